@@ -0,0 +1,53 @@
+# -*- mode: python ; coding: utf-8 -*-
+# Облегченная сборка GUI КС-2 (pyinstaller KS2.spec).
+# Сборка в папку (onedir): при каждом запуске ничего не распаковывается во
+# временный каталог, в отличие от сборок в один файл. Модули обработки
+# загружаются GUI лениво, поэтому перечислены в hiddenimports; библиотеки
+# обработчика документов в это окно не входят и исключены, как и итоги смет
+# (NumPy), которые включаются только в пакетной обработке.
+
+
+a = Analysis(
+    ['pretty_gui.py'],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    hiddenimports=['tkinterdnd2', 'appdirs', 'openpyxl', 'ks2_processor', 'ks2_service',
+                   'ks2_splice', 'ks2_batch', 'fast_save'],
+    hookspath=['.'],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=['docxtpl', 'docx', 'docx2pdf', 'PyPDF2', 'fitz', 'PIL', 'tqdm', 'pythoncom',
+              'pywintypes', 'pandas', 'matplotlib', 'lxml', 'unittest', 'pydoc',
+              'gigachat', 'groq', 'google', 'openai', 'ks2_summary', 'numpy', 'pyarrow'],
+    noarchive=False,
+    optimize=2,
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='KS2',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=False,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='KS2',
+)
@@ -0,0 +1,143 @@
+"""
+Манифест пакетной обработки: какие акты уже собраны из текущих входов.
+
+Для каждого результата хранятся хэши содержимого шаблона и сметы, версия
+обработки, параметры, влияющие на результат, и хэш самого результата.
+Задание пропускается, если ничего из этого не изменилось. Хэши считаются
+потоково; время изменения и размер файла служат быстрой проверкой, поэтому
+для нетронутых файлов чтение содержимого не нужно.
+"""
+import json
+import os
+
+import openpyxl
+
+from ks2_processor import PROCESSOR_VERSION
+from path_manager import PathManager
+from template_cache import file_digest
+
+
+MANIFEST_VERSION = 1
+
+
+def _file_signature(path):
+    """Время изменения и размер файла (None, если файла нет)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class BuildCache:
+    """Манифест собранных актов, ключ записи — абсолютный путь результата"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        # Хэши, уже посчитанные в этом запуске: шаблон общий для многих заданий
+        self._digests = {}
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                # Поврежденный манифест равносилен пустому: все задания выполнятся
+                data = {}
+            if data.get("version") == MANIFEST_VERSION:
+                self.entries = data.get("entries", {})
+
+    def _file_record(self, path, known=None):
+        """
+        Запись о файле: подпись и хэш содержимого.
+        known: прежняя запись; при совпавшей подписи ее хэш используется без чтения файла
+        """
+        path = os.path.abspath(path)
+        signature = _file_signature(path)
+        if signature is None:
+            return None
+        if known is not None and known.get("signature") == signature:
+            return known
+
+        cached = self._digests.get(path)
+        if cached is None or cached["signature"] != signature:
+            cached = self._digests[path] = {"signature": signature, "sha256": file_digest(path)}
+        return cached
+
+    def input_records(self, inputs):
+        """Подписи и хэши входных файлов: словарь роль → запись о файле"""
+        return {role: dict(self._file_record(path), path=os.path.abspath(path))
+                for role, path in inputs.items()}
+
+    def inputs_unchanged(self, known, inputs):
+        """Содержимое входов то же, что в записях known (см. input_records)"""
+        if not known or set(known) != set(inputs):
+            return False
+        for role, path in inputs.items():
+            record = self._file_record(path, known[role])
+            if record is None or record["sha256"] != known[role]["sha256"]:
+                return False
+        return True
+
+    @staticmethod
+    def settings(options):
+        """Все, что кроме входов влияет на результат"""
+        return {
+            "processor": PROCESSOR_VERSION,
+            "openpyxl": openpyxl.__version__,
+            "options": options or {},
+        }
+
+    def is_fresh(self, output, inputs, options=None):
+        """
+        Результат актуален: входы, версия и параметры те же, результат не менялся
+
+        Args:
+            output: путь результата
+            inputs: словарь роль → путь входного файла (template, source)
+            options: параметры обработки, влияющие на результат
+        """
+        entry = self.entries.get(os.path.abspath(output))
+        if entry is None or entry.get("settings") != json.loads(json.dumps(self.settings(options))):
+            return False
+        if not self.inputs_unchanged(entry.get("inputs"), inputs):
+            return False
+
+        # Результат, измененный или удаленный после сборки, собирается заново
+        record = self._file_record(output, entry.get("output"))
+        return record is not None and record["sha256"] == entry["output"]["sha256"]
+
+    def record(self, output, inputs, options=None):
+        """Запоминает успешно собранный результат"""
+        entry = {
+            "settings": self.settings(options),
+            "inputs": self.input_records(inputs),
+            "output": self._file_record(output),
+        }
+        self.entries[os.path.abspath(output)] = entry
+        self.changed = True
+
+    def forget(self, output):
+        """Удаляет запись о результате (например, после ошибки обработки)"""
+        if self.entries.pop(os.path.abspath(output), None) is not None:
+            self.changed = True
+
+    def save(self):
+        """Записывает манифест атомарно (через временный файл)"""
+        if not self.path or not self.changed:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": MANIFEST_VERSION, "entries": self.entries}, f,
+                      ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+
+def default_manifest_path():
+    """Путь манифеста рядом с конфигурацией PathManager"""
+    return PathManager().build_cache_file
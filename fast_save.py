@@ -0,0 +1,370 @@
+"""
+Быстрое сохранение книги КС-2.
+
+Измененные листы пишутся потоком прямо в zip-архив результата (через lxml,
+если он установлен, иначе стандартным сериализатором openpyxl), без
+промежуточного временного файла. Листы шаблона, которые обработка не трогала,
+копируются из архива шаблона байт в байт, поэтому время сохранения зависит
+только от измененного содержимого. Строки измененных листов записываются
+ссылками в таблицу общих строк (shared_strings), которая начинается со
+строк шаблона. Степень сжатия zip настраивается.
+
+К листу можно добавить строки, которых нет в книге (deferred): они
+поступают в запись листа потоком и в памяти книги не хранятся.
+"""
+import datetime
+import posixpath
+from math import isfinite
+from xml.sax.saxutils import escape
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+from openpyxl import LXML
+from openpyxl.cell._writer import write_cell
+from openpyxl.comments.comment_sheet import CommentRecord
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.packaging.relationship import (
+    Relationship, RelationshipList, get_dependents, get_rels_path,
+)
+from openpyxl.reader.workbook import WorkbookParser
+from openpyxl.worksheet._writer import WorksheetWriter
+from openpyxl.worksheet.dimensions import SheetDimension
+from openpyxl.writer.excel import ExcelWriter
+from openpyxl.xml.constants import (
+    ARC_SHARED_STRINGS, ARC_WORKBOOK, ARC_WORKBOOK_RELS, SHARED_STRINGS,
+)
+from openpyxl.xml.functions import Element, SubElement, fromstring, tostring
+
+from shared_strings import SharedStringTable, parse_shared_strings
+
+
+# Степень сжатия по умолчанию совпадает с zlib (и с обычным сохранением openpyxl)
+DEFAULT_COMPRESSLEVEL = 6
+XML_WRITER = "lxml" if LXML else "et_xmlfile"
+PRINTER_SETTINGS = "application/vnd.openxmlformats-officedocument.spreadsheetml.printerSettings"
+
+
+class PackagePart:
+    """Часть архива для манифеста типов содержимого"""
+
+    def __init__(self, path, mime_type):
+        self.path = path
+        self.mime_type = mime_type
+
+
+class PackageArchive(ZipFile):
+    """Архив результата; дополняет связи книги частями, перенесенными из шаблона"""
+
+    def __init__(self, path, compresslevel=DEFAULT_COMPRESSLEVEL):
+        if compresslevel:
+            super().__init__(path, 'w', ZIP_DEFLATED, allowZip64=True, compresslevel=compresslevel)
+        else:
+            super().__init__(path, 'w', ZIP_STORED, allowZip64=True)
+        self.workbook_rels = []
+
+    def writestr(self, zinfo_or_arcname, data, *args, **kwargs):
+        if zinfo_or_arcname == ARC_WORKBOOK_RELS and self.workbook_rels:
+            rels = RelationshipList.from_tree(fromstring(data))
+            for rel in self.workbook_rels:
+                rels.append(rel)
+            data = tostring(rels.to_tree())
+        super().writestr(zinfo_or_arcname, data, *args, **kwargs)
+
+
+class TemplateParts:
+    """Части архива шаблона, которые можно перенести в результат без изменений"""
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.sheets = {}
+        self.shared_strings = None
+
+        try:
+            parser = WorkbookParser(archive, ARC_WORKBOOK)
+            parser.parse()
+        except KeyError:
+            # Нестандартная структура пакета: все листы пишутся заново
+            return
+
+        self.sheets = {sheet.name: rel.target for sheet, rel in parser.find_sheets()}
+        for rel in parser.rels.values():
+            if rel.Type.endswith("/sharedStrings"):
+                self.shared_strings = rel.target
+
+    def sheet_parts(self, title):
+        """
+        Находит часть листа и ее связи в архиве шаблона
+
+        Returns:
+            tuple: (путь листа, связи) или None, если лист нельзя перенести
+        """
+        path = self.sheets.get(title)
+        if path is None or posixpath.dirname(path) != "xl/worksheets":
+            return None
+
+        rels_path = get_rels_path(path)
+        if rels_path not in self.archive.NameToInfo:
+            return path, RelationshipList()
+
+        # Рисунки, примечания, таблицы и т.п. openpyxl нумерует заново —
+        # переносим только листы, связанные разве что с параметрами печати
+        rels = get_dependents(self.archive, rels_path)
+        if any(not rel.Type.endswith("/printerSettings") for rel in rels):
+            return None
+        return path, rels
+
+
+def _cell_xml(cell, styled, strings=None):
+    """
+    XML обычной ячейки (число, строка, формула, пустая со стилем) в том же
+    виде, что пишет openpyxl, а строки — ссылкой в таблицу strings, если
+    она задана; None — ячейку нужно писать стандартным способом
+    """
+    data_type = cell.data_type
+    if data_type not in ("n", "s", "f") or cell.hyperlink is not None:
+        return None
+
+    value = cell._value
+    attrs = f'r="{cell.coordinate}"'
+    if styled:
+        attrs += f' s="{cell.style_id}"'
+    if data_type == "s":
+        attrs += ' t="s"' if strings is not None and value else ' t="inlineStr"'
+    elif data_type == "n":
+        attrs += ' t="n"'
+
+    if value is None or value == "":
+        return f"<c {attrs} />"
+
+    if data_type == "n":
+        if type(value) not in (int, float) or not isfinite(value):
+            return None
+        return f"<c {attrs}><v>{'%.16g' % value}</v></c>"
+
+    if type(value) is not str:
+        return None
+
+    if data_type == "f":
+        if len(value) < 2:
+            return None
+        return f"<c {attrs}><f>{escape(value[1:])}</f><v /></c>"
+
+    if strings is not None:
+        return f"<c {attrs}><v>{strings.add(value)}</v></c>"
+
+    stripped = value.strip()
+    if stripped and stripped != value:
+        return f'<c {attrs}><is><t xml:space="preserve">{escape(value)}</t></is></c>'
+    return f"<c {attrs}><is><t>{escape(value)}</t></is></c>"
+
+
+class FastWorksheetWriter(WorksheetWriter):
+    """
+    Без lxml пишет обычные ячейки готовыми строками, минуя построение
+    элементов; остальные ячейки (даты, примечания, ссылки и т.п.) пишет openpyxl.
+    Строки ячеек записываются ссылками в таблицу strings, если она задана.
+    deferred — строки, добавляемые к строкам листа при записи: объект с
+    методами merge_rows(rows) и dimension() (см. ks2_processor.DeferredTable)
+    """
+
+    def __init__(self, ws, out=None, strings=None, deferred=None):
+        super().__init__(ws, out=out)
+        self.strings = strings
+        self.deferred = deferred
+
+    def rows(self):
+        rows = super().rows()
+        if self.deferred is None:
+            return rows
+        return self.deferred.merge_rows(rows)
+
+    def write_dimensions(self):
+        if self.deferred is None:
+            return super().write_dimensions()
+        self.xf.send(SheetDimension(self.deferred.dimension()).to_tree())
+
+    def write_row(self, xf, row, row_idx):
+        write_raw = getattr(xf, "_file", None)
+        if LXML or write_raw is None:
+            if self.strings is None:
+                return super().write_row(xf, row, row_idx)
+            return self.write_row_elements(xf, row, row_idx)
+
+        attrs = {'r': f"{row_idx}"}
+        attrs.update(self.ws.row_dimensions.get(row_idx, {}))
+
+        with xf.element("row", attrs):
+            chunk = []
+            for cell in row:
+                styled = cell.has_style
+                if cell._comment is None:
+                    if cell._value is None and not styled:
+                        continue
+                    xml = _cell_xml(cell, styled, self.strings)
+                    if xml is not None:
+                        chunk.append(xml)
+                        continue
+
+                if chunk:
+                    write_raw("".join(chunk))
+                    chunk = []
+                if cell._comment is not None:
+                    self.ws._comments.append(CommentRecord.from_cell(cell))
+                write_cell(xf, self.ws, cell, styled)
+
+            if chunk:
+                write_raw("".join(chunk))
+
+    def write_row_elements(self, xf, row, row_idx):
+        """Запись строки элементами (lxml): строки ячеек — ссылками в общую таблицу"""
+        attrs = {'r': f"{row_idx}"}
+        attrs.update(self.ws.row_dimensions.get(row_idx, {}))
+
+        with xf.element("row", attrs):
+            for cell in row:
+                styled = cell.has_style
+                if cell._comment is not None:
+                    self.ws._comments.append(CommentRecord.from_cell(cell))
+                elif cell._value is None and not styled:
+                    continue
+
+                value = cell._value
+                if (cell.data_type == "s" and type(value) is str and value
+                        and cell._comment is None and cell.hyperlink is None):
+                    el = Element("c", {'r': cell.coordinate, 't': "s"})
+                    if styled:
+                        el.set('s', f"{cell.style_id}")
+                    SubElement(el, "v").text = f"{self.strings.add(value)}"
+                    xf.write(el)
+                else:
+                    write_cell(xf, self.ws, cell, styled)
+
+
+class FastExcelWriter(ExcelWriter):
+    """ExcelWriter с потоковой записью листов и переносом нетронутых листов шаблона"""
+
+    def __init__(self, workbook, archive, template_parts=None, modified_sheets=(), deferred=None):
+        super().__init__(workbook, archive)
+        self.template_parts = template_parts
+        self.modified_sheets = set(modified_sheets)
+        self.deferred = deferred or {}
+        self.copied_sheets = []
+        self._copied_parts = set()
+
+        # Строки шаблона сохраняют индексы: на них ссылаются перенесенные листы
+        entries = ()
+        shared_strings = template_parts and template_parts.shared_strings
+        if shared_strings:
+            entries = parse_shared_strings(template_parts.archive.read(shared_strings).decode("utf-8"))
+        self.strings = SharedStringTable(entries) if entries is not None else None
+
+    def write_worksheet(self, ws):
+        if self.workbook.write_only:
+            return super().write_worksheet(ws)
+
+        parts = None
+        if (self.template_parts is not None and ws.title not in self.modified_sheets
+                and ws.title not in self.deferred):
+            parts = self.template_parts.sheet_parts(ws.title)
+
+        if parts is None:
+            self.stream_worksheet(ws)
+        else:
+            self.copy_worksheet(ws, *parts)
+        self.manifest.append(ws)
+
+    def stream_worksheet(self, ws):
+        """Сериализует лист прямо в архив"""
+        ws._drawing = SpreadsheetDrawing()
+        ws._drawing.charts = ws._charts
+        ws._drawing.images = ws._images
+
+        with self._archive.open(ws.path[1:], 'w', force_zip64=True) as out:
+            writer = FastWorksheetWriter(ws, out=out, strings=self.strings,
+                                         deferred=self.deferred.get(ws.title))
+            try:
+                writer.write()
+            except BaseException:
+                # Генератор записи закрывается, пока поток архива еще открыт
+                writer.close()
+                raise
+        ws._rels = writer._rels
+
+    def copy_worksheet(self, ws, source_path, source_rels):
+        """Переносит XML листа и его связи из архива шаблона без изменений"""
+        source = self.template_parts.archive
+        ws._drawing = SpreadsheetDrawing()
+        ws._rels = RelationshipList()
+        ws._hyperlinks = []
+        ws._comments = []
+
+        self._archive.writestr(ws.path[1:], source.read(source_path))
+
+        if source_rels:
+            # Оба листа лежат в xl/worksheets, относительные пути связей остаются верными
+            self._archive.writestr(get_rels_path(ws.path[1:]), source.read(get_rels_path(source_path)))
+            for rel in source_rels:
+                if rel.target in self._copied_parts:
+                    continue
+                self._copied_parts.add(rel.target)
+                self._archive.writestr(rel.target, source.read(rel.target))
+                self.manifest.append(PackagePart("/" + rel.target, PRINTER_SETTINGS))
+
+        self.copied_sheets.append(ws.title)
+
+    def _write_worksheets(self):
+        super()._write_worksheets()
+
+        # Общие строки шаблона (на них ссылаются перенесенные листы) и новые строки.
+        # Если таблицу шаблона разобрать не удалось, новые строки записаны в ячейки
+        shared_strings = self.template_parts and self.template_parts.shared_strings
+        if self.strings is not None and len(self.strings):
+            data = self.strings.to_xml()
+        elif self.strings is None and self.copied_sheets and shared_strings:
+            data = self.template_parts.archive.read(shared_strings)
+        else:
+            data = None
+
+        if data is not None:
+            self._archive.writestr(ARC_SHARED_STRINGS, data)
+            self.manifest.append(PackagePart("/" + ARC_SHARED_STRINGS, SHARED_STRINGS))
+            self._archive.workbook_rels.append(
+                Relationship(type="sharedStrings", Target=posixpath.basename(ARC_SHARED_STRINGS)))
+
+
+def save_workbook_fast(workbook, output_path, template_path=None, modified_sheets=(),
+                       compresslevel=DEFAULT_COMPRESSLEVEL, deferred=None):
+    """
+    Сохраняет книгу быстрым способом
+
+    Args:
+        template_path: файл, из которого загружена книга; его листы, не
+            указанные в modified_sheets, переносятся без повторной сериализации
+        modified_sheets: названия листов, измененных после загрузки
+        compresslevel: степень сжатия zip от 0 (без сжатия) до 9
+        deferred: название листа → строки, дописываемые к листу при записи
+
+    Returns:
+        dict: перенесенные листы, сериализатор XML, степень сжатия и
+            статистика общих строк
+    """
+    if not 0 <= compresslevel <= 9:
+        raise ValueError(f"Степень сжатия должна быть от 0 до 9, получено {compresslevel}")
+
+    template_archive = ZipFile(template_path) if template_path else None
+    try:
+        template_parts = TemplateParts(template_archive) if template_archive else None
+        archive = PackageArchive(output_path, compresslevel)
+        workbook.properties.modified = datetime.datetime.now(
+            tz=datetime.timezone.utc).replace(tzinfo=None)
+        writer = FastExcelWriter(workbook, archive, template_parts, modified_sheets, deferred)
+        writer.save()
+    finally:
+        if template_archive is not None:
+            template_archive.close()
+
+    return {
+        "copied_sheets": writer.copied_sheets,
+        "xml_writer": XML_WRITER,
+        "compresslevel": compresslevel,
+        "strings": writer.strings.stats() if writer.strings is not None else None,
+    }
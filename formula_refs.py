@@ -0,0 +1,189 @@
+import re
+from functools import lru_cache
+
+from openpyxl.formula.tokenizer import Tokenizer, Token
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+
+# Ссылка на лист в начале диапазона: Лист1!A1 или 'Мой лист'!A1
+SHEET_PREFIX_RE = re.compile(r"^(?P<sheet>'(?:[^']|'')+'|[^'!]+)!(?P<ref>.+)$")
+CELL_RE = re.compile(r"^(\$?)([A-Za-z]{1,3})(\$?)([1-9][0-9]{0,6})$")
+ROW_RE = re.compile(r"^(\$?)([1-9][0-9]{0,6})$")
+COL_RE = re.compile(r"^(\$?)([A-Za-z]{1,3})$")
+
+# Формулы без строк в кавычках, имен листов, книг и диапазонов строк вида 5:7:
+# все их адреса находятся регулярным выражением без токенизатора
+PLAIN_FORMULA_RE = re.compile(r"^=[A-Za-z0-9$.,;:+\-*/^&%()<>= ]*$")
+PLAIN_ROW_RANGE_RE = re.compile(r"(?<![A-Za-z0-9$.])\$?[0-9]+:")
+PLAIN_CELL_RE = re.compile(r"(?<![A-Za-z0-9_.$])(\$?[A-Za-z]{1,3}\$?)([1-9][0-9]{0,6})(?![A-Za-z0-9_.(])")
+
+# Разобранные формулы и результаты пересчета кэшируются по тексту формулы:
+# одинаковые формулы подвала разбираются токенизатором один раз
+FORMULA_CACHE_SIZE = 16384
+
+
+def unquote_sheet_name(name):
+    """Убирает кавычки из имени листа в ссылке формулы"""
+    if name.startswith("'") and name.endswith("'"):
+        return name[1:-1].replace("''", "'")
+    return name
+
+
+def _map_part(part, is_range, map_row, map_col):
+    """
+    Пересчитывает одну границу ссылки (A1, $A$1, 5, $C).
+    Возвращает None, если часть не является адресом (например, имя)
+    """
+    match = CELL_RE.match(part)
+    if match:
+        col_abs, col, row_abs, row = match.groups()
+        new_row = map_row(int(row))
+        new_col = map_col(column_index_from_string(col))
+        return f"{col_abs}{get_column_letter(new_col)}{row_abs}{new_row}"
+
+    # Строки (5:7) и столбцы (A:C) встречаются только в диапазонах
+    if is_range:
+        match = ROW_RE.match(part)
+        if match:
+            row_abs, row = match.groups()
+            return f"{row_abs}{map_row(int(row))}"
+
+        match = COL_RE.match(part)
+        if match:
+            col_abs, col = match.groups()
+            return f"{col_abs}{get_column_letter(map_col(column_index_from_string(col)))}"
+
+    return None
+
+
+def _split_reference(reference, sheet_title, external=False):
+    """
+    Отделяет имя листа от адреса ссылки.
+    external: формула находится на другом листе или в имени книги, поэтому
+    ссылки без имени листа к листу sheet_title не относятся
+
+    Returns:
+        tuple: (префикс 'Лист!' или '', адрес) или None для ссылки на другой лист
+    """
+    match = SHEET_PREFIX_RE.match(reference)
+    if not match:
+        return None if external else ("", reference)
+    if unquote_sheet_name(match.group("sheet")) != sheet_title:
+        return None
+    return match.group("sheet") + "!", match.group("ref")
+
+
+def map_reference(reference, sheet_title, map_row, map_col, external=False):
+    """
+    Пересчитывает ссылку вида [Лист!]A1[:B2] с помощью функций map_row/map_col.
+    Ссылки на другие листы и именованные диапазоны не изменяются
+    """
+    split = _split_reference(reference, sheet_title, external)
+    if split is None:
+        return reference
+    prefix, ref = split
+
+    parts = ref.split(":")
+    if len(parts) > 2:
+        return reference
+
+    mapped = []
+    for part in parts:
+        new_part = _map_part(part, len(parts) == 2, map_row, map_col)
+        if new_part is None:
+            return reference
+        mapped.append(new_part)
+
+    return prefix + ":".join(mapped)
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def parse_formula(formula):
+    """
+    Разбирает формулу токенизатором openpyxl
+
+    Returns:
+        tuple: пары (текст токена, является ли он ссылкой) или None,
+            если это не формула
+    """
+    tokens = Tokenizer(formula).items
+    if not tokens or tokens[0].type == Token.LITERAL:
+        return None
+    return tuple((token.value, token.type == Token.OPERAND and token.subtype == Token.RANGE)
+                 for token in tokens)
+
+
+def rewrite_references(formula, map_ref):
+    """Заменяет каждую ссылку формулы результатом map_ref(ссылка)"""
+    tokens = parse_formula(formula)
+    if tokens is None:
+        return formula
+    return "=" + "".join(map_ref(value) if is_range else value for value, is_range in tokens)
+
+
+def rewrite_formula(formula, sheet_title, map_row, map_col, external=False):
+    """Пересчитывает все ссылки на лист sheet_title внутри формулы"""
+    return rewrite_references(
+        formula, lambda ref: map_reference(ref, sheet_title, map_row, map_col, external))
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def shift_formula_rows(formula, sheet_title, start_row, rows_to_insert, external=False):
+    """
+    Пересчитывает формулу после вставки rows_to_insert строк перед start_row.
+    Как и в Excel, сдвигаются и относительные, и абсолютные ссылки
+    """
+    def map_row(row):
+        return row + rows_to_insert if row >= start_row else row
+
+    def map_col(col):
+        return col
+
+    return rewrite_formula(formula, sheet_title, map_row, map_col, external)
+
+
+def move_reference(reference, sheet_title, bounds, columns, external=False):
+    """
+    Пересчитывает ссылку после переноса блока ячеек bounds
+    (min_row, min_col, max_row, max_col) на columns столбцов влево.
+    Как при вырезании и вставке в Excel, меняются только ссылки, целиком
+    лежащие внутри блока; остальные указывают на прежние ячейки
+    """
+    split = _split_reference(reference, sheet_title, external)
+    if split is None:
+        return reference
+    prefix, ref = split
+
+    min_row, min_col, max_row, max_col = bounds
+    parts = []
+    for part in ref.split(":"):
+        match = CELL_RE.match(part)
+        if match is None:
+            return reference
+        col_abs, col, row_abs, row = match.groups()
+        col = column_index_from_string(col)
+        # Ячейки, ушедшие за первый столбец, не переносятся
+        if not (min_row <= int(row) <= max_row and min_col <= col <= max_col) or col <= columns:
+            return reference
+        parts.append(f"{col_abs}{get_column_letter(col - columns)}{row_abs}{row}")
+    return prefix + ":".join(parts)
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def move_formula_block(formula, sheet_title, bounds, columns, external=False):
+    """Пересчитывает формулу после переноса блока bounds на columns столбцов влево"""
+    return rewrite_references(
+        formula, lambda ref: move_reference(ref, sheet_title, bounds, columns, external))
+
+
+def offset_formula_rows(formula, sheet_title, rows):
+    """
+    Сдвигает на rows строк все ссылки формулы на лист sheet_title (и ссылки
+    без имени листа) — формулы таблицы сметы, вставляемой в акт ниже своего
+    места. Формулы сметы обычно различаются только номерами строк, кэш по
+    тексту им не помогает, поэтому простые формулы (=E7*F7) пересчитываются
+    регулярным выражением, остальные — как в shift_formula_rows
+    """
+    if PLAIN_FORMULA_RE.match(formula) and not PLAIN_ROW_RANGE_RE.search(formula):
+        return PLAIN_CELL_RE.sub(lambda m: f"{m.group(1).upper()}{int(m.group(2)) + rows}", formula)
+    return shift_formula_rows(formula, sheet_title, 1, rows)
@@ -0,0 +1,397 @@
+"""
+Пакетная обработка актов КС-2 из командной строки.
+
+Примеры:
+    python ks2_batch.py --manifest jobs.csv --workers 4
+    python ks2_batch.py --template КС-2.xlsx --sources "сметы/*.xlsx" --output-dir акты
+    python ks2_batch.py --manifest jobs.csv --force
+    python ks2_batch.py --manifest jobs.csv --dry-run
+
+Акты, входы и параметры которых не изменились с прошлого запуска, не
+собираются заново (см. build_cache); журнал --state при возобновлении
+после сбоя тоже пропускает только задания с прежними входами и
+параметрами. --force собирает все акты заново.
+--dry-run только проверяет файлы заданий и печатает план вставки без
+загрузки книг (см. ks2_preflight).
+
+Манифест — CSV с колонками template, source, output или JSON-список
+объектов с теми же ключами. Модуль не импортирует tkinter.
+"""
+import argparse
+import csv
+import glob
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ks2_splice import ENGINES
+from ks2_processor import import_summary
+from path_manager import apply_profile
+from build_cache import BuildCache, default_manifest_path
+from template_cache import TemplateCache
+from ks2_events import TextListener, JsonLinesListener
+from ks2_preflight import PreflightError, preflight, plan_summary
+from ks2_profile import add_profile_arguments, profile_options
+from fast_save import DEFAULT_COMPRESSLEVEL
+
+
+JOB_FIELDS = ("template", "source", "output")
+LOG_TAIL_LINES = 20
+
+# Кэш шаблонов рабочего процесса: задания одного процесса используют его повторно
+_template_cache = None
+_metrics_path = None
+_save_options = {}
+_processor_class = ENGINES["openpyxl"]
+
+
+def init_worker(use_template_cache=True, template_cache_dir=None, metrics_path=None,
+                save_options=None, engine="openpyxl"):
+    """Инициализирует рабочий процесс пула"""
+    global _template_cache, _metrics_path, _save_options, _processor_class
+    _template_cache = TemplateCache(disk_dir=template_cache_dir) if use_template_cache else None
+    _metrics_path = metrics_path
+    _save_options = save_options or {}
+    _processor_class = ENGINES[engine]
+
+
+def make_processor(job, listeners, cancel_event=None):
+    """Процессор задания с настройками рабочего процесса (кэш шаблонов, сохранение, движок)"""
+    listeners = list(listeners)
+    if _metrics_path:
+        listeners.append(JsonLinesListener(_metrics_path))
+    return _processor_class(job["template"], job["source"], job["output"],
+                            template_cache=_template_cache, listeners=listeners,
+                            cancel_event=cancel_event, **_save_options)
+
+
+def load_manifest(path):
+    """
+    Читает список заданий из CSV или JSON
+
+    Returns:
+        list: словари с ключами template, source, output
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+
+    if path.lower().endswith(".json"):
+        with open(path, 'r', encoding='utf-8') as f:
+            rows = json.load(f)
+    else:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.DictReader(f))
+
+    jobs = []
+    for number, row in enumerate(rows, start=1):
+        missing = [field for field in JOB_FIELDS if not row.get(field)]
+        if missing:
+            raise ValueError(f"Задание {number} в манифесте: нет полей {', '.join(missing)}")
+        # Относительные пути считаются от папки манифеста
+        jobs.append({field: os.path.join(base_dir, row[field].strip()) for field in JOB_FIELDS})
+    return jobs
+
+
+def jobs_from_glob(template, pattern, output_dir):
+    """Строит задания для всех смет, подходящих под шаблон имени"""
+    jobs = []
+    for source in sorted(glob.glob(pattern)):
+        name = os.path.splitext(os.path.basename(source))[0]
+        jobs.append({
+            "template": template,
+            "source": source,
+            "output": os.path.join(output_dir, f"{name}_КС-2.xlsx"),
+        })
+    return jobs
+
+
+def job_key(job):
+    """Ключ задания для журнала возобновления"""
+    return "|".join(os.path.abspath(job[field]) for field in JOB_FIELDS)
+
+
+def run_job(job):
+    """
+    Выполняет одно задание в рабочем процессе.
+    Журнал процессора собирается и возвращается в результате
+    """
+    log = io.StringIO()
+    started = time.perf_counter()
+    result = dict(job, status="ok", error=None)
+
+    try:
+        output_dir = os.path.dirname(os.path.abspath(job["output"]))
+        os.makedirs(output_dir, exist_ok=True)
+        listeners = [TextListener(write=lambda message: print(message, file=log))]
+        make_processor(job, listeners).process()
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+
+    result["elapsed"] = round(time.perf_counter() - started, 3)
+    result["log"] = log.getvalue().splitlines()[-LOG_TAIL_LINES:]
+    return result
+
+
+class BatchState:
+    """
+    Журнал выполненных заданий (JSON Lines) для возобновления после сбоя.
+    Вместе с успешным заданием записываются хэши его входов, версия обработки
+    и параметры: задание, у которого что-то из этого изменилось, выполняется снова
+    """
+
+    def __init__(self, path, build_cache=None):
+        """build_cache: манифест сборки, чьи хэши файлов используются (иначе — свой, без файла)"""
+        self.path = path
+        self.done = {}
+        self.files = build_cache if build_cache is not None else BuildCache(None)
+
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Последняя строка могла быть записана не полностью
+                        continue
+                    if record.get("status") == "ok":
+                        self.done[job_key(record)] = record
+
+    def is_done(self, job, options=None):
+        """Задание выполнено ранее с теми же входами и параметрами, и его результат на месте"""
+        record = self.done.get(job_key(job))
+        if record is None or not os.path.exists(job["output"]):
+            return False
+        # Версия обработки и параметры — как в манифесте сборки
+        if record.get("settings") != json.loads(json.dumps(BuildCache.settings(options))):
+            return False
+        return self.files.inputs_unchanged(record.get("inputs"), job_inputs(job))
+
+    def record(self, result, options=None):
+        """
+        Дописывает результат задания в журнал.
+        options: параметры обработки (см. build_options); с ними успешное
+        задание записывается вместе с хэшами входов для is_done
+        """
+        if not self.path:
+            return
+        record = {k: v for k, v in result.items() if k != "log"}
+        if options is not None and result["status"] == "ok":
+            record.update(inputs=self.files.input_records(job_inputs(result)),
+                          settings=BuildCache.settings(options))
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def job_inputs(job):
+    """Входные файлы задания для манифеста сборки"""
+    return {"template": job["template"], "source": job["source"]}
+
+
+# Параметры обработки, не влияющие на содержимое результата
+RUN_OPTIONS = ("memory_budget", "profile_report", "profile_allocations")
+
+
+def build_options(engine, save_options):
+    """Параметры, от которых зависит содержимое результата (бюджет памяти и профилирование на него не влияют)"""
+    return {"engine": engine, **{key: value for key, value in (save_options or {}).items()
+                                 if key not in RUN_OPTIONS}}
+
+
+def load_summary(path):
+    """Настройки итогов сметы из файла JSON (None — итоги выключены)"""
+    if not path:
+        return None
+    return import_summary().load_summary_config(path)
+
+
+def run_batch(jobs, workers=None, state_path=None, report_path=None,
+              use_template_cache=True, template_cache_dir=None, metrics_path=None,
+              save_options=None, engine="openpyxl", build_cache_path=None, force=False):
+    """
+    Выполняет задания в пуле процессов
+
+    Args:
+        build_cache_path: манифест сборки; задания с неизменными входами пропускаются
+        force: выполнить все задания, даже выполненные по журналу и актуальные по манифесту
+
+    Returns:
+        dict: сводный отчет
+    """
+    build_cache = BuildCache(build_cache_path) if build_cache_path else None
+    state = BatchState(state_path, build_cache)
+    options = build_options(engine, save_options)
+
+    pending = list(jobs) if force else [job for job in jobs if not state.is_done(job, options)]
+    up_to_date = 0
+    if build_cache is not None and not force:
+        fresh = [job for job in pending if build_cache.is_fresh(job["output"], job_inputs(job), options)]
+        up_to_date = len(fresh)
+        pending = [job for job in pending if job not in fresh]
+    skipped = len(jobs) - len(pending)
+
+    print(f"📦 Заданий: {len(jobs)}, к выполнению: {len(pending)}, пропущено: {skipped}"
+          + (f" (без изменений: {up_to_date})" if up_to_date else ""))
+
+    started = time.perf_counter()
+    results = []
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_worker,
+                                 initargs=(use_template_cache, template_cache_dir,
+                                           metrics_path, save_options, engine)) as executor:
+            futures = {executor.submit(run_job, job): job for job in pending}
+            try:
+                for number, future in enumerate(as_completed(futures), start=1):
+                    result = future.result()
+                    results.append(result)
+                    state.record(result, options)
+                    if build_cache is not None:
+                        if result["status"] == "ok":
+                            build_cache.record(result["output"], job_inputs(result), options)
+                        else:
+                            build_cache.forget(result["output"])
+
+                    name = os.path.basename(result["source"])
+                    if result["status"] == "ok":
+                        print(f"  [{number}/{len(pending)}] ✅ {name} ({result['elapsed']} с)")
+                    else:
+                        print(f"  [{number}/{len(pending)}] ❌ {name}: {result['error']}")
+            finally:
+                if build_cache is not None:
+                    build_cache.save()
+
+    failed = [r for r in results if r["status"] != "ok"]
+    report = {
+        "total": len(jobs),
+        "processed": len(results),
+        "succeeded": len(results) - len(failed),
+        "failed": len(failed),
+        "skipped": skipped,
+        "up_to_date": up_to_date,
+        "elapsed": round(time.perf_counter() - started, 3),
+        "jobs": results,
+    }
+
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+
+    print(f"\n🎉 Готово: успешно {report['succeeded']}, ошибок {report['failed']}, "
+          f"пропущено {skipped}, {report['elapsed']} с")
+    return report
+
+
+def plan_jobs(jobs):
+    """
+    Проверяет файлы заданий и печатает план вставки, ничего не обрабатывая
+
+    Returns:
+        int: число заданий с ошибками
+    """
+    print(f"📝 План пакетной обработки: {len(jobs)} заданий")
+    failed = 0
+    for number, job in enumerate(jobs, start=1):
+        name = os.path.basename(job["source"])
+        try:
+            # Папку результата пакетная обработка создает сама
+            plan = preflight(job["template"], job["source"], job["output"], makedirs=True)
+        except PreflightError as e:
+            failed += 1
+            print(f"  [{number}/{len(jobs)}] ❌ {name}: {e}")
+            continue
+        print(f"  [{number}/{len(jobs)}] ✅ {name} → {os.path.basename(job['output'])}: "
+              f"{plan_summary(plan)}")
+    print(f"\n{'❌' if failed else '✅'} Ошибок: {failed} из {len(jobs)}")
+    return failed
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Пакетная вставка проектных смет в шаблоны КС-2")
+    parser.add_argument("--manifest", help="CSV или JSON со столбцами template, source, output")
+    parser.add_argument("--template", help="шаблон КС-2 для режима --sources")
+    parser.add_argument("--sources", help="шаблон имен смет, например 'сметы/*.xlsx'")
+    parser.add_argument("--output-dir", help="папка результатов для режима --sources")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="число рабочих процессов (по умолчанию — число ядер)")
+    parser.add_argument("--no-template-cache", action="store_true",
+                        help="загружать шаблон заново для каждого задания")
+    parser.add_argument("--template-cache-dir",
+                        help="папка для сохранения разобранных шаблонов на диск")
+    parser.add_argument("--no-fast-save", action="store_true",
+                        help="сохранять обычным способом openpyxl")
+    parser.add_argument("--compresslevel", type=int, default=DEFAULT_COMPRESSLEVEL,
+                        choices=range(10), metavar="0-9",
+                        help="степень сжатия результата (0 — без сжатия)")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="openpyxl",
+                        help="способ обработки: openpyxl или прямая вставка XML (splice)")
+    parser.add_argument("--memory-budget", type=int, metavar="МБ",
+                        help="бюджет памяти на задание: смета вписывается в акт потоком частями")
+    parser.add_argument("--summary", metavar="JSON",
+                        help="настройки итогов сметы: суммы и проверки после вставки (нужен numpy)")
+    parser.add_argument("--metrics",
+                        help="файл метрик этапов в формате JSON Lines")
+    add_profile_arguments(parser)
+    parser.add_argument("--state", default="ks2_batch_state.jsonl",
+                        help="журнал выполненных заданий для возобновления")
+    parser.add_argument("--report", default="ks2_batch_report.json",
+                        help="файл сводного отчета")
+    parser.add_argument("--build-cache",
+                        help="манифест сборки (по умолчанию рядом с настройками программы)")
+    parser.add_argument("--no-build-cache", action="store_true",
+                        help="не вести манифест сборки")
+    parser.add_argument("--force", action="store_true",
+                        help="собрать все акты заново, даже если входы не менялись")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="только проверить файлы и показать план вставки")
+    parser.add_argument("--profile",
+                        help="профиль настроек (path_manager): шаблон, папка, процессы, движок по умолчанию")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = apply_profile(parser, parser.parse_args(argv), argv)
+
+    if args.manifest:
+        jobs = load_manifest(args.manifest)
+    elif args.template and args.sources and args.output_dir:
+        jobs = jobs_from_glob(args.template, args.sources, args.output_dir)
+    else:
+        parser.error("укажите --manifest или --template, --sources и --output-dir")
+
+    if args.dry_run:
+        return 1 if plan_jobs(jobs) else 0
+    try:
+        summary = load_summary(args.summary)
+    except (OSError, ValueError, RuntimeError) as e:
+        parser.error(str(e))
+
+    report = run_batch(jobs, workers=args.workers,
+                       state_path=args.state, report_path=args.report,
+                       use_template_cache=not args.no_template_cache,
+                       template_cache_dir=args.template_cache_dir,
+                       metrics_path=args.metrics,
+                       save_options={"fast_save": not args.no_fast_save,
+                                     "compresslevel": args.compresslevel,
+                                     "memory_budget": args.memory_budget,
+                                     "summary": summary,
+                                     **profile_options(args)},
+                       engine=args.engine,
+                       build_cache_path=None if args.no_build_cache
+                       else args.build_cache or default_manifest_path(),
+                       force=args.force)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+"""
+Замер производительности KS2Processor на синтетических шаблонах и сметах.
+
+Примеры:
+    python ks2_benchmark.py --sizes 100 1000 10000 --output bench_baseline.json
+    python ks2_benchmark.py --compare bench_baseline.json --threshold 0.2
+    python ks2_benchmark.py --sizes 100000 --memory-budget 256 --verify
+    python ks2_benchmark.py --sizes 100000 --copy-workers 4 --verify
+
+Для каждого размера сметы генерируется шаблон с листом 'КС-2 ...'
+(шапка G1:H18 и E12:F18, подвал ниже 20-й строки) и смета с разнообразными
+стилями и объединенными ячейками. Каждый прогон идет в отдельном процессе,
+чтобы пиковая память не зависела от предыдущих прогонов. С --verify
+результат каждого размера сравнивается с результатом обычного режима
+(тот же движок и параметры сохранения, но без бюджета памяти и процессов
+чтения), и для обоих сообщается пиковый RSS.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import ZipFile
+
+import openpyxl
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.worksheet.cell_range import CellRange
+
+from ks2_events import PHASES
+from ks2_profile import add_profile_arguments, profile_options
+from fast_save import DEFAULT_COMPRESSLEVEL
+from ks2_splice import ENGINES
+from memory_budget import peak_rss_mb
+
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+ESTIMATE_COLUMNS = 12
+FOOTER_ROWS = 300
+UNITS = ("м2", "м3", "шт", "т", "м", "компл")
+# Параметры, которые не должны менять результат: --verify собирает эталон без них
+REFERENCE_EXCLUDED = ("memory_budget", "copy_workers", "profile_report", "profile_allocations")
+
+
+def _style_pool(seed):
+    """Набор сочетаний стилей, похожий на реальные сметы"""
+    rnd = random.Random(seed)
+    thin = Side(style="thin")
+    fonts = [Font(name=name, size=size, bold=bold)
+             for name in ("Arial", "Times New Roman") for size in (8, 9, 10) for bold in (False, True)]
+    borders = [Border(), Border(left=thin, right=thin, top=thin, bottom=thin), Border(bottom=thin)]
+    fills = [PatternFill(), PatternFill("solid", start_color="FFF2CC"), PatternFill("solid", start_color="DDEBF7")]
+    formats = ["General", "0.00", "#,##0.00", "0.000", "@"]
+    alignments = [Alignment(), Alignment(wrap_text=True, vertical="top"), Alignment(horizontal="center")]
+    return [(rnd.choice(fonts), rnd.choice(borders), rnd.choice(fills),
+             rnd.choice(formats), rnd.choice(alignments)) for _ in range(60)]
+
+
+def make_template(path, footer_rows=FOOTER_ROWS, seed=1):
+    """Создает синтетический шаблон КС-2"""
+    rnd = random.Random(seed)
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "КС-2 синтетический"
+    wb.create_sheet("Справка")
+    styles = _style_pool(seed)
+
+    # Шапка: реквизиты справа (G1:H18) и блок E12:F18
+    for row in range(1, 19):
+        for col in (7, 8):
+            ws.cell(row=row, column=col, value=f"Реквизит {row}.{col}").font = Font(bold=col == 7)
+    for row in range(12, 19):
+        for col in (5, 6):
+            ws.cell(row=row, column=col, value=f"Поле {row}.{col}").border = Border(bottom=Side(style="thin"))
+    # Заголовок таблицы объединен вне областей, сдвигаемых влево
+    ws["A19"] = "АКТ О ПРИЕМКЕ ВЫПОЛНЕННЫХ РАБОТ"
+    ws.merge_cells("A19:D19")
+
+    # Подвал: итоги и подписи ниже 20-й строки
+    for row in range(20, 20 + footer_rows):
+        for col in range(1, 11):
+            if rnd.random() < 0.4:
+                cell = ws.cell(row=row, column=col, value=f"Подвал {row}")
+                font, border, fill, fmt, alignment = rnd.choice(styles)
+                cell.font, cell.border, cell.fill = font, border, fill
+        if row % 25 == 0:
+            ws.merge_cells(start_row=row, start_column=1, end_row=row, end_column=4)
+    ws.cell(row=20 + footer_rows, column=10, value=f"=SUM(J20:J{19 + footer_rows})")
+    wb.save(path)
+
+
+def make_estimate(path, rows, seed=2):
+    """Создает синтетическую смету потоковой записью"""
+    rnd = random.Random(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Смета")
+    styles = _style_pool(seed)
+
+    for row in range(1, rows + 1):
+        values = [row, f"ФЕР{rnd.randint(1, 47):02d}-{rnd.randint(1, 999):03d}",
+                  f"Работа №{rnd.randint(1, 500)}", rnd.choice(UNITS),
+                  round(rnd.uniform(0.1, 1000), 3), round(rnd.uniform(1, 50000), 2)]
+        values += [round(rnd.uniform(0, 1e5), 2) for _ in range(ESTIMATE_COLUMNS - len(values))]
+
+        cells = []
+        for value in values:
+            cell = WriteOnlyCell(ws, value=value)
+            font, border, fill, fmt, alignment = rnd.choice(styles)
+            cell.font, cell.border, cell.fill = font, border, fill
+            cell.number_format, cell.alignment = fmt, alignment
+            cells.append(cell)
+        ws.append(cells)
+
+        # Заголовки разделов объединены на всю ширину
+        if row % 50 == 1:
+            ws.merged_cells.add(CellRange(min_col=2, min_row=row, max_col=4, max_row=row))
+    wb.save(path)
+
+
+def prepare_inputs(workdir, rows):
+    """Создает (или берет уже созданные) входные файлы для размера rows"""
+    template = os.path.join(workdir, "template.xlsx")
+    estimate = os.path.join(workdir, f"estimate_{rows}.xlsx")
+    if not os.path.exists(template):
+        make_template(template)
+    if not os.path.exists(estimate):
+        make_estimate(estimate, rows)
+    return template, estimate
+
+
+def run_case(template, estimate, output, trace_memory=False, save_options=None, engine="openpyxl"):
+    """Один прогон обработки; выполняется в отдельном процессе"""
+    if trace_memory:
+        tracemalloc.start()
+
+    processor = ENGINES[engine](template, estimate, output, listeners=[], **(save_options or {}))
+    started = time.perf_counter()
+    processor.process()
+    total = time.perf_counter() - started
+
+    result = {phase: round(processor.stats["timings"].get(phase, 0), 4) for phase in PHASES}
+    result["total"] = round(total, 4)
+    result["peak_rss_mb"] = peak_rss_mb()
+    if trace_memory:
+        result["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+    result["cells_copied"] = processor.stats["cells_copied"]
+    return result
+
+
+def compare_outputs(path, reference):
+    """
+    Части архивов результата, содержимое которых различается
+    (время изменения книги в docProps/core.xml не сравнивается)
+    """
+    with ZipFile(path) as archive, ZipFile(reference) as expected:
+        names = set(archive.NameToInfo) | set(expected.NameToInfo)
+        return sorted(name for name in names if name != "docProps/core.xml" and (
+            name not in archive.NameToInfo or name not in expected.NameToInfo
+            or archive.read(name) != expected.read(name)))
+
+
+def run_benchmark(sizes, workdir, repeat=3, trace_memory=False, save_options=None, engine="openpyxl",
+                  verify=False):
+    """
+    Прогоняет все размеры; для времени берется минимум по повторам.
+    verify: сравнить результат с результатом обычного режима — тот же движок и
+    параметры сохранения, но без REFERENCE_EXCLUDED (бюджета памяти, рабочих
+    процессов чтения, профилирования)
+    """
+    context = multiprocessing.get_context("spawn")
+    results = {}
+
+    for rows in sizes:
+        template, estimate = prepare_inputs(workdir, rows)
+        output = os.path.join(workdir, f"output_{rows}.xlsx")
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(run_case, template, estimate, output, trace_memory,
+                                            save_options, engine).result())
+
+        best = {key: min(run[key] for run in runs) for key in runs[0]
+                if all(isinstance(run[key], (int, float)) for run in runs)}
+        results[str(rows)] = best
+        print(f"  {rows:>7} строк: {best['total']:.3f} с, "
+              + ", ".join(f"{phase} {best[phase]:.3f}" for phase in PHASES)
+              + (f", RSS {best['peak_rss_mb']} МБ" if "peak_rss_mb" in best else ""))
+
+        if verify:
+            reference = os.path.join(workdir, f"output_{rows}_reference.xlsx")
+            options = {key: value for key, value in (save_options or {}).items() if key not in REFERENCE_EXCLUDED}
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                expected = executor.submit(run_case, template, estimate, reference, False, options,
+                                           engine).result()
+            differences = compare_outputs(output, reference)
+            best.update(identical=not differences, reference_peak_rss_mb=expected["peak_rss_mb"])
+            if differences:
+                print(f"          ❌ результат отличается от обычного режима: {', '.join(differences)}")
+            else:
+                print(f"          ✅ результат совпадает с обычным режимом "
+                      f"(RSS обычного режима {expected['peak_rss_mb']} МБ)")
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "openpyxl": openpyxl.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "save_options": save_options or {},
+            "engine": engine,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare_results(baseline, current, threshold):
+    """
+    Сравнивает результаты с базовыми
+
+    Returns:
+        list: строки с описанием регрессий
+    """
+    regressions = []
+    metrics = PHASES + ("total", "peak_rss_mb")
+    for size, base in baseline["results"].items():
+        now = current["results"].get(size)
+        if now is None:
+            continue
+        for metric in metrics:
+            old, new = base.get(metric), now.get(metric)
+            # Очень короткие этапы слишком шумные для сравнения
+            if not old or new is None or (metric in PHASES and old < 0.01):
+                continue
+            change = (new - old) / old
+            if change > threshold:
+                regressions.append(f"{size} строк, {metric}: {old} → {new} (+{change:.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк обработки КС-2")
+    parser.add_argument("--sizes", type=int, nargs="+", help="размеры смет в строках")
+    parser.add_argument("--repeat", type=int, default=3, help="число повторов на размер")
+    parser.add_argument("--workdir", help="папка для сгенерированных файлов")
+    parser.add_argument("--output", default="bench_results.json", help="файл результатов")
+    parser.add_argument("--compare", help="файл базовых результатов для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="допустимое относительное ухудшение (0.2 = 20%%)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="дополнительно измерять пик памяти через tracemalloc")
+    parser.add_argument("--no-fast-save", action="store_true",
+                        help="сохранять обычным способом openpyxl")
+    parser.add_argument("--compresslevel", type=int, default=DEFAULT_COMPRESSLEVEL,
+                        choices=range(10), metavar="0-9", help="степень сжатия результата")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="openpyxl",
+                        help="способ обработки: openpyxl или прямая вставка XML (splice)")
+    parser.add_argument("--memory-budget", type=int, metavar="МБ",
+                        help="бюджет памяти: смета вписывается в акт потоком частями")
+    parser.add_argument("--copy-workers", type=int, metavar="N",
+                        help="процессов чтения сметы при вставке (parallel_copy)")
+    add_profile_arguments(parser)
+    parser.add_argument("--verify", action="store_true",
+                        help="сравнить результаты с обычным режимом и его пиковым RSS")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    sizes = args.sizes
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        sizes = sizes or [int(size) for size in baseline["results"]]
+    sizes = sizes or list(DEFAULT_SIZES)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ks2_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    print(f"📊 Бенчмарк КС-2 ({args.engine}): размеры {sizes}, повторов {args.repeat}, папка {workdir}")
+    save_options = {"fast_save": not args.no_fast_save, "compresslevel": args.compresslevel}
+    if args.memory_budget:
+        save_options["memory_budget"] = args.memory_budget
+    if args.copy_workers:
+        save_options["copy_workers"] = args.copy_workers
+    if args.profile_report or args.profile_dir or args.profile_allocations:
+        save_options.update(profile_options(args))
+    current = run_benchmark(sizes, workdir, repeat=args.repeat, trace_memory=args.trace_memory,
+                            save_options=save_options, engine=args.engine, verify=args.verify)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(current, f, ensure_ascii=False, indent=4)
+    print(f"💾 Результаты сохранены: {args.output}")
+
+    mismatched = [size for size, result in current["results"].items() if result.get("identical") is False]
+    if mismatched:
+        print(f"\n❌ Результат отличается от обычного режима для размеров: {', '.join(mismatched)}")
+        return 1
+
+    if baseline is not None:
+        regressions = compare_results(baseline, current, args.threshold)
+        if regressions:
+            print(f"\n❌ Регрессии больше {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\n✅ Регрессий больше {args.threshold:.0%} нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+Сборка акта КС-2 из нескольких смет за один цикл загрузки и сохранения.
+
+Примеры:
+    python ks2_compose.py --template КС-2.xlsx --output акт.xlsx смета1.xlsx смета2.xlsx
+    python ks2_compose.py --template КС-2.xlsx --output акт.xlsx "смета.xlsx:Локальная 2" \\
+        --targets "КС-2 (1)" "КС-2 (2)"
+    python ks2_compose.py --template КС-2.xlsx --output акт.xlsx раздел*.xlsx --copy-workers 4
+
+Вместо нескольких запусков KS2Processor подряд (каждый из которых заново
+загружает и сохраняет растущий результат) смещения всех таблиц считаются
+заранее: лист шаблона сдвигается один раз на суммарное число строк, таблицы
+вставляются друг под другом, книга сохраняется один раз.
+
+С --copy-workers N большие сметы разбираются при вставке N процессами
+(см. parallel_copy); результат тот же, что без этого параметра.
+"""
+import argparse
+import sys
+
+from ks2_processor import KS2Processor
+from source_reader import open_source_workbook
+from style_transfer import StyleTransfer
+from ks2_events import SHEETS_FOUND, INSERT_START, CELLS_COPIED, INSERT_PROGRESS
+from ks2_profile import add_profile_arguments, profile_options
+
+
+START_ROW = 20
+# Параметры KS2Processor, которые сборка не поддерживает: таблицы вставляются
+# в листы целиком, итоги считаются по одной смете
+UNSUPPORTED_OPTIONS = {"memory_budget": "бюджет памяти", "summary": "итоги сметы"}
+
+
+def normalize_inputs(inputs, target_sheets=None):
+    """
+    Приводит входы к списку (смета, лист, лист шаблона).
+
+    Args:
+        inputs: пути смет или кортежи (смета, лист[, лист шаблона]);
+            лист None — активный лист сметы
+        target_sheets: листы шаблона для каждого входа по порядку или один
+            лист для всех; None — первый лист 'КС-2'
+
+    Returns:
+        list: кортежи (смета, лист или None, лист шаблона или None)
+    """
+    items = []
+    for item in inputs:
+        if isinstance(item, str):
+            item = (item,)
+        item = tuple(item)
+        if not 1 <= len(item) <= 3:
+            raise ValueError(f"Неверное описание сметы: {item!r}")
+        items.append(item + (None,) * (3 - len(item)))
+
+    if not items:
+        raise ValueError("Не указано ни одной сметы")
+
+    if target_sheets:
+        targets = list(target_sheets)
+        if len(targets) == 1:
+            targets *= len(items)
+        if len(targets) != len(items):
+            raise ValueError(f"Листов шаблона {len(targets)}, а смет {len(items)}")
+        items = [(source, sheet, target or default)
+                 for (source, sheet, target), default in zip(items, targets)]
+    return items
+
+
+class KS2CompositeProcessor(KS2Processor):
+    """
+    Вставка нескольких смет (или нескольких листов одной сметы) в шаблон КС-2.
+    Таблицы одного листа шаблона идут подряд в порядке входов
+    """
+
+    def __init__(self, template_path, inputs, output_path, target_sheets=None, **kwargs):
+        """
+        Args:
+            inputs, target_sheets: см. normalize_inputs
+            остальные аргументы — как у KS2Processor, кроме memory_budget и summary
+        """
+        for option, name in UNSUPPORTED_OPTIONS.items():
+            if kwargs.get(option):
+                raise ValueError(f"Сборка из нескольких смет не поддерживает {name} ({option})")
+        self.inputs = normalize_inputs(inputs, target_sheets)
+        super().__init__(template_path, [source for source, _, _ in self.inputs], output_path, **kwargs)
+
+    def find_target_sheet(self, workbook, name):
+        """Лист шаблона по имени или первый лист 'КС-2'"""
+        if name is None:
+            return self.find_ks2_sheet(workbook)
+        if name not in workbook.sheetnames:
+            raise ValueError(f"Не найден лист шаблона '{name}'")
+        return workbook[name]
+
+    def find_source_sheet(self, workbook, name, source):
+        """Лист сметы по имени или активный лист"""
+        if name is None:
+            return workbook.active
+        if name not in workbook.sheetnames:
+            raise ValueError(f"В смете {source} нет листа '{name}'")
+        return workbook[name]
+
+    def plan_blocks(self, blocks):
+        """
+        Рассчитывает строки вставки всех таблиц до изменения шаблона
+
+        Args:
+            blocks: список (лист шаблона, лист сметы)
+
+        Returns:
+            dict: лист шаблона → список (лист сметы, первая строка, строк, столбцов)
+        """
+        plan = {}
+        for target_sheet, source_sheet in blocks:
+            source_rows, source_cols = self.get_table_dimensions(source_sheet)
+            target_blocks = plan.setdefault(target_sheet, [])
+            start_row = START_ROW + sum(rows for _, _, rows, _ in target_blocks)
+            target_blocks.append((source_sheet, start_row, source_rows, source_cols))
+        return plan
+
+    def insert_blocks(self, plan, total_rows):
+        """Вставляет все таблицы по плану"""
+        events = self.events
+        transfers = {}
+        copied = done = 0
+
+        for target_sheet, target_blocks in plan.items():
+            for source_sheet, start_row, source_rows, source_cols in target_blocks:
+                events.emit(INSERT_START, start_row=start_row, rows=source_rows, cols=source_cols)
+
+                # Соответствие стилей общее для всех таблиц одной сметы
+                key = (id(source_sheet.parent), id(target_sheet.parent))
+                styles = transfers.get(key)
+                if styles is None:
+                    styles = transfers[key] = StyleTransfer(source_sheet.parent, target_sheet.parent)
+
+                covered = self.insert_layout(target_sheet, source_sheet, start_row)
+                block_copied = self.copy_cells(target_sheet, source_sheet, start_row,
+                                               source_rows, source_cols, styles,
+                                               done_before=done, total=total_rows, covered=covered)
+                copied += block_copied
+                done += source_rows
+                events.emit(CELLS_COPIED, rows=source_rows, cols=source_cols, cells=block_copied,
+                            styled_cells=styles.copied, styles=len(styles))
+
+        self.stats.update(cells_copied=copied,
+                          styled_cells=sum(styles.copied for styles in transfers.values()),
+                          unique_styles=sum(len(styles) for styles in transfers.values()))
+        events.emit(INSERT_PROGRESS, done=total_rows, total=total_rows)
+
+    def run(self):
+        """Этапы обработки для всех смет сразу: каждый этап выполняется один раз"""
+        events = self.events
+        source_workbooks = {}
+        try:
+            self.check_cancelled()
+            with events.phase("load"):
+                template_wb = self.load_template()
+                blocks = []
+                for source, sheet_name, target in self.inputs:
+                    # Смета, указанная несколько раз (разные листы), открывается один раз
+                    source_wb = source_workbooks.get(source)
+                    if source_wb is None:
+                        source_wb = source_workbooks[source] = open_source_workbook(source)
+                    blocks.append((self.find_target_sheet(template_wb, target),
+                                   self.find_source_sheet(source_wb, sheet_name, source)))
+
+            for target_sheet, source_sheet in blocks:
+                events.emit(SHEETS_FOUND, template_sheet=target_sheet.title, source_sheet=source_sheet.title)
+
+            with events.phase("dimensions"):
+                plan = self.plan_blocks(blocks)
+            totals = {sheet: (sum(rows for _, _, rows, _ in target_blocks),
+                              max(cols for _, _, _, cols in target_blocks))
+                      for sheet, target_blocks in plan.items()}
+            total_rows = sum(rows for rows, _ in totals.values())
+            self.stats.update(
+                source_rows=total_rows,
+                source_cols=max(cols for _, cols in totals.values()),
+                template_rows=max(sheet.max_row for sheet in plan),
+                blocks=[{"target": target_sheet.title, "sheet": source_sheet.title,
+                         "start_row": start_row, "rows": rows, "cols": cols}
+                        for target_sheet, target_blocks in plan.items()
+                        for source_sheet, start_row, rows, cols in target_blocks])
+
+            # 1. Каждый лист шаблона сдвигается один раз на сумму строк своих таблиц
+            self.check_cancelled()
+            with events.phase("shift"):
+                cells_moved = 0
+                for sheet, (rows, _) in totals.items():
+                    self.shift_rows(sheet, start_row=START_ROW, rows_to_insert=rows)
+                    cells_moved += self.stats["cells_moved"]
+                self.stats["cells_moved"] = cells_moved
+
+            # 2. Таблицы вставляются друг под другом
+            self.check_cancelled()
+            with events.phase("insert", total=total_rows):
+                self.insert_blocks(plan, total_rows)
+
+            # 3. Шапка сдвигается по самой широкой таблице листа
+            self.check_cancelled()
+            with events.phase("shift_range"):
+                self.stats["header_shift"] = max(
+                    self.shift_header(sheet, rows, cols, start_row=START_ROW)
+                    for sheet, (rows, cols) in totals.items())
+
+            self.check_cancelled()
+            with events.phase("save"):
+                targets = [sheet.title for sheet in plan]
+                self.save_result(template_wb, modified_sheets=[
+                    *targets, *sorted(self.referencing_sheets.difference(targets))])
+
+        finally:
+            for source_wb in source_workbooks.values():
+                source_wb.close()
+
+
+def parse_input(text):
+    """Разбирает вход командной строки 'смета.xlsx[:лист]'"""
+    # Двоеточие после буквы диска Windows не отделяет лист
+    path, sep, sheet = text.rpartition(":")
+    if not sep or len(path) < 2 or sheet.startswith(("\\", "/")):
+        return text, None
+    return path, sheet or None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сборка акта КС-2 из нескольких смет")
+    parser.add_argument("sources", nargs="+", help="сметы в порядке вставки: файл.xlsx[:лист]")
+    parser.add_argument("--template", required=True, help="шаблон КС-2")
+    parser.add_argument("--output", required=True, help="файл результата")
+    parser.add_argument("--targets", nargs="+",
+                        help="листы шаблона для каждой сметы (или один для всех)")
+    parser.add_argument("--copy-workers", type=int, metavar="N",
+                        help="процессов чтения больших смет при вставке (по умолчанию один основной)")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    processor = None
+    try:
+        processor = KS2CompositeProcessor(args.template, [parse_input(s) for s in args.sources],
+                                          args.output, target_sheets=args.targets,
+                                          copy_workers=args.copy_workers, **profile_options(args))
+        processor.process()
+    except Exception as e:
+        # Ошибки обработки уже выведены журналом событий, ошибки входов — нет
+        if processor is None:
+            print(f"❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+События обработки КС-2 и их получатели.
+
+KS2Processor сообщает о ходе работы типизированными событиями, а не print().
+Если получателей нет, событие даже не создается. Текстовый журнал, индикатор
+прогресса, logging и файл метрик — отдельные получатели (адаптеры).
+"""
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+
+# Этапы обработки в порядке выполнения
+PHASES = ("load", "dimensions", "shift", "insert", "summary", "shift_range", "save")
+
+# Виды событий
+PROCESS_START = "process_start"
+PROCESS_END = "process_end"
+PROCESS_ERROR = "process_error"
+PROCESS_CANCELLED = "process_cancelled"
+PHASE_START = "phase_start"
+PHASE_END = "phase_end"
+SHEETS_FOUND = "sheets_found"
+ROWS_SHIFTED = "rows_shifted"
+INSERT_START = "insert_start"
+INSERT_PROGRESS = "insert_progress"
+CELLS_COPIED = "cells_copied"
+LAYOUT_COPIED = "layout_copied"
+HEADER_SHIFT = "header_shift"
+RANGE_SHIFTED = "range_shifted"
+ENGINE_FALLBACK = "engine_fallback"
+SUMMARY_DONE = "summary_done"
+PROFILE_SAVED = "profile_saved"
+
+
+class ProcessEvent:
+    """Событие обработки: вид, время и данные"""
+
+    __slots__ = ("kind", "timestamp", "data")
+
+    def __init__(self, kind, data):
+        self.kind = kind
+        self.timestamp = time.time()
+        self.data = data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def to_dict(self):
+        return dict(self.data, event=self.kind, time=self.timestamp)
+
+    def __repr__(self):
+        return f"<ProcessEvent {self.kind} {self.data!r}>"
+
+
+class EventEmitter:
+    """
+    Рассылает события получателям и собирает время этапов.
+    Получатель — любая функция, принимающая ProcessEvent
+    """
+
+    def __init__(self, listeners=()):
+        self.listeners = list(listeners)
+        self.timings = {}
+
+    def __bool__(self):
+        return bool(self.listeners)
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def emit(self, kind, **data):
+        if not self.listeners:
+            return
+        event = ProcessEvent(kind, data)
+        for listener in self.listeners:
+            listener(event)
+
+    @contextmanager
+    def phase(self, name, **info):
+        """Оборачивает этап обработки событиями начала/конца и замером времени"""
+        self.emit(PHASE_START, phase=name, **info)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[name] = self.timings.get(name, 0) + elapsed
+            self.emit(PHASE_END, phase=name, elapsed=elapsed)
+
+
+def get_column_letter(col):
+    """Буква столбца; openpyxl загружается только при выводе, чтобы модуль событий не замедлял запуск GUI"""
+    from openpyxl.utils import get_column_letter
+    return get_column_letter(col)
+
+
+def _range_name(range_start, range_end):
+    return (f"{get_column_letter(range_start[1])}{range_start[0]}:"
+            f"{get_column_letter(range_end[1])}{range_end[0]}")
+
+
+def _amount(value):
+    return f"{value:,.2f}".replace(",", " ")
+
+
+def summary_lines(metrics, sections, limit=10):
+    """Отчет об итогах сметы: метрики и первые limit разделов (название, сумма, строка)"""
+    lines = [f"  Итого по смете: {_amount(metrics['total'])} ({metrics['rows']} строк со стоимостью)"]
+    if "mismatches" in metrics:
+        if metrics["mismatches"]:
+            lines.append(f"  ⚠️ Количество × цена ≠ стоимость в {metrics['mismatches']} строках "
+                         f"из {metrics['checked']}, первая — строка {metrics['first_mismatch']}")
+        else:
+            lines.append(f"  ✅ Количество × цена = стоимость во всех {metrics['checked']} строках")
+    for name, total, row in sections[:limit]:
+        lines.append(f"    {name}: {_amount(total)}")
+    if len(sections) > limit:
+        lines.append(f"    ... еще разделов: {len(sections) - limit}")
+    return lines
+
+
+class TextListener:
+    """Выводит события в виде привычного текстового журнала"""
+
+    PHASE_TITLES = {
+        "load": "\n📥 Загрузка файлов...",
+        "shift": "\n🔄 Сдвиг строк в шаблоне...",
+        "insert": "\n📋 Вставка данных...",
+        "summary": "\n🧮 Итоги сметы...",
+        "save": "\n💾 Сохранение результата...",
+    }
+
+    def __init__(self, write=print):
+        self.write = write
+
+    def __call__(self, event):
+        for line in self.render(event):
+            self.write(line)
+
+    def render(self, event):
+        """Возвращает строки журнала для события"""
+        kind = event.kind
+
+        if kind == PROCESS_START:
+            # При сборке акта из нескольких смет источников несколько
+            sources = event['source']
+            if isinstance(sources, str):
+                sources = [sources]
+            return ["🚀 === НАЧАЛО ОБРАБОТКИ ===\n",
+                    f"📄 Шаблон: {os.path.basename(event['template'])}",
+                    f"📊 Исходные данные: {', '.join(os.path.basename(s) for s in sources)}"]
+        if kind == PHASE_START and event['phase'] in self.PHASE_TITLES:
+            return [self.PHASE_TITLES[event['phase']]]
+        if kind == SHEETS_FOUND:
+            return [f"✅ Найден лист шаблона: '{event['template_sheet']}'",
+                    f"✅ Используется исходный лист: '{event['source_sheet']}'"]
+        if kind == ROWS_SHIFTED:
+            return [f"  Сдвиг строк с {event['start_row']} на {event['rows']} позиций вниз...",
+                    f"  Перемещено ячеек: {event['cells']}"]
+        if kind == INSERT_START:
+            return [f"  Вставка таблицы начиная со строки {event['start_row']}...",
+                    f"  Размеры вставляемой таблицы: {event['rows']} строк × {event['cols']} столбцов"]
+        if kind == CELLS_COPIED:
+            return [f"  Уникальных стилей: {event['styles']} на {event['styled_cells']} ячеек"]
+        if kind == LAYOUT_COPIED:
+            if not (event['merged'] or event['rows'] or event['columns']):
+                return []
+            return [f"  Перенесено объединений: {event['merged']}, высот строк: {event['rows']}, "
+                    f"ширин столбцов: {event['columns']}"]
+        if kind == HEADER_SHIFT:
+            if event['columns']:
+                return ["\n⬅️  Вставленная таблица выходит за столбец H",
+                        f"  Необходимо сдвинуть области влево на {event['columns']} столбцов"]
+            return [f"\n✅ Вставленная таблица заканчивается на столбце {get_column_letter(event['last_col'])}",
+                    "  Сдвиг областей G1:H18 и E12:F18 не требуется"]
+        if kind == RANGE_SHIFTED:
+            return [f"  Сдвиг диапазона {_range_name(event['range_start'], event['range_end'])} "
+                    f"влево на {event['columns']} столбцов..."]
+        if kind == SUMMARY_DONE:
+            lines = summary_lines(event['metrics'], event['sections'])
+            if event.get('export'):
+                lines.append(f"  💾 Таблица выгружена: {os.path.basename(event['export'])}")
+            return lines
+        if kind == ENGINE_FALLBACK:
+            return [f"  ⚠️ Прямая вставка XML невозможна ({event['reason']}), обработка через openpyxl"]
+        if kind == PROCESS_END:
+            lines = ["\n🎉 === ОБРАБОТКА ЗАВЕРШЕНА ==="]
+            strings = event.get('strings')
+            if strings and strings['string_cells']:
+                lines.append(f"  Строковых ячеек: {strings['string_cells']}, "
+                             f"разных строк: {strings['unique_strings']}")
+            if event.get('memory_budget_mb') and event.get('peak_rss_mb') is not None:
+                peak, budget = event['peak_rss_mb'], event['memory_budget_mb']
+                lines.append(f"  Пиковая память: {peak} МБ при бюджете {budget} МБ"
+                             + (" ⚠️ бюджет превышен" if peak > budget else ""))
+            lines.append(f"✅ Результат сохранен: {os.path.basename(event['output'])}")
+            return lines
+        if kind == PROFILE_SAVED:
+            if event['path'] is None:
+                return [f"  ⚠️ Отчет профилирования не сохранен: {event['error']}"]
+            return [f"📈 Отчет профилирования: {event['path']}"]
+        if kind == PROCESS_CANCELLED:
+            return ["\n⛔ Обработка отменена"]
+        if kind == PROCESS_ERROR:
+            return [f"\n❌ Ошибка: {event['error']}"]
+        return []
+
+
+class ProgressListener:
+    """Передает ход обработки в функцию callback(phase, done, total)"""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def __call__(self, event):
+        if event.kind == PHASE_START:
+            self.callback(event['phase'], 0, event.get('total', 0))
+        elif event.kind == INSERT_PROGRESS:
+            # В режиме с бюджетом памяти смета вписывается во время сохранения
+            self.callback(event.get('phase', "insert"), event['done'], event['total'])
+
+
+class LoggingListener:
+    """Пишет события в стандартный модуль logging"""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger("ks2")
+        self.level = level
+
+    def __call__(self, event):
+        if event.kind == PROCESS_ERROR:
+            self.logger.error("%s %s", event.kind, event.data)
+        elif self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, "%s %s", event.kind, event.data)
+
+
+class JsonLinesListener:
+    """Дописывает события в файл метрик в формате JSON Lines"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, event):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(event.to_dict(), ensure_ascii=False, default=str) + "\n")
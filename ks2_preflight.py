@@ -0,0 +1,315 @@
+"""
+Предварительная проверка файлов КС-2 и план вставки без загрузки книг.
+
+Читаются только описание пакета (связи и workbook.xml) и начало XML
+нужного листа: проверяется, что у шаблона есть лист «КС-2…», а смета —
+книга .xlsx с активным листом, по тегу <dimension> оцениваются размеры
+сметы и рассчитывается, на сколько строк сдвинется шаблон и нужно ли
+сдвигать области шапки G1:H18 и E12:F18. Проверка занимает миллисекунды,
+поэтому GUI выполняет ее при каждом изменении пути.
+
+Модуль не импортирует openpyxl (кроме точного режима, см. check_source).
+
+Пример:
+    python ks2_preflight.py КС-2.xlsx смета.xlsx [--output акт.xlsx] [--exact]
+"""
+import argparse
+import html
+import os
+import posixpath
+import re
+import sys
+import zlib
+from contextlib import contextmanager
+from zipfile import BadZipFile, ZipFile
+
+
+START_ROW = 20
+# Последний столбец шапки (H): таблица шире него сдвигает области шапки влево
+HEADER_LAST_COL = 8
+# Области шапки, сдвигаемые влево: (первый столбец, первая строка, последний столбец, последняя строка)
+HEADER_RANGES = ((7, 1, 8, 18), (5, 12, 6, 18))
+
+# Сколько байт начала XML листа читается в поисках <dimension>
+HEADER_READ_SIZE = 64 * 1024
+
+ATTR_RE = re.compile(r'([\w:]+)="([^"]*)"')
+RELATIONSHIP_RE = re.compile(r"<(?:\w+:)?Relationship\b([^>]*?)/?>")
+SHEET_RE = re.compile(r"<(?:\w+:)?sheet\b([^>]*?)/?>")
+ACTIVE_TAB_RE = re.compile(r'<(?:\w+:)?workbookView\b[^>]*?\sactiveTab="(\d+)"')
+DIMENSION_RE = re.compile(rb'<(?:\w+:)?dimension\b[^>]*?\sref="([A-Z]*)(\d*)(?::([A-Z]+)(\d+))?"')
+OFFICE_DOCUMENT = "/officeDocument"
+
+
+class PreflightError(ValueError):
+    """Файл не подходит для обработки; сообщение — для пользователя"""
+
+
+def _column_letter(col):
+    letters = ""
+    while col:
+        col, rest = divmod(col - 1, 26)
+        letters = chr(65 + rest) + letters
+    return letters
+
+
+def _column_index(letters):
+    col = 0
+    for letter in letters:
+        col = col * 26 + ord(letter) - 64
+    return col
+
+
+def _range_name(bounds, shift=0):
+    """Адрес области, сдвинутой на shift столбцов влево (столбцы левее A отбрасываются)"""
+    min_col, min_row, max_col, max_row = bounds
+    return f"{_column_letter(max(min_col - shift, 1))}{min_row}:{_column_letter(max_col - shift)}{max_row}"
+
+
+def _relationships(archive, part):
+    """Связи части архива: Id → (тип, путь цели); внешние связи не включаются"""
+    folder, name = posixpath.split(part)
+    rels_path = posixpath.join(folder, "_rels", f"{name}.rels")
+    if rels_path not in archive.NameToInfo:
+        return {}
+    rels = {}
+    for match in RELATIONSHIP_RE.finditer(archive.read(rels_path).decode("utf-8")):
+        attrs = dict(ATTR_RE.findall(match.group(1)))
+        if attrs.get("TargetMode") == "External" or "Target" not in attrs:
+            continue
+        target = attrs["Target"]
+        path = target[1:] if target.startswith("/") else posixpath.normpath(posixpath.join(folder, target))
+        rels[attrs.get("Id")] = (attrs.get("Type", ""), path)
+    return rels
+
+
+@contextmanager
+def open_package(path, role):
+    """
+    Открывает файл как пакет .xlsx; ошибки чтения поврежденного архива
+    превращаются в PreflightError
+
+    Yields:
+        tuple: (ZipFile, путь workbook.xml)
+    """
+    if not os.path.isfile(path):
+        raise PreflightError(f"Файл {role} не найден")
+    if path.lower().endswith(".xls"):
+        raise PreflightError(f"Файл {role} в формате .xls: сохраните его в Excel как .xlsx")
+    try:
+        archive = ZipFile(path)
+    except (BadZipFile, OSError):
+        raise PreflightError(f"Файл {role} не является книгой Excel .xlsx")
+
+    with archive:
+        try:
+            workbook = "xl/workbook.xml"
+            for rel_type, target in _relationships(archive, "").values():
+                if rel_type.endswith(OFFICE_DOCUMENT):
+                    workbook = target
+            if workbook not in archive.NameToInfo:
+                raise PreflightError(f"В файле {role} нет книги Excel (поврежден или другой формат)")
+            yield archive, workbook
+        except (BadZipFile, KeyError, EOFError, UnicodeDecodeError, zlib.error):
+            raise PreflightError(f"Файл {role} поврежден")
+
+
+def workbook_sheets(archive, workbook):
+    """
+    Листы книги в порядке следования и номер активного листа
+
+    Returns:
+        tuple: ([(название, тип связи, путь части)], номер активного листа)
+    """
+    xml = archive.read(workbook).decode("utf-8")
+    rels = _relationships(archive, workbook)
+    sheets = []
+    for match in SHEET_RE.finditer(xml):
+        attrs = dict(ATTR_RE.findall(match.group(1)))
+        rel_type, path = rels.get(attrs.get("r:id"), ("", None))
+        sheets.append((html.unescape(attrs.get("name", "")), rel_type, path))
+    active = ACTIVE_TAB_RE.search(xml)
+    return sheets, int(active.group(1)) if active else 0
+
+
+def sheet_dimension(archive, path):
+    """
+    Размер листа по тегу <dimension> в начале его XML
+
+    Returns:
+        tuple: (строк, столбцов) или None, если тега нет
+    """
+    with archive.open(path) as source:
+        head = source.read(HEADER_READ_SIZE)
+    match = DIMENSION_RE.search(head)
+    if match is None:
+        return None
+    first_col, first_row, last_col, last_row = match.groups()
+    if last_col is None:
+        last_col, last_row = first_col, first_row
+    if not last_col or not last_row:
+        return None
+    return int(last_row), _column_index(last_col.decode())
+
+
+def check_template(path):
+    """
+    Проверяет шаблон: книга .xlsx с обычным листом, название которого начинается с «КС-2»
+
+    Returns:
+        dict: {"sheet": название листа КС-2, "sheets": число листов}
+    """
+    with open_package(path, "шаблона") as (archive, workbook):
+        sheets, active = workbook_sheets(archive, workbook)
+        for name, rel_type, part in sheets:
+            if name.startswith("КС-2"):
+                break
+        else:
+            raise PreflightError("Не найден лист, начинающийся с 'КС-2'")
+        if not rel_type.endswith("/worksheet") or part not in archive.NameToInfo:
+            raise PreflightError(f"Лист '{name}' шаблона не является обычным листом")
+    return {"sheet": name, "sheets": len(sheets)}
+
+
+def check_source(path, exact=False):
+    """
+    Проверяет смету и оценивает размер таблицы ее активного листа.
+
+    Без exact размер берется из тега <dimension>: он учитывает и пустые
+    отформатированные ячейки, поэтому может быть больше таблицы. С exact
+    лист просматривается целиком (table_dimensions.scan_sheet_xml_bounds),
+    как при обработке
+
+    Returns:
+        dict: {"sheet", "rows", "cols", "exact"}; rows и cols — None,
+            если размер без просмотра листа неизвестен
+    """
+    with open_package(path, "сметы") as (archive, workbook):
+        sheets, active = workbook_sheets(archive, workbook)
+        if not sheets or active >= len(sheets):
+            raise PreflightError("В смете не найден активный лист")
+        name, rel_type, part = sheets[active]
+        if not rel_type.endswith("/worksheet") or part not in archive.NameToInfo:
+            raise PreflightError(f"Активный лист сметы '{name}' не является обычным листом")
+
+        bounds = None
+        if exact:
+            from table_dimensions import scan_sheet_xml_bounds
+            with archive.open(part) as source:
+                bounds = scan_sheet_xml_bounds(source)
+        exact = bounds is not None
+        if bounds is None:
+            bounds = sheet_dimension(archive, part)
+    rows, cols = bounds if bounds is not None else (None, None)
+    return {"sheet": name, "rows": rows, "cols": cols, "exact": exact}
+
+
+def check_output(path, inputs=(), makedirs=False):
+    """
+    Проверяет путь результата: папка существует (или будет создана при
+    обработке — makedirs), файл не совпадает с входными
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    if not makedirs and not os.path.isdir(folder):
+        raise PreflightError("Папка для результата не существует")
+    if os.path.isdir(path):
+        raise PreflightError("Путь результата указывает на папку")
+    target = os.path.normcase(os.path.abspath(path))
+    if any(item and os.path.normcase(os.path.abspath(item)) == target for item in inputs):
+        raise PreflightError("Результат нельзя сохранить поверх входного файла")
+    return {"output": path}
+
+
+def plan_insert(template, source):
+    """
+    План вставки по результатам check_template и check_source
+
+    Returns:
+        dict: листы, размер сметы, строки вставки и сдвиг областей шапки
+            ("header_shift" — на сколько столбцов, "moved_ranges" — [(было, станет)])
+    """
+    rows, cols = source["rows"], source["cols"]
+    plan = {
+        "template_sheet": template["sheet"],
+        "source_sheet": source["sheet"],
+        "rows": rows,
+        "cols": cols,
+        "exact": source["exact"],
+        "start_row": START_ROW,
+        "header_shift": None,
+        "moved_ranges": [],
+    }
+    if cols is not None:
+        shift = max(cols - HEADER_LAST_COL, 0)
+        plan["header_shift"] = shift
+        if shift:
+            plan["moved_ranges"] = [(_range_name(bounds), _range_name(bounds, shift))
+                                    for bounds in HEADER_RANGES if bounds[2] - shift >= 1]
+    return plan
+
+
+def preflight(template_path, source_path, output_path=None, exact=False, makedirs=False):
+    """
+    Проверяет файлы обработки и строит план вставки
+
+    Raises:
+        PreflightError: первый найденный недостаток файлов
+    """
+    template = check_template(template_path)
+    source = check_source(source_path, exact)
+    if output_path:
+        check_output(output_path, (template_path, source_path), makedirs)
+    return plan_insert(template, source)
+
+
+def plan_summary(plan):
+    """Краткое описание плана в одну строку (для строки состояния GUI)"""
+    if plan["rows"] is None:
+        return f"лист '{plan['template_sheet']}', размер сметы определится при обработке"
+    size = f"{plan['rows']} × {plan['cols']}" if plan["exact"] else f"≈{plan['rows']} × {plan['cols']}"
+    if plan["header_shift"]:
+        return f"смета {size}, шапка сдвинется влево на {plan['header_shift']} столбцов"
+    return f"смета {size}, шапка без сдвига"
+
+
+def plan_lines(plan):
+    """Отчет о плане вставки в стиле журнала обработки"""
+    lines = [f"✅ Лист шаблона: '{plan['template_sheet']}'",
+             f"✅ Лист сметы: '{plan['source_sheet']}'"]
+    if plan["rows"] is None:
+        lines.append("  ⚠️ В смете нет тега размера: строки и столбцы определятся при обработке")
+        return lines
+
+    estimate = "" if plan["exact"] else " (оценка по тегу размера листа)"
+    lines.append(f"  Размеры таблицы: {plan['rows']} строк × {plan['cols']} столбцов{estimate}")
+    lines.append(f"  Вставка со строки {plan['start_row']}: строки шаблона сдвинутся "
+                 f"на {plan['rows']} позиций вниз")
+    if plan["header_shift"]:
+        lines.append(f"  ⬅️ Таблица выходит за столбец H: области шапки сдвинутся "
+                     f"влево на {plan['header_shift']} столбцов")
+        lines.extend(f"    {before} → {after}" for before, after in plan["moved_ranges"])
+    else:
+        lines.append("  Сдвиг областей G1:H18 и E12:F18 не требуется")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка файлов и план вставки сметы в КС-2 без обработки")
+    parser.add_argument("template", help="шаблон КС-2")
+    parser.add_argument("source", help="проектная смета")
+    parser.add_argument("--output", help="файл результата (проверяется путь)")
+    parser.add_argument("--exact", action="store_true",
+                        help="точный размер таблицы просмотром всего листа сметы")
+    args = parser.parse_args(argv)
+
+    try:
+        plan = preflight(args.template, args.source, args.output, exact=args.exact)
+    except PreflightError as e:
+        print(f"❌ {e}")
+        return 1
+    print("\n".join(plan_lines(plan)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,569 @@
+import os
+import time
+from operator import attrgetter
+from openpyxl import load_workbook
+from openpyxl.cell.cell import Cell, MergedCell
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.formula import ArrayFormula
+from sheet_shift import shift_rows_down, shift_row_references, move_block_references, shift_source_formula
+from style_transfer import StyleTransfer
+from table_dimensions import DimensionIndex
+from sheet_layout import MergeIndex, apply_row_dimensions, apply_column_dimensions, merge_cells
+from source_reader import open_source_workbook, iter_source_cells
+from parallel_copy import ChunkedCellReader
+from ks2_profile import RunProfiler, save_report
+from fast_save import save_workbook_fast, DEFAULT_COMPRESSLEVEL
+from memory_budget import chunk_rows, peak_rss_mb
+from ks2_events import (
+    EventEmitter, TextListener,
+    PROCESS_START, PROCESS_END, PROCESS_ERROR, PROCESS_CANCELLED,
+    SHEETS_FOUND, ROWS_SHIFTED, INSERT_START, INSERT_PROGRESS, CELLS_COPIED, LAYOUT_COPIED,
+    HEADER_SHIFT, RANGE_SHIFTED, SUMMARY_DONE, PROFILE_SAVED,
+)
+
+
+# Прогресс вставки сообщается каждые PROGRESS_STEP строк
+PROGRESS_STEP = 500
+
+# Версия обработки: увеличивается, когда меняется содержимое результата,
+# чтобы пакетная обработка не считала старые результаты актуальными
+PROCESSOR_VERSION = 16
+
+
+class ProcessingCancelled(Exception):
+    """Обработка остановлена по запросу пользователя"""
+
+
+def import_summary():
+    """Модуль итогов сметы: он требует NumPy, поэтому импортируется, только когда итоги включены"""
+    try:
+        import ks2_summary
+    except ImportError as e:
+        raise RuntimeError(f"Для итогов сметы нужен пакет numpy (pip install numpy): {e}")
+    return ks2_summary
+
+
+class DeferredTable:
+    """
+    Таблица сметы, которая вписывается в лист КС-2 во время его записи
+    (режим с бюджетом памяти).
+
+    Ячейки сметы не попадают в словарь ячеек листа: при сохранении строки
+    сметы читаются потоком частями по chunk_rows строк, превращаются в ячейки,
+    записываются и освобождаются. Значения и стили ячеек те же, что дает
+    KS2Processor.copy_cells, поэтому результат совпадает с обычной вставкой
+    """
+
+    def __init__(self, processor, target_sheet, source_sheet, start_row, rows, cols, chunk_rows,
+                 covered=frozenset()):
+        self.processor = processor
+        self.sheet = target_sheet
+        self.source_sheet = source_sheet
+        self.start_row = start_row
+        self.rows = rows
+        self.cols = cols
+        self.chunk_rows = chunk_rows
+        self.covered = covered
+        self.styles = StyleTransfer(source_sheet.parent, target_sheet.parent)
+
+    def dimension(self):
+        """
+        Размер листа вместе с таблицей сметы. Таблица занимает строки
+        start_row..start_row + rows - 1 и считается начинающейся со столбца A
+        """
+        min_row, max_row = self.start_row, self.start_row + self.rows - 1
+        min_col, max_col = 1, self.cols
+        for row, col in self.sheet._cells:
+            min_row, max_row = min(min_row, row), max(max_row, row)
+            max_col = max(max_col, col)
+        return f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{max_row}"
+
+    def iter_chunks(self):
+        """Части таблицы сметы: списки (строка сметы, [(столбец, значение, стиль)])"""
+        chunk = []
+        row = None
+        for row_idx, col_idx, value, style in iter_source_cells(self.source_sheet, self.rows, self.cols):
+            if row is None or row[0] != row_idx:
+                if len(chunk) >= self.chunk_rows:
+                    yield chunk
+                    chunk = []
+                row = (row_idx, [])
+                chunk.append(row)
+            row[1].append((col_idx, value, style))
+        if chunk:
+            yield chunk
+
+    def merge_rows(self, rows):
+        """
+        Строки листа для записи: строки шаблона (отсортированные пары
+        (номер, ячейки)) вместе со строками сметы
+        """
+        start, end = self.start_row, self.start_row + self.rows
+        # Ячейки шаблона в освободившихся строках (стили), как в copy_cells, принимают значения сметы
+        gap = {row_idx: cells for row_idx, cells in rows if start <= row_idx < end}
+
+        yield from (row for row in rows if row[0] < start)
+        yield from self.iter_rows(gap)
+        yield from (row for row in rows if row[0] >= end)
+
+    def iter_rows(self, gap):
+        """Строки таблицы сметы, собираемые и освобождаемые по частям"""
+        processor = self.processor
+        sheet, styles, covered = self.sheet, self.styles, self.covered
+        offset = self.start_row - 1
+        title = self.source_sheet.title
+        gap_rows = sorted(gap, reverse=True)
+        column = attrgetter("column")
+        copied = 0
+
+        for chunk in self.iter_chunks():
+            processor.check_cancelled()
+            processor.events.emit(INSERT_PROGRESS, done=chunk[0][0] - 1, total=self.rows, phase="save")
+
+            rows = []
+            for source_row, source_cells in chunk:
+                row_idx = source_row + offset
+                while gap_rows and gap_rows[-1] < row_idx:
+                    rows.append((gap_rows[-1], gap[gap_rows.pop()]))
+                if gap_rows and gap_rows[-1] == row_idx:
+                    gap_rows.pop()
+
+                cells = {cell.column: cell for cell in gap.get(row_idx, ())}
+                for col_idx, value, style in source_cells:
+                    cell = cells.get(col_idx)
+                    if cell is None:
+                        cell = cells[col_idx] = Cell(sheet, row=row_idx, column=col_idx)
+                    if isinstance(value, (str, ArrayFormula)):
+                        value = shift_source_formula(value, title, offset)
+                    try:
+                        cell.value = value
+                    except AttributeError:
+                        if (row_idx, col_idx) not in covered:
+                            raise
+                    copied += 1
+                    if style is not None:
+                        styles.copy_style_array(style, cell)
+                rows.append((row_idx, sorted(cells.values(), key=column)))
+
+            # Часть отдается на запись целиком и после этого освобождается
+            yield from rows
+            del rows, chunk
+
+        while gap_rows:
+            yield gap_rows[-1], gap[gap_rows.pop()]
+
+        # Смета прочитана: ее лист и кэш стилей больше не нужны
+        self.source_sheet = None
+        processor.stats.update(cells_copied=copied, styled_cells=styles.copied, unique_styles=len(styles))
+        processor.events.emit(CELLS_COPIED, rows=self.rows, cols=self.cols, cells=copied,
+                              styled_cells=styles.copied, styles=len(styles))
+        processor.events.emit(INSERT_PROGRESS, done=self.rows, total=self.rows, phase="save")
+
+
+class KS2Processor:
+    """Класс для обработки вставки проектной сметы в шаблон КС-2"""
+
+    def __init__(self, template_path, source_path, output_path, template_cache=None,
+                 listeners=None, cancel_event=None, fast_save=True,
+                 compresslevel=DEFAULT_COMPRESSLEVEL, memory_budget=None, summary=None,
+                 copy_workers=None, profile_report=None, profile_allocations=False):
+        """
+        Args:
+            listeners: получатели событий (см. ks2_events); по умолчанию
+                текстовый журнал в stdout, пустой список отключает вывод
+            cancel_event: threading.Event, установка которого останавливает обработку
+            fast_save: сохранять через fast_save (нетронутые листы шаблона
+                переносятся без изменений), иначе обычным сохранением openpyxl
+            compresslevel: степень сжатия zip при быстром сохранении (0-9)
+            memory_budget: бюджет памяти в МБ; если задан (и включено быстрое
+                сохранение), смета не копируется в лист, а вписывается в него
+                при записи частями по размеру бюджета (см. DeferredTable)
+            summary: настройки итогов сметы (см. ks2_summary.normalize_config);
+                если заданы, после вставки считаются итоги и проверки таблицы
+            copy_workers: число процессов чтения таблиц смет при вставке;
+                больше 1 — большие таблицы разбираются параллельно блоками
+                строк (см. parallel_copy), результат тот же
+            profile_report: записать отчет профилирования (см. ks2_profile):
+                True — рядом с результатом, строка — в эту папку
+            profile_allocations: в отчете профилирования — выделения памяти
+                по строкам кода (tracemalloc; обработка в несколько раз медленнее)
+        """
+        self.template_path = template_path
+        self.source_path = source_path
+        self.output_path = output_path
+        self.template_cache = template_cache
+        self.cancel_event = cancel_event
+        self.fast_save = fast_save
+        self.compresslevel = compresslevel
+        self.memory_budget = memory_budget
+        self.summary = summary
+        self.cell_reader = ChunkedCellReader(copy_workers) if copy_workers else None
+        self.profile_report = profile_report
+        self.profile_allocations = profile_allocations
+        # Таблицы смет, вписываемые в листы при сохранении: название листа → DeferredTable
+        self.deferred = {}
+        self.dimensions = DimensionIndex()
+        # Сканер столбцов итогов: они собираются в том же просмотре листа сметы, что и границы таблицы
+        self.summary_scanner = None
+        self.events = EventEmitter([TextListener()] if listeners is None else listeners)
+        self.stats = {}
+        # Листы шаблона, формулы которых изменились при пересчете ссылок на лист КС-2
+        self.referencing_sheets = set()
+
+    def check_cancelled(self):
+        """Останавливает обработку, если запрошена отмена"""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ProcessingCancelled("Обработка отменена пользователем")
+
+    def load_template(self):
+        """Загружает книгу шаблона (через кэш шаблонов, если он задан)"""
+        if self.template_cache is not None:
+            return self.template_cache.load(self.template_path)
+        return load_workbook(self.template_path)
+
+    def find_ks2_sheet(self, workbook):
+        """Находит лист, начинающийся с 'КС-2'"""
+        for sheet_name in workbook.sheetnames:
+            if sheet_name.startswith("КС-2"):
+                return workbook[sheet_name]
+        raise ValueError("Не найден лист, начинающийся с 'КС-2'")
+
+    def get_table_dimensions(self, source_sheet):
+        """Определяет размеры таблицы из исходного файла (один раз на лист)"""
+        return self.dimensions.get(source_sheet, self.summary_scanner)
+
+    def shift_rows(self, sheet, start_row, rows_to_insert):
+        """Сдвигает строки вниз начиная с start_row"""
+        # Перестраиваем хранилище ячеек за один проход вместо копирования каждой ячейки
+        moved_cells = shift_rows_down(sheet, start_row, rows_to_insert)
+        # Ссылки на сдвинутые строки из имен и других листов
+        self.referencing_sheets.update(shift_row_references(sheet, start_row, rows_to_insert))
+        self.stats["cells_moved"] = moved_cells
+        self.events.emit(ROWS_SHIFTED, start_row=start_row, rows=rows_to_insert, cells=moved_cells)
+
+    def shift_range_left(self, sheet, range_start, range_end, columns_to_shift, skip_rows=None):
+        """
+        Сдвигает диапазон ячеек влево на указанное количество столбцов
+        range_start, range_end: кортежи (строка, столбец)
+        skip_rows: строки, формулы которых не пересчитываются (вставленная смета)
+        """
+        self.events.emit(RANGE_SHIFTED, range_start=range_start, range_end=range_end,
+                         columns=columns_to_shift)
+
+        styles = StyleTransfer(sheet.parent, sheet.parent)
+
+        for row_idx in range(range_start[0], range_end[0] + 1):
+            for col_idx in range(range_start[1], range_end[1] + 1):
+                source_cell = sheet.cell(row=row_idx, column=col_idx)
+                target_col = col_idx - columns_to_shift
+
+                if target_col >= 1:  # Проверяем, что не выходим за границы
+                    target_cell = sheet.cell(row=row_idx, column=target_col)
+
+                    # Копируем значение
+                    target_cell.value = source_cell.value
+
+                    # Копируем форматирование
+                    if source_cell.has_style:
+                        styles.copy_style(source_cell, target_cell)
+
+                # Очищаем исходную ячейку
+                source_cell.value = None
+
+        # Ссылки на перенесенные ячейки следуют за ними, как при вырезании в Excel
+        bounds = range_start + range_end
+        self.referencing_sheets.update(
+            move_block_references(sheet, bounds, columns_to_shift, skip_rows))
+
+    def shift_header(self, sheet, inserted_rows, inserted_cols, start_row=20):
+        """
+        Сдвигает области G1:H18 и E12:F18 влево, если вставленная таблица
+        выходит за столбец H
+
+        Returns:
+            int: на сколько столбцов сдвинуты области
+        """
+        # Столбец H это 8-й столбец
+        columns_to_shift = max(inserted_cols - 8, 0)
+        self.events.emit(HEADER_SHIFT, columns=columns_to_shift, last_col=inserted_cols)
+
+        if columns_to_shift:
+            inserted = range(start_row, start_row + inserted_rows)
+
+            # Сдвигаем область G1:H18 (столбцы 7-8, строки 1-18)
+            self.shift_range_left(sheet,
+                                  range_start=(1, 7),
+                                  range_end=(18, 8),
+                                  columns_to_shift=columns_to_shift,
+                                  skip_rows=inserted)
+
+            # Сдвигаем область E12:F18 (столбцы 5-6, строки 12-18)
+            self.shift_range_left(sheet,
+                                  range_start=(12, 5),
+                                  range_end=(18, 6),
+                                  columns_to_shift=columns_to_shift,
+                                  skip_rows=inserted)
+
+        return columns_to_shift
+
+    def insert_table(self, target_sheet, source_sheet, start_row=20):
+        """Вставляет таблицу из source_sheet в target_sheet начиная со start_row"""
+        # Получаем размеры исходной таблицы
+        source_rows, source_cols = self.get_table_dimensions(source_sheet)
+        self.events.emit(INSERT_START, start_row=start_row, rows=source_rows, cols=source_cols)
+
+        covered = self.insert_layout(target_sheet, source_sheet, start_row)
+        styles = StyleTransfer(source_sheet.parent, target_sheet.parent)
+        copied = self.copy_cells(target_sheet, source_sheet, start_row, source_rows, source_cols, styles,
+                                 covered=covered)
+
+        self.stats.update(cells_copied=copied, styled_cells=styles.copied, unique_styles=len(styles))
+        self.events.emit(CELLS_COPIED, rows=source_rows, cols=source_cols, cells=copied,
+                         styled_cells=styles.copied, styles=len(styles))
+        self.events.emit(INSERT_PROGRESS, done=source_rows, total=source_rows)
+
+        return source_rows, source_cols
+
+    def defer_table(self, target_sheet, source_sheet, start_row=20):
+        """
+        Откладывает вставку таблицы из source_sheet до записи target_sheet
+        (режим с бюджетом памяти); события и размеры те же, что у insert_table
+        """
+        source_rows, source_cols = self.get_table_dimensions(source_sheet)
+        if not source_rows:
+            return self.insert_table(target_sheet, source_sheet, start_row)
+
+        rows_per_chunk = chunk_rows(self.memory_budget, source_cols)
+        self.events.emit(INSERT_START, start_row=start_row, rows=source_rows, cols=source_cols)
+        covered = self.insert_layout(target_sheet, source_sheet, start_row)
+        self.deferred[target_sheet.title] = DeferredTable(self, target_sheet, source_sheet, start_row,
+                                                          source_rows, source_cols, rows_per_chunk,
+                                                          covered)
+        self.stats["chunk_rows"] = rows_per_chunk
+        return source_rows, source_cols
+
+    def insert_layout(self, target_sheet, source_sheet, start_row=20):
+        """
+        Переносит разметку таблицы сметы в target_sheet со строки start_row:
+        объединения, высоты строк и ширины столбцов. Объединения создаются
+        до копирования ячеек, поэтому стили их ячеек затем приходят из сметы
+
+        Returns:
+            set: ячейки внутри перенесенных объединений — их значения не копируются
+        """
+        layout = self.dimensions.layout(source_sheet).shifted(start_row - 1)
+        MergeIndex.from_sheet(target_sheet).check_free(layout.merged, "объединена")
+
+        apply_row_dimensions(target_sheet, layout.rows)
+        apply_column_dimensions(target_sheet, layout.columns)
+        for bounds in layout.merged:
+            merge_cells(target_sheet, bounds)
+
+        counts = {"merged": len(layout.merged), "rows": len(layout.rows), "columns": len(layout.columns)}
+        totals = self.stats.setdefault("layout", dict.fromkeys(counts, 0))
+        for key, value in counts.items():
+            totals[key] += value
+        self.events.emit(LAYOUT_COPIED, **counts)
+        return layout.covered()
+
+    def write_summary(self, target_sheet, source_sheet, rows, cols, start_row=20):
+        """Считает итоги таблицы сметы и записывает их в ячейки шаблона"""
+        summary_module = import_summary()
+        path = summary_module.export_path(self.summary, self.source_path)
+        summary = summary_module.summarize_sheet(source_sheet, self.summary, rows, cols, start_row,
+                                                 export=path is not None, scanner=self.summary_scanner)
+        for row_idx, col_idx, value in summary.cells():
+            cell = target_sheet.cell(row_idx, col_idx)
+            if isinstance(cell, MergedCell):
+                raise ValueError(f"Ячейка итогов {cell.coordinate} входит в объединенную область")
+            cell.value = value
+        self.finish_summary(summary, path)
+
+    def start_summary_scan(self):
+        """Сканер столбцов итогов для просмотра границ таблицы (None, если итоги не включены)"""
+        if not self.summary:
+            return None
+        return import_summary().column_scanner(self.summary)
+
+    def finish_summary(self, summary, path):
+        """Выгружает таблицу (если задан путь) и сообщает итоги"""
+        if path is not None:
+            summary.export(path)
+        self.stats["summary"] = dict(summary.metrics, export=path)
+        self.events.emit(SUMMARY_DONE, metrics=summary.metrics, sections=summary.sections, export=path)
+
+    def copy_cells(self, target_sheet, source_sheet, start_row, source_rows, source_cols, styles,
+                   done_before=0, total=None, covered=frozenset()):
+        """
+        Копирует ячейки таблицы source_rows × source_cols в target_sheet со строки start_row.
+        done_before, total: положение таблицы в общем прогрессе вставки
+        covered: ячейки внутри объединений сметы (см. insert_layout)
+
+        Returns:
+            int: количество скопированных ячеек
+        """
+        total = source_rows if total is None else total
+        copied = 0
+        # Формулы сметы ссылаются на ее строки: ссылки сдвигаются вместе с таблицей
+        offset = start_row - 1
+        title = source_sheet.title
+
+        # Копируем данные построчно по мере чтения исходного листа
+        last_row = 0
+        for row_idx, col_idx, value, style in self.iter_table_cells(source_sheet, source_rows, source_cols):
+            if row_idx != last_row:
+                last_row = row_idx
+                if row_idx % PROGRESS_STEP == 0:
+                    self.check_cancelled()
+                    self.events.emit(INSERT_PROGRESS, done=done_before + row_idx, total=total)
+
+            target_cell = target_sheet.cell(row=row_idx + offset, column=col_idx)
+            if isinstance(value, (str, ArrayFormula)):
+                value = shift_source_formula(value, title, offset)
+
+            # Копируем значение (внутренние ячейки объединений сметы значений не хранят)
+            try:
+                target_cell.value = value
+            except AttributeError:
+                if (target_cell.row, col_idx) not in covered:
+                    raise
+            copied += 1
+
+            # Копируем форматирование
+            if style is not None:
+                styles.copy_style_array(style, target_cell)
+
+        return copied
+
+    def iter_table_cells(self, source_sheet, source_rows, source_cols):
+        """Ячейки таблицы сметы для copy_cells: большие таблицы при copy_workers читаются параллельно"""
+        if self.cell_reader is not None and self.cell_reader.accepts(source_sheet, source_rows):
+            return self.cell_reader.iter_cells(source_sheet, source_rows, source_cols)
+        return iter_source_cells(source_sheet, source_rows, source_cols)
+
+    def save_result(self, workbook, modified_sheets):
+        """Сохраняет книгу результата"""
+        if not self.fast_save:
+            workbook.save(self.output_path)
+            return
+
+        try:
+            result = save_workbook_fast(workbook, self.output_path,
+                                        template_path=self.template_path,
+                                        modified_sheets=modified_sheets,
+                                        compresslevel=self.compresslevel,
+                                        deferred=self.deferred)
+        except BaseException:
+            # Смета вписывается во время записи: ошибка в ней оставила бы недописанный файл
+            if self.deferred and os.path.exists(self.output_path):
+                os.remove(self.output_path)
+            raise
+        self.stats["strings"] = result.pop("strings")
+        self.stats["save"] = result
+
+    def process(self):
+        """Основной метод обработки"""
+        events = self.events
+        profiler = None
+        if self.profile_report:
+            profiler = RunProfiler(root_code=KS2Processor.process.__code__,
+                                   allocations=self.profile_allocations)
+            events.subscribe(profiler)
+        started = time.perf_counter()
+        events.emit(PROCESS_START, template=self.template_path, source=self.source_path,
+                    output=self.output_path)
+
+        try:
+            self.run()
+
+            self.stats["timings"] = dict(events.timings)
+            self.stats["elapsed"] = time.perf_counter() - started
+            self.stats["peak_rss_mb"] = peak_rss_mb()
+            if self.memory_budget:
+                self.stats["memory_budget_mb"] = self.memory_budget
+            events.emit(PROCESS_END, output=self.output_path, **self.stats)
+
+            return True
+
+        except ProcessingCancelled:
+            events.emit(PROCESS_CANCELLED)
+            raise
+
+        except Exception as e:
+            events.emit(PROCESS_ERROR, error=str(e))
+            raise
+
+        finally:
+            if self.cell_reader is not None:
+                self.cell_reader.close()
+            if profiler is not None:
+                self.save_profile(profiler)
+
+    def save_profile(self, profiler):
+        """Сохраняет отчет профилирования; ошибка записи отчета не прерывает обработку"""
+        self.events.listeners.remove(profiler)
+        try:
+            path = save_report(profiler.report(self, self.stats), self.output_path, self.profile_report)
+        except OSError as e:
+            self.events.emit(PROFILE_SAVED, path=None, error=str(e))
+        else:
+            self.events.emit(PROFILE_SAVED, path=path)
+
+    def run(self):
+        """Этапы обработки: загрузка, сдвиг, вставка, итоги (если включены), сдвиг шапки, сохранение"""
+        events = self.events
+        source_wb = None
+        try:
+            # Загружаем файлы
+            self.check_cancelled()
+            with events.phase("load"):
+                template_wb = self.load_template()
+                source_wb = open_source_workbook(self.source_path)
+
+                # Находим нужные листы
+                ks2_sheet = self.find_ks2_sheet(template_wb)
+                source_sheet = source_wb.active
+
+            events.emit(SHEETS_FOUND, template_sheet=ks2_sheet.title, source_sheet=source_sheet.title)
+
+            # Получаем размеры вставляемой таблицы (и столбцы итогов в том же проходе)
+            self.summary_scanner = self.start_summary_scan()
+            with events.phase("dimensions"):
+                source_rows, source_cols = self.get_table_dimensions(source_sheet)
+            self.stats.update(source_rows=source_rows, source_cols=source_cols,
+                              template_rows=ks2_sheet.max_row)
+
+            # 1. Сдвигаем строки в шаблоне
+            self.check_cancelled()
+            with events.phase("shift"):
+                self.shift_rows(ks2_sheet, start_row=20, rows_to_insert=source_rows)
+
+            # 2. Вставляем таблицу
+            self.check_cancelled()
+            with events.phase("insert", total=source_rows):
+                if self.memory_budget and self.fast_save:
+                    inserted_rows, inserted_cols = self.defer_table(ks2_sheet, source_sheet, start_row=20)
+                else:
+                    inserted_rows, inserted_cols = self.insert_table(ks2_sheet, source_sheet, start_row=20)
+
+            # Итоги записываются до сдвига шапки, чтобы ячейки шапки сдвинулись вместе с ней
+            if self.summary:
+                self.check_cancelled()
+                with events.phase("summary"):
+                    self.write_summary(ks2_sheet, source_sheet, source_rows, source_cols, start_row=20)
+
+            # 3. Проверяем, нужно ли сдвигать области G1:H18 и E12:F18
+            self.check_cancelled()
+            with events.phase("shift_range"):
+                self.stats["header_shift"] = self.shift_header(ks2_sheet, inserted_rows, inserted_cols)
+
+            # Сохраняем результат
+            self.check_cancelled()
+            with events.phase("save"):
+                self.save_result(template_wb,
+                                 modified_sheets=[ks2_sheet.title, *sorted(self.referencing_sheets)])
+
+        finally:
+            # Книга сметы открыта только для чтения и держит архив открытым
+            if source_wb is not None:
+                source_wb.close()
@@ -0,0 +1,468 @@
+"""
+Профилирование обработки КС-2: отчет о том, на что ушло время одного запуска.
+
+Включается параметром KS2Processor(profile_report=...), флагом
+--profile-report в командной строке или галочкой в GUI. Во время обработки
+фоновый поток PROFILE_INTERVAL раз в секунду снимает стек потока обработки
+(выборочный профилировщик): обработка замедляется на несколько процентов,
+а время внутри zlib и разбора XML тоже учитывается. Вместе со стеком
+снимается RSS процесса (где текущий RSS недоступен — пиковый): его рост
+приписывается функциям, во время которых он произошел.
+
+С profile_allocations (--profile-allocations) память дополнительно
+отслеживает tracemalloc, и для каждого этапа запоминаются строки кода с
+наибольшим ростом выделенной памяти. tracemalloc замедляет обработку в
+несколько раз, время этапов в таком отчете сравнивать с обычным нельзя.
+
+Отчет — небольшой JSON (десятки КБ), который можно приложить к обращению:
+время этапов, самые затратные функции каждого этапа, рост памяти,
+характеристики входов (строки, столбцы, доля ячеек со стилем, высота
+шаблона) и свернутые стеки для flame graph. Входы и модули в отчете —
+только имена файлов. Рабочие процессы parallel_copy не профилируются.
+
+Отчет сохраняется рядом с результатом (акт.profile.json), а если туда
+писать нельзя — в папку profiles настроек программы (см. PathManager);
+свою папку задает --profile-dir.
+
+Пример:
+    python ks2_compose.py --template КС-2.xlsx --output акт.xlsx смета.xlsx --profile-report
+    python ks2_profile.py акт.profile.json [--flame акт.folded]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from ks2_events import PROCESS_START, PROCESS_END, PROCESS_ERROR, PROCESS_CANCELLED, PHASE_START, PHASE_END
+from memory_budget import current_rss, peak_rss
+
+
+REPORT_VERSION = 1
+REPORT_SUFFIX = ".profile.json"
+# Папка отчетов в папке настроек программы и сколько отчетов в ней хранится
+PROFILE_FOLDER = "profiles"
+KEEP_REPORTS = 20
+
+# Сколько раз в секунду снимается стек потока обработки
+PROFILE_INTERVAL = 200
+# Интервал переключения потоков во время профилирования, с. При обычных 5 мс
+# поток снимков получает GIL в основном тогда, когда его отпускает zlib, и
+# почти все время приписывается чтению архива
+SWITCH_INTERVAL = 0.0001
+# Размеры отчета: функций на этап, строк выделения памяти на этап, свернутых стеков
+TOP_FUNCTIONS = 15
+TOP_ALLOCATIONS = 10
+TOP_STACKS = 300
+# Время вне этапов (начало и конец process)
+OTHER_PHASE = "other"
+
+STATUSES = {PROCESS_END: "ok", PROCESS_ERROR: "error", PROCESS_CANCELLED: "cancelled"}
+
+
+def _path_roots():
+    """Папки sys.path, от которых отсчитываются имена файлов (сначала самые длинные)"""
+    return sorted({os.path.abspath(path) for path in sys.path if path}, key=len, reverse=True)
+
+
+def _short_path(filename, roots):
+    """Файл относительно sys.path (или только имя): в отчете нет путей пользователя"""
+    for root in roots:
+        if filename.startswith(root):
+            filename = filename[len(root):].lstrip("\\/")
+            break
+    else:
+        filename = os.path.basename(filename)
+    return filename.replace(os.sep, "/")
+
+
+def _code_label(code, roots):
+    return f"{_short_path(code.co_filename, roots)}:{code.co_name}"
+
+
+def _line_statistics(snapshot):
+    """Выделенная память снимка tracemalloc по строкам кода: (файл, строка) → (байт, блоков)"""
+    return {(stat.traceback[0].filename, stat.traceback[0].lineno): (stat.size, stat.count)
+            for stat in snapshot.statistics("lineno")}
+
+
+class StackSampler(threading.Thread):
+    """Снимает стек потока обработки и RSS процесса через равные промежутки времени"""
+
+    def __init__(self, profiler, thread_id, interval):
+        super().__init__(name="ks2-profile", daemon=True)
+        self.profiler = profiler
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        profiler = self.profiler
+        root_code = profiler.root_code
+        rss_of = current_rss if current_rss() is not None else peak_rss
+        last_rss = rss_of() or 0
+        while not self.stopped.wait(self.interval):
+            phase = profiler.phase
+            frame = sys._current_frames().get(self.thread_id)
+            if phase is None or frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(code)
+                if code is root_code:
+                    break
+                frame = frame.f_back
+            key = phase, tuple(reversed(stack))
+            profiler.samples[key] += 1
+
+            # Учитывается только рост: освобожденная память не вычитается из функции, которая ее освободила
+            rss = rss_of() or 0
+            if rss > last_rss:
+                profiler.rss_growth[key] += rss - last_rss
+            last_rss = rss
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class RunProfiler:
+    """
+    Получатель событий KS2Processor, который профилирует этапы обработки:
+    подписывается до начала process(), report() собирает отчет после него
+    """
+
+    def __init__(self, root_code=None, interval=1 / PROFILE_INTERVAL, allocations=False):
+        """
+        Args:
+            root_code: код функции, с которой начинаются стеки (обычно KS2Processor.process)
+            allocations: отслеживать выделения памяти через tracemalloc
+        """
+        self.root_code = root_code
+        self.interval = interval
+        self.allocations = allocations
+        # Текущий этап; None — снимки не записываются
+        self.phase = None
+        # (этап, стек) → число снимков и рост RSS, байт
+        self.samples = Counter()
+        self.rss_growth = Counter()
+        self.phases = {}
+        self.status = None
+        self.error = None
+        self.elapsed = 0.0
+        self.sampler = None
+        self._started = None
+        self._switch_interval = None
+        self._tracing = False
+        # Выделенная память по строкам кода на конец предыдущего этапа (tracemalloc)
+        self._allocated = None
+
+    def __call__(self, event):
+        kind = event.kind
+        if kind == PROCESS_START:
+            self.start()
+        elif kind == PHASE_START:
+            self.phase = event['phase']
+        elif kind == PHASE_END:
+            self.phase = OTHER_PHASE
+            info = self.phases.setdefault(event['phase'], {"seconds": 0.0})
+            info["seconds"] += event['elapsed']
+            peak = peak_rss()
+            info["peak_rss_mb"] = None if peak is None else round(peak / 2 ** 20, 1)
+            if self._allocated is not None:
+                info["allocations"] = self._allocations()
+        elif kind in STATUSES:
+            self.status = STATUSES[kind]
+            self.error = event.get('error')
+            self.stop()
+
+    def start(self):
+        """Запускает профилирование потока, из которого вызвана (потока обработки)"""
+        self._started = time.perf_counter()
+        if self.allocations:
+            # Если память уже отслеживается (ks2_benchmark --trace-memory), tracemalloc не останавливается
+            self._tracing = not tracemalloc.is_tracing()
+            if self._tracing:
+                tracemalloc.start()
+            self._allocated = _line_statistics(tracemalloc.take_snapshot())
+        self.phase = OTHER_PHASE
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(SWITCH_INTERVAL)
+        self.sampler = StackSampler(self, threading.get_ident(), self.interval)
+        self.sampler.start()
+
+    def stop(self):
+        """Останавливает профилирование (повторный вызов ничего не делает)"""
+        if self.sampler is None:
+            return
+        self.sampler.stop()
+        self.sampler = None
+        sys.setswitchinterval(self._switch_interval)
+        self.phase = None
+        self.elapsed = time.perf_counter() - self._started
+        self._allocated = None
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def _allocations(self):
+        """Рост выделенной памяти закончившегося этапа по строкам кода (tracemalloc)"""
+        phase, self.phase = self.phase, None
+        current, peak = tracemalloc.get_traced_memory()
+        # Статистика предыдущего снимка хранится, поэтому каждый снимок разбирается один раз
+        statistics = _line_statistics(tracemalloc.take_snapshot())
+        growth = []
+        for line, (size, count) in statistics.items():
+            before_size, before_count = self._allocated.get(line, (0, 0))
+            if size > before_size:
+                growth.append((size - before_size, count - before_count, line))
+        growth.sort(reverse=True)
+        tracemalloc.reset_peak()
+        self._allocated = statistics
+        self.phase = phase
+
+        roots = _path_roots()
+        return {
+            "current_mb": round(current / 2 ** 20, 1),
+            "peak_mb": round(peak / 2 ** 20, 1),
+            "top": [{"line": f"{_short_path(filename, roots)}:{lineno}", "kb": round(size / 1024, 1), "count": count}
+                    for size, count, (filename, lineno) in growth[:TOP_ALLOCATIONS]],
+        }
+
+    def top_functions(self, counter, phase=None, limit=TOP_FUNCTIONS):
+        """
+        Функции с наибольшей долей counter (снимков или роста RSS): собственной
+        (функция на вершине стека) и вместе с вызванными, в процентах
+        """
+        roots = _path_roots()
+        own, total = Counter(), Counter()
+        for (sample_phase, stack), count in counter.items():
+            if phase is not None and sample_phase != phase:
+                continue
+            if stack:
+                own[stack[-1]] += count
+            for code in set(stack):
+                total[code] += count
+        overall = sum(own.values()) or 1
+        return [{"function": _code_label(code, roots),
+                 "self": round(100 * count / overall, 1),
+                 "total": round(100 * total[code] / overall, 1)}
+                for code, count in own.most_common(limit)]
+
+    def folded_stacks(self, limit=TOP_STACKS):
+        """Свернутые стеки «этап;функция;...;функция число снимков» для flame graph (самые частые)"""
+        roots = _path_roots()
+        lines = Counter()
+        for (phase, stack), count in self.samples.items():
+            lines[";".join([phase, *(_code_label(code, roots) for code in stack)])] += count
+        return [f"{line} {count}" for line, count in lines.most_common(limit)]
+
+    def report(self, processor, stats):
+        """Отчет о запуске обработки processor (stats — его статистика)"""
+        self.stop()
+        samples, growth = Counter(), Counter()
+        for (phase, _), count in self.samples.items():
+            samples[phase] += count
+        for (phase, _), size in self.rss_growth.items():
+            growth[phase] += size
+
+        phases = {}
+        for phase in [*self.phases, OTHER_PHASE]:
+            info = self.phases.get(phase, {})
+            phases[phase] = dict(info, seconds=round(info.get("seconds", 0.0), 3), samples=samples[phase],
+                                 rss_growth_mb=round(growth[phase] / 2 ** 20, 1),
+                                 functions=self.top_functions(self.samples, phase),
+                                 memory=self.top_functions(self.rss_growth, phase, TOP_ALLOCATIONS))
+        return {
+            "version": REPORT_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "status": self.status,
+            "error": self.error,
+            "elapsed": round(self.elapsed, 3),
+            "inputs": input_characteristics(processor, stats),
+            "environment": environment(),
+            "sampling": {"interval_ms": round(self.interval * 1000, 1), "samples": sum(samples.values()),
+                         "allocations": self.allocations},
+            "phases": phases,
+            "functions": self.top_functions(self.samples, limit=2 * TOP_FUNCTIONS),
+            "flame": self.folded_stacks(),
+        }
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+
+def input_characteristics(processor, stats):
+    """Входы обработки, размеры таблицы сметы и параметры из статистики обработки"""
+    sources = processor.source_path
+    if isinstance(sources, str):
+        sources = [sources]
+    cells = stats.get("cells_copied")
+    styled = stats.get("styled_cells")
+    return {
+        "engine": type(processor).__name__,
+        "template": os.path.basename(processor.template_path),
+        "template_bytes": _file_size(processor.template_path),
+        "sources": [{"name": os.path.basename(path), "bytes": _file_size(path)} for path in sources],
+        "rows": stats.get("source_rows"),
+        "cols": stats.get("source_cols"),
+        "cells": cells,
+        "styled_cells": styled,
+        "styled_ratio": round(styled / cells, 3) if cells and styled is not None else None,
+        "unique_styles": stats.get("unique_styles"),
+        "template_rows": stats.get("template_rows"),
+        "cells_moved": stats.get("cells_moved"),
+        "header_shift": stats.get("header_shift"),
+        "layout": stats.get("layout"),
+        "peak_rss_mb": stats.get("peak_rss_mb"),
+        "options": {
+            "fast_save": processor.fast_save,
+            "compresslevel": processor.compresslevel,
+            "memory_budget": processor.memory_budget,
+            "copy_workers": processor.cell_reader.workers if processor.cell_reader is not None else None,
+            "summary": bool(processor.summary),
+        },
+    }
+
+
+def environment():
+    """Версии обработки, Python и openpyxl, система и число ядер"""
+    import openpyxl
+    from ks2_processor import PROCESSOR_VERSION
+    return {
+        "processor_version": PROCESSOR_VERSION,
+        "python": platform.python_version(),
+        "openpyxl": openpyxl.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def config_folder():
+    """Папка отчетов в папке настроек программы"""
+    from path_manager import PathManager
+    return os.path.join(PathManager().config_dir, PROFILE_FOLDER)
+
+
+def report_path(output_path, folder=None):
+    """
+    Путь отчета: рядом с результатом (акт.profile.json) или в папке folder
+    (с временем запуска в имени, чтобы отчеты не затирали друг друга)
+    """
+    name = os.path.splitext(os.path.basename(output_path))[0]
+    if folder is None:
+        return os.path.join(os.path.dirname(os.path.abspath(output_path)), name + REPORT_SUFFIX)
+    return os.path.join(folder, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}{REPORT_SUFFIX}")
+
+
+def _write_report(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    return path
+
+
+def _prune(folder, keep=KEEP_REPORTS):
+    """Оставляет в папке keep последних отчетов"""
+    reports = sorted((entry for entry in os.scandir(folder) if entry.name.endswith(REPORT_SUFFIX)),
+                     key=lambda entry: entry.stat().st_mtime)
+    for entry in reports[:-keep]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def save_report(report, output_path, destination=True):
+    """
+    Сохраняет отчет. destination: True — рядом с результатом, а если там
+    писать нельзя — в папку отчетов настроек программы; строка — своя папка
+
+    Returns:
+        str: путь сохраненного отчета
+    """
+    if destination is True:
+        try:
+            return _write_report(report, report_path(output_path))
+        except OSError:
+            destination = config_folder()
+    os.makedirs(destination, exist_ok=True)
+    path = _write_report(report, report_path(output_path, destination))
+    if os.path.normcase(os.path.abspath(destination)) == os.path.normcase(config_folder()):
+        _prune(destination)
+    return path
+
+
+def add_profile_arguments(parser):
+    """Аргументы профилирования для командной строки (значения — см. profile_options)"""
+    parser.add_argument("--profile-report", action="store_true",
+                        help="записать отчет профилирования рядом с результатом")
+    parser.add_argument("--profile-dir", metavar="ПАПКА",
+                        help="записать отчет профилирования в ПАПКУ")
+    parser.add_argument("--profile-allocations", action="store_true",
+                        help="в отчете — выделения памяти по строкам кода (tracemalloc, "
+                             "обработка в несколько раз медленнее)")
+
+
+def profile_options(args):
+    """Параметры KS2Processor из аргументов add_profile_arguments"""
+    report = args.profile_dir or (True if args.profile_report or args.profile_allocations else None)
+    return {"profile_report": report, "profile_allocations": args.profile_allocations}
+
+
+def report_lines(report, limit=5):
+    """Краткое описание отчета: входы, этапы, самые затратные функции и рост памяти"""
+    inputs = report["inputs"]
+    lines = [f"📈 Отчет профилирования от {report['created']}: {report['status']}, {report['elapsed']} с",
+             f"  {inputs['engine']}: шаблон {inputs['template']} ({inputs['template_rows']} строк), "
+             f"сметы: {', '.join(source['name'] for source in inputs['sources'])}",
+             f"  Таблица: {inputs['rows']} × {inputs['cols']}, ячеек {inputs['cells']}, "
+             f"доля со стилем {inputs['styled_ratio']}"]
+    if report.get("error"):
+        lines.append(f"  ❌ {report['error']}")
+    if report["sampling"]["allocations"]:
+        lines.append("  ⚠️ С отслеживанием выделений памяти: время этапов завышено")
+
+    for phase, info in report["phases"].items():
+        lines.append(f"\n  {phase}: {info['seconds']} с, снимков {info['samples']}, "
+                     f"рост RSS {info['rss_growth_mb']} МБ")
+        for function in info["functions"][:limit]:
+            lines.append(f"    {function['self']:5.1f}% ({function['total']:5.1f}%)  {function['function']}")
+        for function in info["memory"][:limit]:
+            lines.append(f"    💾 {function['self']:5.1f}% роста RSS  {function['function']}")
+        for allocation in info.get("allocations", {}).get("top", [])[:limit]:
+            lines.append(f"    🧩 +{allocation['kb']} КБ  {allocation['line']}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Отчет профилирования обработки КС-2")
+    parser.add_argument("report", help="файл отчета (*.profile.json)")
+    parser.add_argument("--limit", type=int, default=5, help="сколько функций показывать для этапа")
+    parser.add_argument("--flame", metavar="ФАЙЛ",
+                        help="записать свернутые стеки для flamegraph.pl или speedscope")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.report, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"❌ Не удалось прочитать отчет: {e}")
+        return 1
+    print("\n".join(report_lines(report, args.limit)))
+    if args.flame:
+        with open(args.flame, 'w', encoding='utf-8') as f:
+            f.write("\n".join(report["flame"]) + "\n")
+        print(f"\n🔥 Стеки для flame graph: {args.flame}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
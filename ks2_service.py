@@ -0,0 +1,596 @@
+"""
+Локальный сервис обработки КС-2: очередь заданий и пул «прогретых» процессов.
+
+Рабочие процессы запускаются один раз, держат загруженные модули и кэш
+шаблонов, поэтому задание не платит за холодный старт. Сервис слушает
+только localhost и использует лишь стандартную библиотеку.
+
+Примеры:
+    python ks2_service.py --port 8765 --workers 2
+    KS2_SERVICE_URL=http://127.0.0.1:8765 python pretty_gui.py
+
+API (JSON):
+    POST /jobs                {"template": путь, "source": путь} → 202 {"id": ...}
+    GET  /jobs/<id>?since=N   состояние задания и его события начиная с N-го
+    POST /jobs/<id>/cancel    отмена задания в очереди или в работе
+    GET  /jobs/<id>/result    файл результата
+    GET  /health              состояние сервиса (broken — упал рабочий процесс,
+                              пул перезапустится при следующем задании)
+
+События задания — те же события ks2_events, что получают слушатели
+KS2Processor; RemoteKS2Processor передает их своим получателям, поэтому
+журнал и индикатор прогресса GUI работают без изменений.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit, parse_qs
+from urllib.request import Request, urlopen
+
+from ks2_batch import init_worker, load_summary, make_processor
+from ks2_processor import ProcessingCancelled
+from ks2_splice import ENGINES
+from path_manager import apply_profile
+from ks2_events import EventEmitter, TextListener, PROCESS_END
+from ks2_profile import add_profile_arguments, profile_options
+from fast_save import DEFAULT_COMPRESSLEVEL
+
+
+HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE_SIZE = 32
+# Сколько завершенных заданий (и их результатов) хранит сервис
+FINISHED_JOBS_LIMIT = 200
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Состояния задания
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+CANCELLED = "cancelled"
+FINISHED = (DONE, ERROR, CANCELLED)
+
+# Служебное событие рабочего процесса: задание закончилось
+JOB_FINISHED = "job_finished"
+
+JOB_PATH_RE = re.compile(r"^/jobs/([0-9a-f]{32})(/result|/cancel)?$")
+
+logger = logging.getLogger("ks2.service")
+
+
+class ServiceError(Exception):
+    """Ошибка запроса к сервису; status — код ответа HTTP"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# Очередь событий рабочего процесса
+_events = None
+
+
+def init_service_worker(events, use_template_cache, template_cache_dir, save_options, engine):
+    """Инициализирует рабочий процесс сервиса"""
+    global _events
+    _events = events
+    init_worker(use_template_cache, template_cache_dir, None, save_options, engine)
+
+
+def warm_up():
+    """Пустое задание: запускает рабочий процесс заранее"""
+    return os.getpid()
+
+
+class FileCancelFlag:
+    """Признак отмены для процесса-исполнителя: файл-метка в папке задания"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def is_set(self):
+        return os.path.exists(self.path)
+
+
+def run_service_job(job_id, job, cancel_path):
+    """Выполняет задание в рабочем процессе, передавая события в очередь сервиса"""
+    def forward(event):
+        _events.put((job_id, event.kind, event.data))
+
+    status, error = DONE, None
+    try:
+        make_processor(job, [forward], cancel_event=FileCancelFlag(cancel_path)).process()
+    except ProcessingCancelled:
+        status = CANCELLED
+    except Exception as e:
+        status, error = ERROR, str(e)
+    # Последнее событие задания: после него сервис считает задание завершенным
+    _events.put((job_id, JOB_FINISHED, {"status": status, "error": error}))
+
+
+class KS2Service:
+    """Очередь заданий КС-2 и пул рабочих процессов"""
+
+    def __init__(self, work_dir=None, workers=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 use_template_cache=True, template_cache_dir=None, save_options=None,
+                 engine="openpyxl"):
+        """
+        Args:
+            work_dir: папка результатов заданий (по умолчанию временная)
+            workers: число рабочих процессов (по умолчанию — число ядер)
+            queue_size: сколько заданий может ждать и выполняться одновременно
+        """
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix="ks2_service_")
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.context = multiprocessing.get_context("spawn")
+        self.events = self.context.Queue()
+        self.initargs = (self.events, use_template_cache, template_cache_dir, save_options, engine)
+        # Причина поломки пула (аварийно завершился рабочий процесс) и число перезапусков
+        self.pool_error = None
+        self.restarts = 0
+        self.executor = self._start_pool()
+
+        self.reader = threading.Thread(target=self._read_events, daemon=True)
+        self.reader.start()
+
+        # Процессы запускаются сразу, а не при первом задании
+        for future in [self.executor.submit(warm_up) for _ in range(self.workers)]:
+            future.result()
+
+    def _start_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context,
+                                   initializer=init_service_worker, initargs=self.initargs)
+
+    def _restart_pool(self):
+        """
+        Заменяет сломанный пул новым (вызывается под self.lock). Задания
+        старого пула уже завершены с ошибкой, новые процессы запускаются сразу
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = self._start_pool()
+        self.pool_error = None
+        self.restarts += 1
+        logger.warning("Пул рабочих процессов перезапущен")
+        for _ in range(self.workers):
+            self.executor.submit(warm_up)
+
+    def _submit_job(self, *args):
+        """
+        Передает задание пулу (под self.lock); сломанный пул перезапускается.
+        Если и новый пул не принимает задание, сервис отвечает 503
+        """
+        if self.pool_error is not None:
+            self._restart_pool()
+        try:
+            return self.executor.submit(run_service_job, *args)
+        except BrokenProcessPool as e:
+            # Рабочий процесс упал, а задания, которые узнали бы об этом, не было
+            self.pool_error = str(e)
+        try:
+            self._restart_pool()
+            return self.executor.submit(run_service_job, *args)
+        except (BrokenProcessPool, OSError) as e:
+            self.pool_error = str(e)
+            raise ServiceError(f"Пул рабочих процессов недоступен: {e}", status=503)
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.work_dir, job_id)
+
+    def submit(self, request):
+        """
+        Ставит задание в очередь
+
+        Args:
+            request: словарь с путями template и source (файлы на этом компьютере)
+                и необязательным именем результата name
+
+        Returns:
+            dict: описание задания
+        """
+        paths = {}
+        for field in ("template", "source"):
+            path = request.get(field)
+            if not isinstance(path, str) or not path:
+                raise ServiceError(f"Не указано поле {field}")
+            if not os.path.isfile(path):
+                raise ServiceError(f"Файл не найден: {path}")
+            paths[field] = os.path.abspath(path)
+
+        name = os.path.basename(request.get("name") or "") or \
+            f"{os.path.splitext(os.path.basename(paths['source']))[0]}_КС-2.xlsx"
+
+        job_id = uuid.uuid4().hex
+        job_dir = self._job_dir(job_id)
+
+        with self.lock:
+            active = sum(1 for job in self.jobs.values() if job["status"] not in FINISHED)
+            if active >= self.queue_size:
+                raise ServiceError("Очередь заданий заполнена, повторите позже", status=503)
+
+            os.makedirs(job_dir)
+            try:
+                future = self._submit_job(
+                    job_id, {"template": paths["template"], "source": paths["source"],
+                             "output": os.path.join(job_dir, name)},
+                    os.path.join(job_dir, "cancel"))
+            except ServiceError:
+                shutil.rmtree(job_dir, ignore_errors=True)
+                raise
+
+            # Задание появляется в списке, только когда пул его принял
+            job = {
+                "id": job_id,
+                "status": QUEUED,
+                "error": None,
+                "template": paths["template"],
+                "source": paths["source"],
+                "output": os.path.join(job_dir, name),
+                "created": time.time(),
+                "started": None,
+                "finished": None,
+                "events": [],
+                "future": future,
+            }
+            self.jobs[job_id] = job
+
+        future.add_done_callback(lambda f: self._job_done(job_id, f))
+        return self.describe(job_id)
+
+    def _job_done(self, job_id, future):
+        """Задание снято из очереди или рабочий процесс аварийно завершился"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] in FINISHED:
+                return
+            if future.cancelled():
+                self._finish(job, CANCELLED)
+            elif future.exception() is not None:
+                error = future.exception()
+                if isinstance(error, BrokenProcessPool):
+                    # Пул больше не принимает задания: следующее задание его перезапустит
+                    self.pool_error = str(error)
+                self._finish(job, ERROR, str(error))
+
+    def _finish(self, job, status, error=None):
+        """Отмечает задание завершенным и удаляет самые старые завершенные задания"""
+        job["status"] = status
+        job["error"] = error
+        job["finished"] = time.time()
+
+        finished = [job_id for job_id, item in self.jobs.items() if item["status"] in FINISHED]
+        for job_id in finished[:max(len(finished) - FINISHED_JOBS_LIMIT, 0)]:
+            del self.jobs[job_id]
+            shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+
+    def _read_events(self):
+        """Переносит события рабочих процессов в описания заданий"""
+        while True:
+            message = self.events.get()
+            if message is None:
+                return
+            job_id, kind, data = message
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is None or job["status"] in FINISHED:
+                    continue
+                if kind == JOB_FINISHED:
+                    self._finish(job, data["status"], data["error"])
+                    continue
+                if job["status"] == QUEUED:
+                    job["status"] = RUNNING
+                    job["started"] = time.time()
+                job["events"].append(dict(data, event=kind))
+
+    def _get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise ServiceError("Задание не найдено", status=404)
+        return job
+
+    def describe(self, job_id, since=0):
+        """Состояние задания и его события начиная с since"""
+        with self.lock:
+            job = self._get(job_id)
+            return {
+                "id": job_id,
+                "status": job["status"],
+                "error": job["error"],
+                "created": job["created"],
+                "started": job["started"],
+                "finished": job["finished"],
+                "events": job["events"][since:],
+                "events_total": len(job["events"]),
+                "result": job["status"] == DONE,
+            }
+
+    def cancel(self, job_id):
+        """Отменяет задание: из очереди снимается сразу, выполняемое — на ближайшей проверке"""
+        with self.lock:
+            job = self._get(job_id)
+            if job["status"] in FINISHED:
+                raise ServiceError("Задание уже завершено", status=409)
+            future = job["future"]
+        if not future.cancel():
+            with open(os.path.join(self._job_dir(job_id), "cancel"), 'w'):
+                pass
+        return self.describe(job_id)
+
+    def result_path(self, job_id):
+        """Путь результата завершенного задания"""
+        with self.lock:
+            job = self._get(job_id)
+            if job["status"] != DONE:
+                raise ServiceError("Результат еще не готов", status=409)
+            return job["output"]
+
+    def health(self):
+        with self.lock:
+            statuses = [job["status"] for job in self.jobs.values()]
+            pool_error, restarts = self.pool_error, self.restarts
+        return {
+            # broken: рабочий процесс упал, пул перезапустится при следующем задании
+            "status": "ok" if pool_error is None else "broken",
+            "pool_error": pool_error,
+            "pool_restarts": restarts,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queued": statuses.count(QUEUED),
+            "running": statuses.count(RUNNING),
+            "finished": sum(1 for status in statuses if status in FINISHED),
+        }
+
+    def close(self):
+        """Останавливает пул; невыполненные задания отменяются"""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.events.put(None)
+        self.reader.join()
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """HTTP-интерфейс KS2Service (экземпляр сервиса — server.service)"""
+
+    server_version = "KS2Service/1"
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, path):
+        self.send_response(200)
+        self.send_header("Content-Type", XLSX_MIME)
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, DOWNLOAD_CHUNK_SIZE)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            data = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise ServiceError("Тело запроса должно быть JSON")
+        if not isinstance(data, dict):
+            raise ServiceError("Тело запроса должно быть объектом JSON")
+        return data
+
+    def _handle(self, method):
+        service = self.server.service
+        url = urlsplit(self.path)
+        try:
+            match = JOB_PATH_RE.match(url.path)
+            if method == "GET" and url.path == "/health":
+                return self._send_json(service.health())
+            if method == "POST" and url.path == "/jobs":
+                return self._send_json(service.submit(self._read_json()), status=202)
+            if match and method == "GET" and match.group(2) is None:
+                since = int(parse_qs(url.query).get("since", ["0"])[0])
+                return self._send_json(service.describe(match.group(1), max(since, 0)))
+            if match and method == "POST" and match.group(2) == "/cancel":
+                return self._send_json(service.cancel(match.group(1)))
+            if match and method == "GET" and match.group(2) == "/result":
+                return self._send_file(service.result_path(match.group(1)))
+            raise ServiceError("Неизвестный запрос", status=404)
+        except ServiceError as e:
+            self._send_json({"error": str(e)}, status=e.status)
+        except ValueError as e:
+            self._send_json({"error": str(e)}, status=400)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+def make_server(service, port=DEFAULT_PORT):
+    """HTTP-сервер на localhost для сервиса (port=0 — свободный порт)"""
+    server = ThreadingHTTPServer((HOST, port), ServiceRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+class KS2ServiceClient:
+    """Клиент сервиса обработки"""
+
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _open(self, method, path, payload=None):
+        data = None if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        request = Request(self.url + path, data=data, method=method,
+                          headers={"Content-Type": "application/json"})
+        try:
+            return urlopen(request, timeout=self.timeout)
+        except HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error") or str(e)
+            except ValueError:
+                message = str(e)
+            raise ServiceError(message, status=e.code)
+        except URLError as e:
+            raise ServiceError(f"Сервис обработки недоступен: {e.reason}", status=503)
+
+    def _request(self, method, path, payload=None):
+        with self._open(method, path, payload) as response:
+            return json.loads(response.read())
+
+    def health(self):
+        return self._request("GET", "/health")
+
+    def submit(self, template, source, name=None):
+        """Ставит задание в очередь и возвращает его идентификатор"""
+        payload = {"template": os.path.abspath(template), "source": os.path.abspath(source)}
+        if name:
+            payload["name"] = name
+        return self._request("POST", "/jobs", payload)["id"]
+
+    def status(self, job_id, since=0):
+        return self._request("GET", f"/jobs/{job_id}?since={since}")
+
+    def cancel(self, job_id):
+        return self._request("POST", f"/jobs/{job_id}/cancel")
+
+    def download(self, job_id, path):
+        """Сохраняет результат задания в path"""
+        with self._open("GET", f"/jobs/{job_id}/result") as response, open(path, 'wb') as f:
+            shutil.copyfileobj(response, f, DOWNLOAD_CHUNK_SIZE)
+
+
+class RemoteKS2Processor:
+    """
+    Обработка через сервис с интерфейсом KS2Processor: события задания
+    передаются получателям так же, как при локальной обработке
+    """
+
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, template_path, source_path, output_path, service_url,
+                 listeners=None, cancel_event=None):
+        self.template_path = template_path
+        self.source_path = source_path
+        self.output_path = output_path
+        self.client = KS2ServiceClient(service_url)
+        self.cancel_event = cancel_event
+        self.events = EventEmitter([TextListener()] if listeners is None else listeners)
+        self.stats = {}
+
+    def process(self):
+        """Выполняет задание на сервисе и сохраняет результат в output_path"""
+        client = self.client
+        job_id = client.submit(self.template_path, self.source_path,
+                               name=os.path.basename(self.output_path))
+        since = 0
+        cancel_sent = False
+
+        while True:
+            if not cancel_sent and self.cancel_event is not None and self.cancel_event.is_set():
+                cancel_sent = True
+                try:
+                    client.cancel(job_id)
+                except ServiceError:
+                    # Задание успело завершиться
+                    pass
+
+            status = client.status(job_id, since)
+            for data in status["events"]:
+                kind = data.pop("event")
+                if kind == PROCESS_END:
+                    self.stats = {key: value for key, value in data.items() if key != "output"}
+                self.events.emit(kind, **data)
+            since += len(status["events"])
+
+            if status["status"] in FINISHED:
+                break
+            time.sleep(self.POLL_INTERVAL)
+
+        if status["status"] == CANCELLED:
+            raise ProcessingCancelled("Обработка отменена пользователем")
+        if status["status"] == ERROR:
+            raise ServiceError(status["error"] or "Ошибка обработки на сервисе", status=500)
+
+        client.download(job_id, self.output_path)
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный сервис обработки КС-2")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="порт на 127.0.0.1")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="число рабочих процессов (по умолчанию — число ядер)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="сколько заданий может ждать и выполняться одновременно")
+    parser.add_argument("--work-dir", help="папка результатов заданий")
+    parser.add_argument("--template-cache-dir",
+                        help="папка для сохранения разобранных шаблонов на диск")
+    parser.add_argument("--no-fast-save", action="store_true",
+                        help="сохранять обычным способом openpyxl")
+    parser.add_argument("--compresslevel", type=int, default=DEFAULT_COMPRESSLEVEL,
+                        choices=range(10), metavar="0-9", help="степень сжатия результата")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="openpyxl",
+                        help="способ обработки: openpyxl или прямая вставка XML (splice)")
+    parser.add_argument("--memory-budget", type=int, metavar="МБ",
+                        help="бюджет памяти на задание: смета вписывается в акт потоком частями")
+    parser.add_argument("--summary", metavar="JSON",
+                        help="настройки итогов сметы: суммы и проверки после вставки (нужен numpy)")
+    add_profile_arguments(parser)
+    parser.add_argument("--profile",
+                        help="профиль настроек (path_manager): шаблон, папка, процессы, движок по умолчанию")
+    args = apply_profile(parser, parser.parse_args(argv), argv)
+    try:
+        summary = load_summary(args.summary)
+    except (OSError, ValueError, RuntimeError) as e:
+        parser.error(str(e))
+
+    service = KS2Service(work_dir=args.work_dir, workers=args.workers, queue_size=args.queue_size,
+                         template_cache_dir=args.template_cache_dir,
+                         save_options={"fast_save": not args.no_fast_save,
+                                       "compresslevel": args.compresslevel,
+                                       "memory_budget": args.memory_budget,
+                                       "summary": summary,
+                                       **profile_options(args)},
+                         engine=args.engine)
+    server = make_server(service, args.port)
+    print(f"🖧 Сервис КС-2: http://{HOST}:{server.server_port}, процессов {service.workers}, "
+          f"папка {service.work_dir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⛔ Остановка сервиса")
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
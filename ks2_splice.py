@@ -0,0 +1,1110 @@
+"""
+Прямая вставка сметы в шаблон КС-2 на уровне XML.
+
+KS2SpliceProcessor выполняет ту же работу, что KS2Processor, но не строит
+объектную модель openpyxl ни для шаблона, ни для сметы. Строки листа
+шаблона переписываются как текст XML: номера строк и адреса ячеек,
+ссылки формул, объединения, условное форматирование, проверки данных,
+гиперссылки, области печати. Строки сметы читаются из архива потоком и
+вписываются в освободившиеся строки вместе с высотами, объединения и
+ширины столбцов сметы дописываются в XML листа, строки сметы добавляются в таблицу
+общих строк шаблона (каждая уникальная строка один раз), а ее стили — в
+таблицу стилей шаблона. Остальные части архива шаблона переносятся в
+результат байт в байт.
+
+Если в книгах встречается то, что здесь не обрабатывается (рисунки или
+примечания на листе КС-2, нестандартная структура пакета и т.п.),
+обработка выполняется обычным путем KS2Processor.
+"""
+import html
+import posixpath
+import re
+import shutil
+import tempfile
+from xml.sax.saxutils import escape
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+from openpyxl import Workbook
+from openpyxl.formula.translate import Translator
+from openpyxl.packaging.relationship import get_rels_path
+from openpyxl.styles.stylesheet import apply_stylesheet, write_stylesheet
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.xml.constants import SHARED_STRINGS
+from openpyxl.xml.functions import tostring
+
+from formula_refs import map_reference, shift_formula_rows, move_formula_block, offset_formula_rows
+from shared_strings import SharedStringTable, parse_shared_strings
+from ks2_events import (
+    ENGINE_FALLBACK, SHEETS_FOUND, ROWS_SHIFTED, INSERT_START, INSERT_PROGRESS,
+    CELLS_COPIED, LAYOUT_COPIED, HEADER_SHIFT, RANGE_SHIFTED,
+)
+from ks2_processor import KS2Processor, PROGRESS_STEP, import_summary
+from memory_budget import BUFFER_SHARE
+from sheet_layout import SheetLayout, MergeIndex, bounds_ref, overlay_columns
+from style_transfer import StyleTransfer
+from table_dimensions import scan_sheet_xml_bounds
+
+
+START_ROW = 20
+# Области шапки, сдвигаемые влево: (строка, столбец) начала и конца
+HEADER_RANGES = (((1, 7), (18, 8)), ((12, 5), (18, 6)))
+
+READ_CHUNK_SIZE = 1024 * 1024
+# Вставленные строки копятся в памяти до этого размера, дальше — на диске
+SPOOL_MAX_SIZE = 32 * 1024 * 1024
+
+# Связи листа КС-2, которые не зависят от содержимого строк
+SUPPORTED_SHEET_RELS = ("/printerSettings", "/hyperlink", "/table")
+
+ROW_RE = re.compile(r"<row\b([^>]*?)(?:/>|>(.*?)</row>)", re.S)
+CELL_RE = re.compile(r"<c\b([^>]*?)(?:/>|>(.*?)</c>)", re.S)
+ATTR_RE = re.compile(r'([\w:]+)="([^"]*)"')
+ROW_NUM_RE = re.compile(r'\sr="(\d+)"')
+CELL_REF_RE = re.compile(r'\br="([A-Z]{1,3})(\d+)"')
+CELL_ATTRS_RE = re.compile(r' r="([A-Z]{1,3})\d+"(?: s="(\d+)")?(?: t="(\w+)")?')
+STYLE_ATTR_RE = re.compile(r'\bs="(\d+)"')
+TYPE_ATTR_RE = re.compile(r'\bt="(\w+)"')
+FORMULA_RE = re.compile(r"<f\b([^>]*?)(?:/>|>(.*?)</f>)", re.S)
+FORMULA_REF_RE = re.compile(r'(\sref=")([^"]*)(")')
+VALUE_RE = re.compile(r"<v>(.*?)</v>", re.S)
+INLINE_RE = re.compile(r"<is>(.*?)</is>", re.S)
+
+MERGE_REF_RE = re.compile(r'(<mergeCell\b[^>]*?\sref=")([^"]*)(")')
+MERGE_CELLS_RE = re.compile(r"<mergeCells\b[^>]*?(?:/>|>(.*?)</mergeCells>)", re.S)
+# Элементы листа, которые идут после <mergeCells>
+MERGE_CELLS_BEFORE = ("<phoneticPr", "<conditionalFormatting", "<dataValidations", "<hyperlinks",
+                      "<printOptions", "<pageMargins", "<pageSetup", "<headerFooter", "<rowBreaks",
+                      "<colBreaks", "<customProperties", "<cellWatches", "<ignoredErrors",
+                      "<smartTags", "<drawing", "<legacyDrawing", "<picture", "<oleObjects",
+                      "<controls", "<webPublishItems", "<tableParts", "<extLst", "</worksheet>")
+COLS_RE = re.compile(r"<cols\b[^>]*?(?:/>|>(.*?)</cols>)", re.S)
+COL_RE = re.compile(r"<col\b([^>]*?)/?>")
+SQREF_RE = re.compile(r'(<(?:conditionalFormatting|dataValidation)\b[^>]*?\ssqref=")([^"]*)(")')
+TAG_REF_RE = re.compile(r'(<(?:hyperlink|autoFilter)\b[^>]*?\sref=")([^"]*)(")')
+RULE_FORMULA_RE = re.compile(r"(<(formula|formula1|formula2|xm:f)>)(.*?)(</\2>)", re.S)
+XM_SQREF_RE = re.compile(r"(<xm:sqref>)(.*?)(</xm:sqref>)", re.S)
+DIMENSION_RE = re.compile(r'(<dimension\b[^>]*?\sref=")([^"]*)(")')
+TABLE_REF_RE = re.compile(r'(<(?:table|autoFilter)\b[^>]*?\sref=")([^"]*)(")')
+
+SHEET_RE = re.compile(r"<sheet\b([^>]*?)/?>")
+RELATIONSHIP_RE = re.compile(r"<Relationship\b([^>]*?)/?>")
+ACTIVE_TAB_RE = re.compile(r'<workbookView\b[^>]*?\sactiveTab="(\d+)"')
+DEFINED_NAME_RE = re.compile(r"(<definedName\b([^>]*)>)(.*?)(</definedName>)", re.S)
+CALC_PR_RE = re.compile(r"<calcPr\b([^>]*?)/?>")
+CALC_PR_AFTER = ("</definedNames>", "</externalReferences>", "</functionGroups>", "</sheets>")
+PRINT_NAMES = ("_xlnm.Print_Area", "_xlnm.Print_Titles")
+SHARED_STRINGS_PATH = "xl/sharedStrings.xml"
+SHARED_STRINGS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"
+
+
+class SpliceUnsupported(Exception):
+    """Книга содержит то, что прямая вставка не обрабатывает"""
+
+
+def _attrs(text):
+    return dict(ATTR_RE.findall(text))
+
+
+def _read_text(archive, path):
+    return archive.read(path).decode("utf-8")
+
+
+def _part_path(base, target):
+    """Путь части архива по цели связи относительно части base"""
+    if target.startswith("/"):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base), target))
+
+
+def _relationships(archive, part):
+    """
+    Связи части архива
+
+    Returns:
+        dict: Id → (тип, путь цели); внешние связи не включаются
+    """
+    rels_path = get_rels_path(part)
+    if rels_path not in archive.NameToInfo:
+        return {}
+    rels = {}
+    for match in RELATIONSHIP_RE.finditer(_read_text(archive, rels_path)):
+        attrs = _attrs(match.group(1))
+        if attrs.get("TargetMode") == "External":
+            rels[attrs["Id"]] = (attrs.get("Type", ""), None)
+        else:
+            rels[attrs["Id"]] = (attrs.get("Type", ""), _part_path(part, attrs["Target"]))
+    return rels
+
+
+def _workbook_sheets(archive, workbook_xml):
+    """
+    Листы книги в порядке следования
+
+    Returns:
+        list: (название, тип связи, путь части)
+    """
+    rels = _relationships(archive, "xl/workbook.xml")
+    sheets = []
+    for match in SHEET_RE.finditer(workbook_xml):
+        attrs = _attrs(match.group(1))
+        rel_id = next((value for name, value in attrs.items() if name.endswith(":id")), None)
+        rel_type, path = rels.get(rel_id, ("", None))
+        sheets.append((html.unescape(attrs.get("name", "")), rel_type, path))
+    return sheets
+
+
+def _load_stylesheet(archive):
+    """Таблица стилей книги в виде пустой книги openpyxl с ее стилями"""
+    workbook = Workbook()
+    apply_stylesheet(archive, workbook)
+    return workbook
+
+
+def _split_sheet(xml):
+    """
+    Делит XML листа на начало, содержимое sheetData и окончание
+
+    Returns:
+        tuple: (head, rows_xml, tail)
+    """
+    start = xml.find("<sheetData")
+    if start < 0:
+        raise SpliceUnsupported("нестандартная разметка листа КС-2")
+    open_end = xml.index(">", start)
+    if xml[open_end - 1] == "/":
+        return xml[:start], "", xml[open_end + 1:]
+    end = xml.index("</sheetData>", open_end)
+    return xml[:start], xml[open_end + 1:end], xml[end + len("</sheetData>"):]
+
+
+class XmlCell:
+    """Ячейка листа шаблона: столбец, стиль, тип и содержимое тега в виде XML"""
+
+    __slots__ = ("col", "s", "t", "extra", "inner")
+
+    def __init__(self, col, s=0, t=None, extra="", inner=""):
+        self.col = col
+        self.s = s
+        self.t = t
+        self.extra = extra
+        self.inner = inner
+
+    def to_xml(self, row):
+        attrs = f' s="{self.s}"' if self.s else ""
+        if self.t:
+            attrs += f' t="{self.t}"'
+        attrs += self.extra
+        ref = f"{get_column_letter(self.col)}{row}"
+        if self.inner:
+            return f'<c r="{ref}"{attrs}>{self.inner}</c>'
+        return f'<c r="{ref}"{attrs}/>'
+
+
+class XmlRow:
+    """Строка листа шаблона: номер, атрибуты (высота и т.п.) и ячейки"""
+
+    __slots__ = ("idx", "attrs", "cells")
+
+    def __init__(self, idx, attrs="", cells=None):
+        self.idx = idx
+        self.attrs = attrs
+        self.cells = cells if cells is not None else []
+
+    def to_xml(self):
+        if not self.cells:
+            return f'<row r="{self.idx}"{self.attrs}/>'
+        cells = "".join(cell.to_xml(self.idx) for cell in self.cells)
+        return f'<row r="{self.idx}"{self.attrs}>{cells}</row>'
+
+
+def parse_rows(rows_xml):
+    """Разбирает строки листа шаблона"""
+    rows = []
+    for row_match in ROW_RE.finditer(rows_xml):
+        row_attrs = row_match.group(1)
+        number = ROW_NUM_RE.search(row_attrs)
+        if number is None:
+            raise SpliceUnsupported("строки листа КС-2 без номеров")
+        row = XmlRow(int(number.group(1)), ROW_NUM_RE.sub("", row_attrs, count=1).rstrip())
+
+        for cell_match in CELL_RE.finditer(row_match.group(2) or ""):
+            col, s, t, extra = None, 0, None, ""
+            for name, value in ATTR_RE.findall(cell_match.group(1)):
+                if name == "r":
+                    col = column_index_from_string(value.rstrip("0123456789"))
+                elif name == "s":
+                    s = int(value)
+                elif name == "t":
+                    t = value
+                else:
+                    extra += f' {name}="{value}"'
+            if col is None:
+                raise SpliceUnsupported("ячейки листа КС-2 без адресов")
+            row.cells.append(XmlCell(col, s, t, extra, cell_match.group(2) or ""))
+        rows.append(row)
+    return rows
+
+
+def _shift_refs(value, title, map_row):
+    """Пересчитывает список диапазонов через пробел (sqref) или один диапазон"""
+    return " ".join(map_reference(part, title, map_row, int) for part in value.split())
+
+
+def _shift_formula_xml(text, title, start_row, rows_to_insert):
+    """Пересчитывает экранированный текст формулы из XML"""
+    formula = shift_formula_rows("=" + html.unescape(text), title, start_row, rows_to_insert)
+    return escape(formula[1:])
+
+
+def rewrite_formula_texts(xml, rewrite, external=False, needle=None):
+    """
+    Пересчитывает тексты формул <f> функцией rewrite(формула, external).
+    needle: пересчитываются только формулы, содержащие эту строку
+    """
+    def formula(match):
+        text = match.group(2)
+        if not text or (needle is not None and needle not in text):
+            return match.group(0)
+        text = escape(rewrite("=" + html.unescape(text), external)[1:])
+        return f"<f{match.group(1)}>{text}</f>"
+
+    return FORMULA_RE.sub(formula, xml)
+
+
+def rewrite_formulas(rows, title, start_row, rows_to_insert):
+    """
+    Пересчитывает формулы строк шаблона после вставки строк.
+    Общие формулы раскрываются в обычные (как при загрузке openpyxl),
+    сохраненные результаты формул удаляются — Excel пересчитает их
+    """
+    shared = {}
+    for row in rows:
+        for cell in row.cells:
+            match = FORMULA_RE.search(cell.inner) if "<f" in cell.inner else None
+            if match is None:
+                continue
+            attrs = _attrs(match.group(1))
+            text = match.group(2) or ""
+            kind = attrs.get("t")
+            coord = f"{get_column_letter(cell.col)}{row.idx}"
+
+            if kind == "dataTable" or not (text or kind == "shared"):
+                continue
+            if kind == "shared":
+                si = attrs.get("si")
+                if text:
+                    shared[si] = Translator("=" + html.unescape(text), origin=coord)
+                elif si in shared:
+                    text = escape(shared[si].translate_formula(coord)[1:])
+                else:
+                    continue
+                formula = f"<f>{_shift_formula_xml(text, title, start_row, rows_to_insert)}</f>"
+            else:
+                if kind == "array" and "ref" in attrs:
+                    attrs["ref"] = _shift_refs(attrs["ref"], title,
+                                               lambda r: r + rows_to_insert if r >= start_row else r)
+                f_attrs = "".join(f' {name}="{value}"' for name, value in attrs.items())
+                formula = f"<f{f_attrs}>{_shift_formula_xml(text, title, start_row, rows_to_insert)}</f>"
+
+            cell.inner = formula
+            cell.t = None
+
+
+def shift_sheet_parts(xml, title, start_row, rows_to_insert):
+    """
+    Пересчитывает адреса в частях листа вне sheetData: объединения, условное
+    форматирование, проверки данных, гиперссылки, автофильтр.
+    Разрывы страниц и выделение, как и в KS2Processor, не изменяются
+    """
+    def map_row(row):
+        return row + rows_to_insert if row >= start_row else row
+
+    def refs(match):
+        return match.group(1) + _shift_refs(match.group(2), title, map_row) + match.group(3)
+
+    def formula(match):
+        text = _shift_formula_xml(match.group(3), title, start_row, rows_to_insert)
+        return match.group(1) + text + match.group(4)
+
+    xml = MERGE_REF_RE.sub(refs, xml)
+    xml = SQREF_RE.sub(refs, xml)
+    xml = TAG_REF_RE.sub(refs, xml)
+    xml = XM_SQREF_RE.sub(refs, xml)
+    return RULE_FORMULA_RE.sub(formula, xml)
+
+
+class KS2SpliceProcessor(KS2Processor):
+    """
+    Вставка сметы в шаблон КС-2 правкой XML без загрузки книг в openpyxl.
+    Интерфейс, события и результат те же, что у KS2Processor
+    """
+
+    def run(self):
+        """Этапы обработки правкой XML; при неподдерживаемом содержимом — обычным путем"""
+        events = self.events
+        self.check_cancelled()
+        try:
+            with events.phase("load"):
+                self.load_package()
+        except SpliceUnsupported as e:
+            return self.fallback(str(e))
+
+        self.stats["engine"] = "splice"
+        try:
+            self.run_splice()
+        finally:
+            self.close_package()
+
+    def fallback(self, reason):
+        """Обрабатывает книги обычным путем KS2Processor"""
+        self.close_package()
+        self.stats["engine"] = "openpyxl"
+        self.events.emit(ENGINE_FALLBACK, reason=reason)
+        return KS2Processor.run(self)
+
+    def close_package(self):
+        """Закрывает архивы шаблона и сметы"""
+        for archive in (getattr(self, "template_zip", None), getattr(self, "source_zip", None)):
+            if archive is not None:
+                archive.close()
+        self.template_zip = self.source_zip = None
+
+    def load_package(self):
+        """Открывает архивы и разбирает части, нужные для вставки"""
+        self.template_zip = ZipFile(self.template_path)
+        self.source_zip = ZipFile(self.source_path)
+        template, source = self.template_zip, self.source_zip
+
+        try:
+            self.workbook_xml = _read_text(template, "xl/workbook.xml")
+            source_workbook = _read_text(source, "xl/workbook.xml")
+        except KeyError:
+            raise SpliceUnsupported("нестандартная структура пакета")
+
+        # Лист шаблона
+        sheets = _workbook_sheets(template, self.workbook_xml)
+        for index, (name, rel_type, path) in enumerate(sheets):
+            if name.startswith("КС-2"):
+                break
+        else:
+            raise ValueError("Не найден лист, начинающийся с 'КС-2'")
+        if not rel_type.endswith("/worksheet") or path not in template.NameToInfo:
+            raise SpliceUnsupported(f"лист '{name}' не является обычным листом")
+        self.sheet_title, self.sheet_index, self.sheet_path = name, index, path
+        self.referencing_parts = self._referencing_parts(sheets)
+        self.reference_passes = []
+
+        self.sheet_rels = _relationships(template, path)
+        for rel_type, target in self.sheet_rels.values():
+            if not rel_type.endswith(SUPPORTED_SHEET_RELS):
+                raise SpliceUnsupported(f"на листе '{name}' есть {rel_type.rsplit('/', 1)[-1]}")
+
+        self.sheet_head, rows_xml, self.sheet_tail = _split_sheet(_read_text(template, path))
+        self.template_rows = parse_rows(rows_xml)
+
+        # Лист сметы: активный лист книги, как у openpyxl
+        source_sheets = _workbook_sheets(source, source_workbook)
+        active = ACTIVE_TAB_RE.search(source_workbook)
+        active = int(active.group(1)) if active else 0
+        if not source_sheets or active >= len(source_sheets):
+            raise SpliceUnsupported("в смете не найден активный лист")
+        self.source_title, rel_type, self.source_sheet_path = source_sheets[active]
+        if not rel_type.endswith("/worksheet") or self.source_sheet_path not in source.NameToInfo:
+            raise SpliceUnsupported(f"лист сметы '{self.source_title}' не является обычным листом")
+
+        # Общие строки: строки сметы добавляются к строкам шаблона
+        self.source_strings = self._shared_strings(source, "сметы") or []
+        self.strings_path = None
+        for rel_type, target in _relationships(template, "xl/workbook.xml").values():
+            if rel_type.endswith("/sharedStrings") and target in template.NameToInfo:
+                self.strings_path = target
+        self.strings = SharedStringTable(self._shared_strings(template, "шаблона") or ())
+
+        # Таблицы стилей обеих книг
+        self.template_styles = _load_stylesheet(template)
+        self.source_styles = _load_stylesheet(source)
+        self.styles_size = self._stylesheet_size()
+
+        self.events.emit(SHEETS_FOUND, template_sheet=self.sheet_title, source_sheet=self.source_title)
+
+    def _referencing_parts(self, sheets):
+        """
+        XML остальных листов шаблона, в тексте которых встречается имя листа КС-2.
+        Их формулы пересчитываются при сохранении
+        """
+        template = self.template_zip
+        needle = self.title_needle = escape(self.sheet_title.replace("'", "''"))
+        parts = {}
+        for name, rel_type, path in sheets:
+            if path == self.sheet_path or not rel_type.endswith("/worksheet") or path not in template.NameToInfo:
+                continue
+            xml = _read_text(template, path)
+            if needle not in xml:
+                continue
+            # Общие формулы openpyxl раскрывает при загрузке; здесь их пришлось бы раскрывать на чужом листе
+            for match in FORMULA_RE.finditer(xml):
+                if needle in (match.group(2) or "") and _attrs(match.group(1)).get("t") == "shared":
+                    raise SpliceUnsupported(f"общие формулы листа '{name}' ссылаются на лист КС-2")
+            parts[path] = xml
+        return parts
+
+    def rewrite_references(self, formula, external, print_name=False):
+        """
+        Применяет к формуле все пересчеты ссылок на лист КС-2 по порядку:
+        вставку строк и переносы областей шапки (области печати переносы не затрагивают)
+        """
+        for rewrite, moves_print in self.reference_passes:
+            if moves_print or not print_name:
+                formula = rewrite(formula, external)
+        return formula
+
+    def _shared_strings(self, archive, owner):
+        """Содержимое элементов <si> общих строк книги (None, если их нет)"""
+        for rel_type, target in _relationships(archive, "xl/workbook.xml").values():
+            if rel_type.endswith("/sharedStrings") and target in archive.NameToInfo:
+                entries = parse_shared_strings(_read_text(archive, target))
+                if entries is None:
+                    raise SpliceUnsupported(f"нестандартная разметка общих строк {owner}")
+                return entries
+        return None
+
+    def _stylesheet_size(self):
+        wb = self.template_styles
+        return (len(wb._cell_styles), len(wb._fonts), len(wb._fills), len(wb._borders),
+                len(wb._number_formats), len(wb._protections), len(wb._alignments))
+
+    def get_source_dimensions(self):
+        """
+        Границы таблицы сметы по XML листа (None, если у ячеек нет адресов).
+        В том же проходе собирается разметка сметы (source_layout) и, если
+        включены итоги, их столбцы (summary_scanner)
+        """
+        self.source_layout = SheetLayout()
+        with self.source_zip.open(self.source_sheet_path) as source:
+            return scan_sheet_xml_bounds(source, self.source_layout, self.summary_scanner)
+
+    def template_merges(self):
+        """Объединенные области листа шаблона (MergeIndex)"""
+        return MergeIndex.from_refs(match.group(2) for match in MERGE_REF_RE.finditer(self.sheet_tail))
+
+    def run_splice(self):
+        events = self.events
+
+        self.summary_scanner = self.start_summary_scan()
+        with events.phase("dimensions"):
+            bounds = self.get_source_dimensions()
+        if bounds is None:
+            return self.fallback("у ячеек сметы нет адресов")
+        source_rows, source_cols = bounds
+        self.source_layout = self.source_layout.table(source_rows, source_cols).shifted(START_ROW - 1)
+
+        merged_rows = [bounds[2] for bounds in self.template_merges().ranges]
+        template_rows = max([row.idx for row in self.template_rows if row.cells] + merged_rows + [1])
+        self.stats.update(source_rows=source_rows, source_cols=source_cols, template_rows=template_rows)
+
+        self.check_cancelled()
+        with events.phase("shift"):
+            gap = self.shift_rows_xml(START_ROW, source_rows)
+
+        self.check_cancelled()
+        with events.phase("insert", total=source_rows):
+            inserted = self.insert_rows_xml(START_ROW, source_rows, source_cols, gap)
+
+        try:
+            if self.summary:
+                self.check_cancelled()
+                with events.phase("summary"):
+                    self.write_summary_xml(START_ROW, source_rows, source_cols)
+
+            self.check_cancelled()
+            with events.phase("shift_range"):
+                columns_to_shift = max(source_cols - 8, 0)
+                self.stats["header_shift"] = columns_to_shift
+                events.emit(HEADER_SHIFT, columns=columns_to_shift, last_col=source_cols)
+
+                if columns_to_shift:
+                    for range_start, range_end in HEADER_RANGES:
+                        self.shift_header_xml(range_start, range_end, columns_to_shift)
+
+            self.check_cancelled()
+            with events.phase("save"):
+                self.save_splice(inserted, source_rows, source_cols)
+        finally:
+            inserted.close()
+
+    def shift_rows_xml(self, start_row, rows_to_insert):
+        """
+        Сдвигает строки шаблона начиная с start_row вниз
+
+        Returns:
+            dict: номер освободившейся строки → {столбец: стиль} ячеек шаблона,
+                стоявших там до сдвига (стили остаются на месте, как в openpyxl)
+        """
+        title = self.sheet_title
+        gap = {}
+        moved = 0
+
+        if rows_to_insert:
+            self.reference_passes.append((
+                lambda formula, external: shift_formula_rows(formula, title, start_row,
+                                                             rows_to_insert, external),
+                True))
+            rewrite_formulas(self.template_rows, title, start_row, rows_to_insert)
+            cell_styles = self.template_styles._cell_styles
+            for row in self.template_rows:
+                if row.idx < start_row:
+                    continue
+                if row.idx < start_row + rows_to_insert:
+                    styled = {cell.col: cell.s for cell in row.cells if any(cell_styles[cell.s])}
+                    if styled:
+                        gap[row.idx] = styled
+                moved += len(row.cells)
+                row.idx += rows_to_insert
+
+            self.sheet_tail = shift_sheet_parts(self.sheet_tail, title, start_row, rows_to_insert)
+
+        self.stats["cells_moved"] = moved
+        self.events.emit(ROWS_SHIFTED, start_row=start_row, rows=rows_to_insert, cells=moved)
+        return gap
+
+    def _merged_blocks(self, start_row, end_row):
+        """Объединенные области шаблона, задевающие строки start_row..end_row"""
+        return self.template_merges().sweep().covering(start_row, end_row)
+
+    def _check_merged(self, blocks, row_idx, col_idx, action):
+        """Ячейку внутри объединенной области (кроме левой верхней) изменить нельзя"""
+        for min_row, min_col, max_row, max_col in blocks:
+            if (min_col <= col_idx <= max_col and min_row <= row_idx <= max_row
+                    and (row_idx, col_idx) != (min_row, min_col)):
+                raise ValueError(f"Ячейка {get_column_letter(col_idx)}{row_idx} входит в объединенную "
+                                 f"область {bounds_ref((min_row, min_col, max_row, max_col))} "
+                                 f"и не может быть {action}")
+
+    def insert_layout_xml(self, layout, template_merges):
+        """
+        Переносит разметку сметы (уже сдвинутую к строке вставки) в XML листа
+        так же, как KS2Processor.insert_layout: ширины столбцов — в <cols>,
+        объединения — в <mergeCells>. Высоты строк пишет insert_rows_xml
+        """
+        template_merges.check_free(layout.merged, "объединена")
+
+        if layout.columns:
+            match = COLS_RE.search(self.sheet_head)
+            base = []
+            if match is not None:
+                for col_match in COL_RE.finditer(match.group(1) or ""):
+                    attrs = _attrs(col_match.group(1))
+                    lo, hi = int(attrs.pop("min")), int(attrs.pop("max"))
+                    base.append((lo, hi, attrs))
+            cols = "".join(
+                f'<col min="{lo}" max="{hi}"' + "".join(f' {key}="{value}"' for key, value in data.items())
+                + "/>" for lo, hi, data, override in overlay_columns(base, layout.columns))
+            cols = f"<cols>{cols}</cols>"
+            head = self.sheet_head
+            if match is None:
+                self.sheet_head = head + cols
+            else:
+                self.sheet_head = head[:match.start()] + cols + head[match.end():]
+
+        if layout.merged:
+            tail = self.sheet_tail
+            refs = "".join(f'<mergeCell ref="{bounds_ref(bounds)}"/>' for bounds in layout.merged)
+            count = len(template_merges) + len(layout.merged)
+            match = MERGE_CELLS_RE.search(tail)
+            if match is not None:
+                merge_cells = f'<mergeCells count="{count}">{match.group(1) or ""}{refs}</mergeCells>'
+                self.sheet_tail = tail[:match.start()] + merge_cells + tail[match.end():]
+            else:
+                pos = min(pos for pos in (tail.find(tag) for tag in MERGE_CELLS_BEFORE) if pos >= 0)
+                self.sheet_tail = tail[:pos] + f'<mergeCells count="{count}">{refs}</mergeCells>' + tail[pos:]
+
+        counts = {"merged": len(layout.merged), "rows": len(layout.rows), "columns": len(layout.columns)}
+        self.stats["layout"] = counts
+        self.events.emit(LAYOUT_COPIED, **counts)
+
+    def _source_value(self, t, inner, offset):
+        """
+        Содержимое ячейки сметы для листа шаблона
+
+        Returns:
+            tuple: (XML содержимого, тип ячейки)
+        """
+        if not inner:
+            return "", None
+
+        if "<f" in inner:
+            match = FORMULA_RE.search(inner)
+            if match is not None:
+                # Ссылки формул сметы сдвигаются вместе с ее строками; подчиненные
+                # ячейки общей формулы текста не хранят и следуют за главной
+                attrs, text = match.group(1), match.group(2)
+                if 'ref="' in attrs:
+                    attrs = FORMULA_REF_RE.sub(
+                        lambda m: m.group(1) + _shift_refs(m.group(2), None, lambda r: r + offset)
+                        + m.group(3), attrs, count=1)
+                if not text:
+                    return f"<f{attrs}/>" if text is None else f"<f{attrs}></f>", None
+                formula = offset_formula_rows("=" + html.unescape(text), self.source_title, offset)
+                return f"<f{attrs}>{escape(formula[1:])}</f>", None
+
+        # Строки записываются ссылками в общую таблицу
+        if t == "inlineStr":
+            match = INLINE_RE.search(inner)
+            if match is None:
+                return "", None
+            return f"<v>{self.strings.add_xml(match.group(1))}</v>", "s"
+
+        match = VALUE_RE.search(inner)
+        if match is None:
+            return "", None
+        value = match.group(1)
+
+        if t == "s":
+            return f"<v>{self.strings.add_xml(self.source_strings[int(value)])}</v>", "s"
+        if t == "str":
+            space = ' xml:space="preserve"' if value != value.strip() else ""
+            return f"<v>{self.strings.add_xml(f'<t{space}>{value}</t>')}</v>", "s"
+        if t == "n":
+            t = None
+        return f"<v>{value}</v>", t
+
+    def iter_source_rows(self, source_rows):
+        """
+        Читает строки листа сметы потоком до строки source_rows
+
+        Yields:
+            tuple: (номер строки, XML ячеек строки)
+        """
+        with self.source_zip.open(self.source_sheet_path) as source:
+            tail = b""
+            finished = False
+            while not finished:
+                data = source.read(READ_CHUNK_SIZE)
+                if data:
+                    # Фрагмент режется по концу строки листа
+                    data = tail + data
+                    cut = data.rfind(b"</row>") + len(b"</row>")
+                    if cut < len(b"</row>"):
+                        tail = data
+                        continue
+                    data, tail = data[:cut], data[cut:]
+                else:
+                    data, finished = tail, True
+
+                for row_match in ROW_RE.finditer(data.decode("utf-8")):
+                    number = ROW_NUM_RE.search(row_match.group(1))
+                    if number is None:
+                        raise ValueError("В строках сметы нет номеров")
+                    source_row = int(number.group(1))
+                    if source_row > source_rows:
+                        return
+                    yield source_row, row_match.group(2) or ""
+
+    def spool_size(self):
+        """Сколько XML вставленных строк держать в памяти; при бюджете памяти — его долю"""
+        if self.memory_budget:
+            return min(SPOOL_MAX_SIZE, int(self.memory_budget * 1024 * 1024 * BUFFER_SHARE))
+        return SPOOL_MAX_SIZE
+
+    def insert_rows_xml(self, start_row, source_rows, source_cols, gap):
+        """
+        Переписывает строки сметы в строки шаблона начиная со start_row
+
+        Returns:
+            SpooledTemporaryFile: XML вставленных строк
+        """
+        events = self.events
+        events.emit(INSERT_START, start_row=start_row, rows=source_rows, cols=source_cols)
+
+        cell_styles = self.template_styles._cell_styles
+        source_styles = self.source_styles._cell_styles
+        transfer = StyleTransfer(self.source_styles, self.template_styles)
+        style_ids = {}
+        source_style = {}
+        col_indexes = {}
+        offset = start_row - 1
+        add_string = self.strings.add_xml
+        source_strings = self.source_strings
+        copied = styled_cells = 0
+
+        # Разметка сметы: объединения задевают только вставляемые строки,
+        # поэтому шаблон проверяется обходом по строкам без перебора всех областей
+        layout = self.source_layout
+        template_merges = self.template_merges()
+        self.insert_layout_xml(layout, template_merges)
+        merged_sweep = template_merges.sweep()
+        covered = layout.covered()
+        row_attrs = {idx: "".join(f' {key}="{value}"' for key, value in attrs.items())
+                     for idx, attrs in layout.rows.items()}
+
+        # Строки без пары в смете: ячейки шаблона со стилями и строки с высотой
+        extra_rows = sorted(set(gap) | set(row_attrs), reverse=True)
+
+        def extra_row_xml(row_idx):
+            attrs = row_attrs.get(row_idx, "")
+            if row_idx not in gap:
+                return f'<row r="{row_idx}"{attrs}/>'
+            cells = "".join(f'<c r="{get_column_letter(col)}{row_idx}" s="{s}"/>'
+                            for col, s in sorted(gap[row_idx].items()))
+            return f'<row r="{row_idx}"{attrs}>{cells}</row>'
+
+        out = tempfile.SpooledTemporaryFile(max_size=self.spool_size())
+        chunk = []
+        try:
+            for source_row, row_xml in self.iter_source_rows(source_rows):
+                row_idx = source_row + offset
+                if source_row % PROGRESS_STEP == 0:
+                    self.check_cancelled()
+                    events.emit(INSERT_PROGRESS, done=source_row, total=source_rows)
+                    out.write("".join(chunk).encode("utf-8"))
+                    chunk = []
+
+                while extra_rows and extra_rows[-1] < row_idx:
+                    chunk.append(extra_row_xml(extra_rows.pop()))
+                if extra_rows and extra_rows[-1] == row_idx:
+                    extra_rows.pop()
+                row_gap = dict(gap[row_idx]) if row_idx in gap else None
+                merged = merged_sweep.covering(row_idx)
+
+                cells = []
+                for attrs, inner in CELL_RE.findall(row_xml):
+                    # Обычно атрибуты идут в порядке r, s, t — тогда хватает одного сравнения
+                    fast = CELL_ATTRS_RE.fullmatch(attrs)
+                    if fast is not None:
+                        letters, s, t = fast.groups()
+                    else:
+                        ref = CELL_REF_RE.search(attrs)
+                        if ref is None:
+                            raise ValueError(f"В строке {source_row} сметы есть ячейки без адресов")
+                        letters = ref.group(1)
+                        s = STYLE_ATTR_RE.search(attrs)
+                        s = s and s.group(1)
+                        t = TYPE_ATTR_RE.search(attrs)
+                        t = t and t.group(1)
+
+                    col = col_indexes.get(letters)
+                    if col is None:
+                        col = col_indexes[letters] = column_index_from_string(letters)
+                    if col > source_cols:
+                        continue
+                    copied += 1
+
+                    style = source_style.get(s, False)
+                    if style is False:
+                        style = source_styles[int(s) if s else 0]
+                        style = source_style[s] = style if any(style) else None
+
+                    gap_s = row_gap.pop(col, None) if row_gap else None
+                    if style is not None:
+                        styled_cells += 1
+                        out_s = style_ids.get((s, gap_s))
+                        if out_s is None:
+                            mapped = transfer.map_style_array(
+                                style, cell_styles[gap_s] if gap_s is not None else None)
+                            out_s = style_ids[(s, gap_s)] = cell_styles.add(mapped)
+                    else:
+                        out_s = gap_s
+
+                    if merged:
+                        self._check_merged(merged, row_idx, col, "заполнена")
+                    if covered and (row_idx, col) in covered:
+                        # Внутренние ячейки объединений сметы значений не хранят
+                        inner, t = "", None
+
+                    if not inner:
+                        value = ""
+                    elif t in (None, "n") and inner.startswith("<v>"):
+                        value, t = inner, None
+                    elif t == "s" and inner.startswith("<v>"):
+                        value = f"<v>{add_string(source_strings[int(inner[3:-4])])}</v>"
+                    else:
+                        value, t = self._source_value(t, inner, offset)
+                    if not value and out_s is None:
+                        continue
+
+                    cell_attrs = f' s="{out_s}"' if out_s else ""
+                    if t:
+                        cell_attrs += f' t="{t}"'
+                    if value:
+                        cells.append((col, f'<c r="{letters}{row_idx}"{cell_attrs}>{value}</c>'))
+                    else:
+                        cells.append((col, f'<c r="{letters}{row_idx}"{cell_attrs}/>'))
+
+                if row_gap:
+                    cells.extend((col, f'<c r="{get_column_letter(col)}{row_idx}" s="{s}"/>')
+                                 for col, s in row_gap.items())
+                    cells.sort(key=lambda item: item[0])
+                attrs = row_attrs.get(row_idx, "")
+                if cells:
+                    chunk.append(f'<row r="{row_idx}"{attrs}>{"".join(xml for col, xml in cells)}</row>')
+                elif attrs:
+                    chunk.append(f'<row r="{row_idx}"{attrs}/>')
+
+            while extra_rows:
+                chunk.append(extra_row_xml(extra_rows.pop()))
+            out.write("".join(chunk).encode("utf-8"))
+        except BaseException:
+            out.close()
+            raise
+
+        self.stats.update(cells_copied=copied, styled_cells=styled_cells, unique_styles=len(transfer),
+                          strings=self.strings.stats())
+        events.emit(CELLS_COPIED, rows=source_rows, cols=source_cols, cells=copied,
+                    styled_cells=styled_cells, styles=len(transfer))
+        events.emit(INSERT_PROGRESS, done=source_rows, total=source_rows)
+        return out
+
+    def write_summary_xml(self, start_row, source_rows, source_cols):
+        """Итоги таблицы сметы так же, как KS2Processor.write_summary, но по XML листа сметы"""
+        summary_module = import_summary()
+        path = summary_module.export_path(self.summary, self.source_path)
+        source_strings = self.source_strings
+
+        def string_text(idx):
+            return summary_module.si_text(source_strings[idx])
+
+        scanner = self.summary_scanner
+        if scanner is not None and scanner.complete:
+            # Столбцы собраны при поиске границ таблицы
+            summary = summary_module.summarize_columns(
+                scanner.columns(source_rows, string_text), self.summary, source_rows, source_cols,
+                start_row, export=path is not None)
+        else:
+            with self.source_zip.open(self.source_sheet_path) as source:
+                summary = summary_module.summarize_stream(
+                    source, self.summary, source_rows, source_cols, start_row, string_text,
+                    export=path is not None)
+
+        cells = summary.cells()
+        rows = {row.idx: row for row in self.template_rows}
+        merged = self._merged_blocks(min(row_idx for row_idx, _, _ in cells),
+                                     max(row_idx for row_idx, _, _ in cells)) if cells else []
+        for row_idx, col_idx, value in cells:
+            self._check_merged(merged, row_idx, col_idx, "заполнена итогами")
+            row = rows.get(row_idx)
+            if row is None:
+                row = rows[row_idx] = XmlRow(row_idx)
+                self.template_rows.append(row)
+            for cell in row.cells:
+                if cell.col == col_idx:
+                    break
+            else:
+                cell = XmlCell(col_idx)
+                row.cells.append(cell)
+                row.cells.sort(key=lambda item: item.col)
+            cell.t, cell.inner = None, f"<v>{value!r}</v>"
+        self.template_rows.sort(key=lambda row: row.idx)
+        self.finish_summary(summary, path)
+
+    def shift_header_xml(self, range_start, range_end, columns_to_shift):
+        """Сдвигает область шапки влево так же, как KS2Processor.shift_range_left"""
+        self.events.emit(RANGE_SHIFTED, range_start=range_start, range_end=range_end,
+                         columns=columns_to_shift)
+
+        workbook = self.template_styles
+        cell_styles = workbook._cell_styles
+        transfer = StyleTransfer(workbook, workbook)
+        rows = {row.idx: row for row in self.template_rows if row.idx <= range_end[0]}
+        merged = self._merged_blocks(range_start[0], range_end[0])
+
+        def get_cell(row_idx, col_idx):
+            self._check_merged(merged, row_idx, col_idx, "сдвинута")
+            row = rows.get(row_idx)
+            if row is None:
+                row = rows[row_idx] = XmlRow(row_idx)
+                self.template_rows.append(row)
+            for cell in row.cells:
+                if cell.col == col_idx:
+                    return cell
+            cell = XmlCell(col_idx)
+            row.cells.append(cell)
+            return cell
+
+        for row_idx in range(range_start[0], range_end[0] + 1):
+            for col_idx in range(range_start[1], range_end[1] + 1):
+                source_cell = get_cell(row_idx, col_idx)
+                target_col = col_idx - columns_to_shift
+
+                if target_col >= 1:
+                    target_cell = get_cell(row_idx, target_col)
+                    target_cell.t, target_cell.inner = source_cell.t, source_cell.inner
+                    if any(cell_styles[source_cell.s]):
+                        style = transfer.map_style_array(cell_styles[source_cell.s],
+                                                         cell_styles[target_cell.s])
+                        target_cell.s = cell_styles.add(style)
+
+                source_cell.t, source_cell.inner = None, ""
+
+        for row in rows.values():
+            row.cells = [cell for cell in row.cells
+                         if cell.inner or cell.extra or any(cell_styles[cell.s])]
+            row.cells.sort(key=lambda cell: cell.col)
+        self.template_rows.sort(key=lambda row: row.idx)
+
+        # Ссылки на перенесенные ячейки следуют за ними (вставленная смета в template_rows не входит)
+        title = self.sheet_title
+        bounds = range_start + range_end
+
+        def move(formula, external):
+            return move_formula_block(formula, title, bounds, columns_to_shift, external)
+
+        self.reference_passes.append((move, False))
+        for row in self.template_rows:
+            for cell in row.cells:
+                if "<f" in cell.inner:
+                    cell.inner = rewrite_formula_texts(cell.inner, move)
+
+    def _sheet_head(self, source_rows, source_cols):
+        """Начало XML листа с обновленным размером в <dimension>"""
+        def dimension(match):
+            bounds = CellRange(match.group(2))
+            max_row, max_col = bounds.max_row, bounds.max_col
+            if source_rows:
+                if max_row >= START_ROW:
+                    max_row += source_rows
+                max_row = max(max_row, START_ROW + source_rows - 1)
+                max_col = max(max_col, source_cols)
+            ref = f"{get_column_letter(bounds.min_col)}{bounds.min_row}:{get_column_letter(max_col)}{max_row}"
+            return match.group(1) + ref + match.group(3)
+
+        return DIMENSION_RE.sub(dimension, self.sheet_head, count=1)
+
+    def _workbook_xml(self):
+        """workbook.xml с пересчитанными именованными диапазонами и областью печати"""
+        def defined_name(match):
+            attrs = _attrs(match.group(2))
+            if not match.group(3):
+                return match.group(0)
+            # Ссылки без имени листа относятся к листу КС-2 только в его локальных именах
+            external = attrs.get("localSheetId") != str(self.sheet_index)
+            formula = self.rewrite_references("=" + html.unescape(match.group(3)), external,
+                                              print_name=attrs.get("name") in PRINT_NAMES)
+            return match.group(1) + escape(formula[1:]) + match.group(4)
+
+        xml = DEFINED_NAME_RE.sub(defined_name, self.workbook_xml)
+
+        # Результаты формул удалены: Excel должен пересчитать книгу при открытии
+        calc = CALC_PR_RE.search(xml)
+        if calc is not None:
+            attrs = re.sub(r'\sfullCalcOnLoad="[^"]*"', "", calc.group(1).rstrip("/")).rstrip()
+            return xml[:calc.start()] + f'<calcPr{attrs} fullCalcOnLoad="1"/>' + xml[calc.end():]
+        for tag in CALC_PR_AFTER:
+            pos = xml.find(tag)
+            if pos >= 0:
+                pos += len(tag)
+                return xml[:pos] + '<calcPr fullCalcOnLoad="1"/>' + xml[pos:]
+        return xml
+
+    def save_splice(self, inserted, source_rows, source_cols):
+        """Собирает архив результата: измененные части пишутся заново, остальные копируются"""
+        template = self.template_zip
+        title = self.sheet_title
+        replaced = {}
+
+        if self._stylesheet_size() != self.styles_size:
+            replaced["xl/styles.xml"] = tostring(write_stylesheet(self.template_styles))
+
+        rels_path = get_rels_path("xl/workbook.xml")
+        workbook_rels = _relationships(template, "xl/workbook.xml")
+        rels_xml = _read_text(template, rels_path)
+        content_types = _read_text(template, "[Content_Types].xml")
+        added = {}
+
+        if len(self.strings) > self.strings.template_count:
+            strings_path = self.strings_path
+            if strings_path is None:
+                # У шаблона не было общих строк: добавляем часть и связь с ней
+                strings_path = SHARED_STRINGS_PATH
+                number = len(workbook_rels) + 1
+                while f"rId{number}" in workbook_rels:
+                    number += 1
+                rels_xml = rels_xml.replace(
+                    "</Relationships>",
+                    f'<Relationship Id="rId{number}" Type="{SHARED_STRINGS_REL}" '
+                    f'Target="{posixpath.basename(strings_path)}"/></Relationships>')
+                content_types = content_types.replace(
+                    "</Types>", f'<Override PartName="/{strings_path}" ContentType="{SHARED_STRINGS}"/></Types>')
+                added[strings_path] = self.strings.to_xml()
+            else:
+                replaced[strings_path] = self.strings.to_xml()
+
+        # Цепочка вычислений ссылается на старые адреса ячеек — ее пересоздаст Excel
+        calc_chain = None
+        for rel_type, target in workbook_rels.values():
+            if rel_type.endswith("/calcChain"):
+                calc_chain = target
+
+        if source_rows:
+            replaced["xl/workbook.xml"] = self._workbook_xml().encode("utf-8")
+
+            # Формулы других листов со ссылками на лист КС-2
+            for path, xml in self.referencing_parts.items():
+                rewritten = rewrite_formula_texts(xml, self.rewrite_references, True, self.title_needle)
+                if rewritten != xml:
+                    replaced[path] = rewritten.encode("utf-8")
+
+            def table_ref(match):
+                return match.group(1) + _shift_refs(
+                    match.group(2), title,
+                    lambda r: r + source_rows if r >= START_ROW else r) + match.group(3)
+
+            for rel_type, target in self.sheet_rels.values():
+                if rel_type.endswith("/table") and target in template.NameToInfo:
+                    replaced[target] = TABLE_REF_RE.sub(table_ref, _read_text(template, target)).encode("utf-8")
+
+            if calc_chain is not None:
+                content_types = re.sub(
+                    rf'<Override\b[^>]*?PartName="/{re.escape(calc_chain)}"[^>]*/>', "", content_types)
+                rels_xml = re.sub(r'<Relationship\b[^>]*?Type="[^"]*/calcChain"[^>]*/>', "", rels_xml)
+        else:
+            calc_chain = None
+
+        if rels_xml != _read_text(template, rels_path):
+            replaced[rels_path] = rels_xml.encode("utf-8")
+        if content_types != _read_text(template, "[Content_Types].xml"):
+            replaced["[Content_Types].xml"] = content_types.encode("utf-8")
+
+        if self.compresslevel:
+            archive = ZipFile(self.output_path, 'w', ZIP_DEFLATED, allowZip64=True,
+                              compresslevel=self.compresslevel)
+        else:
+            archive = ZipFile(self.output_path, 'w', ZIP_STORED, allowZip64=True)
+
+        with archive:
+            for info in template.infolist():
+                name = info.filename
+                if name == calc_chain:
+                    continue
+                if name == self.sheet_path:
+                    self._write_sheet(archive, inserted, source_rows, source_cols)
+                elif name in replaced:
+                    archive.writestr(name, replaced[name])
+                else:
+                    archive.writestr(name, template.read(name))
+            for name, data in added.items():
+                archive.writestr(name, data)
+
+        self.stats["save"] = {"compresslevel": self.compresslevel}
+
+    def _write_sheet(self, archive, inserted, source_rows, source_cols):
+        """Пишет лист КС-2 потоком: шапка, вставленные строки, сдвинутые строки"""
+        upper = [row for row in self.template_rows if row.idx < START_ROW]
+        lower = [row for row in self.template_rows if row.idx >= START_ROW]
+
+        with archive.open(self.sheet_path, 'w', force_zip64=True) as out:
+            out.write(self._sheet_head(source_rows, source_cols).encode("utf-8"))
+            out.write(b"<sheetData>")
+            out.write("".join(row.to_xml() for row in upper if row.cells or row.attrs).encode("utf-8"))
+            inserted.seek(0)
+            shutil.copyfileobj(inserted, out)
+            out.write("".join(row.to_xml() for row in lower).encode("utf-8"))
+            out.write(b"</sheetData>")
+            out.write(self.sheet_tail.encode("utf-8"))
+
+
+# Движки обработки для командной строки и бенчмарка
+ENGINES = {
+    "openpyxl": KS2Processor,
+    "splice": KS2SpliceProcessor,
+}
@@ -0,0 +1,148 @@
+"""
+Замер времени запуска: импорт модулей КС-2 и показ окна GUI при холодном
+и теплом старте.
+
+Холодный старт — первый запуск с пустым кэшем байт-кода (все .pyc, в том
+числе openpyxl, компилируются заново), теплый — повторный запуск с готовым
+кэшем. Каждый замер выполняется в новом процессе интерпретатора.
+
+Примеры:
+    python ks2_startup.py
+    python ks2_startup.py --gui --output startup.json
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# Что замеряется: модуль событий и настройки (нужны окну сразу),
+# путь обработки (загружается после показа окна) и сервис
+TARGETS = (
+    ("events", "ks2_events"),
+    ("paths", "path_manager"),
+    ("processing", "ks2_processor"),
+    ("service", "ks2_service"),
+)
+TOP_MODULES = 8
+
+IMPORT_TIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _run(args, cache_dir, extra_env=None):
+    """Запускает интерпретатор с отдельным кэшем байт-кода"""
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=cache_dir, **(extra_env or {}))
+    # Без записи .pyc теплый старт не отличался бы от холодного
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable] + args, cwd=PACKAGE_DIR, env=env,
+                            capture_output=True, text=True, encoding="utf-8", errors="replace")
+    return result, time.perf_counter() - started
+
+
+def measure_import(module, cache_dir):
+    """
+    Время импорта модуля в новом процессе по данным -X importtime
+
+    Returns:
+        dict: общее время импорта, время процесса и самые медленные модули
+    """
+    result, wall = _run(["-X", "importtime", "-c", f"import {module}"], cache_dir)
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "ошибка"}
+
+    total = 0
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        modules.append((name, int(self_us)))
+        if not indent and name == module:
+            total = int(cumulative_us)
+
+    modules.sort(key=lambda item: item[1], reverse=True)
+    return {
+        "import_s": round(total / 1e6, 4),
+        "process_s": round(wall, 4),
+        "modules": len(modules),
+        "slowest": [[name, round(us / 1e6, 4)] for name, us in modules[:TOP_MODULES]],
+    }
+
+
+def measure_gui(cache_dir):
+    """Время до показа окна и до загрузки модулей обработки (нужен дисплей)"""
+    result, wall = _run(["pretty_gui.py"], cache_dir, {"KS2_STARTUP_REPORT": "1"})
+    for line in reversed(result.stdout.splitlines()):
+        if line.startswith("{"):
+            return dict(json.loads(line), process_s=round(wall, 4))
+    lines = result.stderr.strip().splitlines()
+    return {"error": lines[-1] if lines else "окно не запустилось"}
+
+
+def run_report(gui=False):
+    """Замеры холодного и теплого старта"""
+    cache_dir = tempfile.mkdtemp(prefix="ks2_pycache_")
+    report = {}
+    try:
+        for start in ("cold", "warm"):
+            results = report[start] = {}
+            for name, module in TARGETS:
+                # Для холодного старта каждый модуль замеряется с чистым кэшем
+                if start == "cold":
+                    shutil.rmtree(cache_dir, ignore_errors=True)
+                results[name] = measure_import(module, cache_dir)
+            if gui:
+                if start == "cold":
+                    shutil.rmtree(cache_dir, ignore_errors=True)
+                results["gui"] = measure_gui(cache_dir)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    report["meta"] = {"python": sys.version.split()[0], "created": time.strftime("%Y-%m-%d %H:%M:%S")}
+    return report
+
+
+def print_report(report):
+    titles = {"cold": "❄️  Холодный старт", "warm": "🔥 Теплый старт"}
+    for start in ("cold", "warm"):
+        print(f"\n{titles[start]}:")
+        for name, result in report[start].items():
+            if "error" in result:
+                print(f"  {name:<11} ❌ {result['error']}")
+            elif name == "gui":
+                print(f"  {name:<11} окно {result['window']:.3f} с, "
+                      f"модули обработки {result['processing']:.3f} с")
+            else:
+                slowest = ", ".join(f"{module} {seconds:.3f}" for module, seconds in result["slowest"][:3])
+                print(f"  {name:<11} импорт {result['import_s']:.3f} с, процесс {result['process_s']:.3f} с "
+                      f"({result['modules']} модулей; медленнее всех: {slowest})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замер времени запуска КС-2")
+    parser.add_argument("--gui", action="store_true",
+                        help="замерить также показ окна pretty_gui (нужен дисплей)")
+    parser.add_argument("--output", help="файл отчета JSON")
+    args = parser.parse_args(argv)
+
+    print("⏱️  Замер времени запуска...")
+    report = run_report(gui=args.gui)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(f"\n💾 Отчет сохранен: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
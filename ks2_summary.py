@@ -0,0 +1,669 @@
+"""
+Итоги вставленной сметы: суммы, суммы по разделам и проверка
+«количество × цена = стоимость».
+
+Этап необязательный и включается настройками итогов (JSON). Нужные столбцы
+таблицы сметы собираются прямо из XML листа (для формул берется значение,
+сохраненное в файле) в том же проходе, в котором ищутся границы таблицы
+(ColumnScanner, table_dimensions), поэтому лист сметы не распаковывается
+и не просматривается второй раз. Итоги и проверки считаются векторно по
+столбцам NumPy, результаты записываются в указанные ячейки шаблона, а
+таблица при необходимости выгружается в столбцовый файл (.npz, .npy,
+Parquet, Arrow) для отчетности. Для сметы в 100 тысяч строк × 7 столбцов
+(итоги по трем столбцам и разделы) этап итогов занимает около 0,3 с
+(сборка массивов из найденных ячеек, итоги, разделы), а разбор ячеек
+нужных столбцов добавляет к поиску границ около 0,4 с — отдельное чтение
+листа (read_columns) занимает около 1,1 с. Встроенные строки
+(t="inlineStr", так пишет openpyxl) разбираются дольше общих строк Excel.
+
+Модуль требует NumPy (Parquet и Arrow — еще и pyarrow), поэтому
+обработчики импортируют его, только когда итоги включены.
+
+Настройки:
+    {
+        "columns": {"quantity": "E", "price": "F", "cost": "G"},
+        "section": {"column": "C", "prefix": "Раздел"},
+        "tolerance": 0.01,
+        "cells": {"total": "G21", "mismatches": "G22", "section:1": "G23"},
+        "export": "выгрузка/{name}.parquet"
+    }
+
+Обязателен только столбец стоимости. Адреса cells указываются в
+координатах шаблона (до вставки): ячейки ниже строки вставки сдвигаются
+вместе с подвалом, ячейки шапки — вместе с областями шапки. В пути
+выгрузки {name} заменяется именем сметы без расширения; относительные
+пути считаются от папки файла настроек.
+
+Пример:
+    python ks2_summary.py смета.xlsx --config итоги.json [--export смета.npz]
+"""
+import argparse
+import html
+import json
+import os
+import re
+import sys
+import numpy as np
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.cell import coordinate_from_string
+from openpyxl.utils.exceptions import CellCoordinatesException
+from ks2_events import summary_lines
+
+
+START_ROW = 20
+DEFAULT_TOLERANCE = 0.01
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Значения, которые можно записать в ячейки шаблона
+METRICS = {
+    "total": "сумма стоимости",
+    "computed_total": "сумма произведений количества на цену",
+    "difference": "сумма стоимости минус сумма произведений",
+    "rows": "строк со стоимостью",
+    "checked": "проверенных строк (есть количество, цена и стоимость)",
+    "mismatches": "строк, где количество × цена ≠ стоимость",
+    "first_mismatch": "строка результата с первым расхождением",
+    "sections": "число разделов",
+}
+SECTION_METRIC_RE = re.compile(r"section:(\d+)$")
+COLUMN_ROLES = ("quantity", "price", "cost")
+EXPORT_FORMATS = (".npz", ".npy", ".parquet", ".arrow", ".feather")
+
+TYPE_ATTR_RE = re.compile(rb'\bt="(\w+)"')
+VALUE_RE = re.compile(rb"<(?:\w+:)?v>(.*?)</(?:\w+:)?v>", re.S)
+TEXT_RE = re.compile(r"<(?:\w+:)?t\b[^>]*?(?:/>|>(.*?)</(?:\w+:)?t>)", re.S)
+PHONETIC_RE = re.compile(r"<(?:\w+:)?rPh\b.*?</(?:\w+:)?rPh>", re.S)
+SIMPLE_INLINE_RE = re.compile(rb"<is><t>([^<&]*)</t></is>")
+# Ячейка, адрес которой не первый атрибут
+NONCANONICAL_RE = re.compile(rb'<c (?!r=")')
+# Найденные ячейки: столбец, строка, тип, прочие атрибуты, значение <v>, прочее содержимое
+CELL_DTYPE = np.dtype([("letter", "S3"), ("row", "S7"), ("t", "S9"), ("attrs", "O"), ("v", "O"), ("other", "O")])
+
+
+def _fast_cell_pattern(names):
+    """
+    Ячейки нужных столбцов при обычном порядке атрибутов (r, s, t):
+    (столбец, строка, тип, прочие атрибуты, значение <v>, прочее содержимое)
+    """
+    return re.compile(rb'<c r="(' + names + rb')(\d+)"(?: s="\d+")?(?: t="(\w+)")?([^>]*?)(?<!/)>'
+                      rb'(?:<f\b[^>]*?(?:/>|>[^<]*</f>))?(?:<v>([^<]*)</v>|(.*?))</c>', re.S)
+
+
+def _generic_cell_pattern(names):
+    """Ячейки нужных столбцов при любом порядке атрибутов и с префиксами пространства имен"""
+    return re.compile(rb'<(?:\w+:)?c\b([^>]*?)\br="(' + names + rb')(\d+)"([^>]*?)'
+                      rb'(?:/>|>(.*?)</(?:\w+:)?c>)', re.S)
+
+
+def _generic_cell(before, letter, row, after, inner):
+    """Ячейка, найденная общим выражением, в виде результата быстрого"""
+    t = TYPE_ATTR_RE.search(before + after)
+    t = t.group(1) if t is not None else b""
+    if not inner or t == b"inlineStr":
+        return letter, row, t, b"", b"", inner
+    value = VALUE_RE.search(inner)
+    return letter, row, t, b"", value.group(1) if value is not None else b"", b""
+
+
+def si_text(xml):
+    """Текст элемента <si> или <is> (форматированный текст склеивается, фонетика отбрасывается)"""
+    if "<rPh" in xml:
+        xml = PHONETIC_RE.sub("", xml)
+    return html.unescape("".join(TEXT_RE.findall(xml)))
+
+
+def to_number(value):
+    """Число из значения ячейки; текст вида «1 234,50» тоже считается числом"""
+    if isinstance(value, float):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value.replace("\xa0", "").replace(" ", "").replace(",", "."))
+        except ValueError:
+            return None
+    return None
+
+
+def _text(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def load_summary_config(path):
+    """Читает и проверяет настройки итогов из JSON"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return normalize_config(data, base_dir=os.path.dirname(os.path.abspath(path)))
+
+
+def normalize_config(data, base_dir=None):
+    """
+    Проверяет настройки итогов и приводит их к полному виду
+
+    Returns:
+        dict: настройки с заполненными значениями по умолчанию
+    """
+    columns = {role: str(letter).strip().upper() for role, letter in (data.get("columns") or {}).items()}
+    unknown = set(columns) - set(COLUMN_ROLES)
+    if unknown:
+        raise ValueError(f"Итоги: неизвестные столбцы {', '.join(sorted(unknown))} "
+                         f"(допустимы {', '.join(COLUMN_ROLES)})")
+    if "cost" not in columns:
+        raise ValueError("Итоги: не указан столбец стоимости (columns.cost)")
+    section = dict(data.get("section") or {})
+    if section:
+        if not section.get("column"):
+            raise ValueError("Итоги: не указан столбец названий разделов (section.column)")
+        section = {"column": str(section["column"]).strip().upper(),
+                   "prefix": section.get("prefix", "Раздел")}
+    for letter in [*columns.values(), *([section["column"]] if section else [])]:
+        try:
+            column_index_from_string(letter)
+        except ValueError:
+            raise ValueError(f"Итоги: неверное обозначение столбца '{letter}'")
+
+    cells = {}
+    for metric, address in (data.get("cells") or {}).items():
+        if metric not in METRICS and not SECTION_METRIC_RE.match(metric):
+            raise ValueError(f"Итоги: неизвестное значение '{metric}' для ячейки {address}")
+        try:
+            coordinate_from_string(address)
+        except (ValueError, CellCoordinatesException):
+            raise ValueError(f"Итоги: неверный адрес ячейки '{address}' для '{metric}'")
+        cells[metric] = address.upper()
+
+    export = data.get("export")
+    if export:
+        if not export.lower().endswith(EXPORT_FORMATS):
+            raise ValueError(f"Итоги: формат выгрузки '{export}' не поддерживается "
+                             f"({', '.join(EXPORT_FORMATS)})")
+        if base_dir is not None:
+            export = os.path.join(base_dir, export)
+
+    return {
+        "columns": columns,
+        "section": section,
+        "tolerance": float(data.get("tolerance", DEFAULT_TOLERANCE)),
+        "cells": cells,
+        "export": export or None,
+    }
+
+
+def _column_names(cols):
+    """Выражение для букв столбцов cols (None — любой столбец)"""
+    if cols is None:
+        return rb"[A-Z]{1,3}"
+    letters = sorted(get_column_letter(col).encode() for col in cols)
+    # Класс символов находится заметно быстрее перебора вариантов
+    if all(len(letter) == 1 for letter in letters):
+        return b"[" + b"".join(letters) + b"]"
+    return b"|".join(letters)
+
+
+class ColumnScanner:
+    """
+    Собирает ячейки столбцов cols (None — всех столбцов) из фрагментов XML
+    листа. Каждый фрагмент разбирается одним регулярным выражением, найденные
+    ячейки (кортежи байтовых строк) складываются в структурированный массив
+    NumPy; ячейки остальных столбцов выражение пропускает, не создавая объектов.
+
+    Фрагменты передаются по порядку и режутся по границам строк, как в
+    просмотре границ таблицы (table_dimensions.scan_sheet_xml_bounds):
+    переданный туда сканер собирает столбцы итогов в том же проходе, и лист
+    сметы распаковывается и просматривается один раз
+    """
+
+    def __init__(self, cols=None):
+        names = _column_names(cols)
+        self.fast, self.generic = _fast_cell_pattern(names), _generic_cell_pattern(names)
+        self.parts = []
+        self.last_row = 0
+        # Лист просмотрен до конца (см. finish)
+        self.complete = False
+
+    def scan(self, data):
+        """Дополняет собранные ячейки фрагментом XML листа (байты)"""
+        cells = None
+        # Быстрое выражение годится, если у всех ячеек адрес идет первым атрибутом,
+        # а тип (если есть) — сразу за адресом и стилем; префиксы пространства
+        # имен (<x:c>) разбираются общим выражением
+        if b":c " not in data and NONCANONICAL_RE.search(data) is None:
+            matches = self.fast.findall(data)
+            cells = np.fromiter(matches, dtype=CELL_DTYPE, count=len(matches))
+            attrs = cells["attrs"][cells["attrs"] != b""]
+            if any(b't="' in item for item in attrs.tolist()):
+                cells = None
+        if cells is None:
+            cells = np.array([_generic_cell(*match) for match in self.generic.findall(data)], dtype=CELL_DTYPE)
+
+        if cells.size:
+            self.parts.append(cells)
+            self.last_row = int(cells["row"][-1])
+
+    def finish(self):
+        """Отмечает, что лист просмотрен целиком"""
+        self.complete = True
+
+    def columns(self, max_row, string_text=None):
+        """Собранные ячейки строк 1..max_row (SheetColumns)"""
+        return SheetColumns(self.parts, max_row, string_text)
+
+
+def read_columns(source, cols, max_row, string_text=None):
+    """
+    Читает ячейки столбцов cols в строках 1..max_row прямым просмотром XML
+    листа (ColumnScanner); чтение останавливается после строки max_row
+
+    Returns:
+        SheetColumns
+    """
+    scanner = ColumnScanner(cols)
+    tail = b""
+
+    while True:
+        chunk = source.read(READ_CHUNK_SIZE)
+        data = tail + chunk
+        if chunk:
+            cut = data.rfind(b"row>") + len(b"row>")
+            if cut < len(b"row>"):
+                tail = data
+                continue
+            data, tail = data[:cut], data[cut:]
+
+        scanner.scan(data)
+        if not chunk or scanner.last_row > max_row:
+            break
+
+    return scanner.columns(max_row, string_text)
+
+
+def configured_columns(config):
+    """Номера столбцов, указанных в настройках итогов (роли и столбец разделов)"""
+    letters = list(config["columns"].values())
+    if config["section"]:
+        letters.append(config["section"]["column"])
+    return {column_index_from_string(letter) for letter in letters}
+
+
+def column_scanner(config):
+    """
+    Сканер столбцов для итогов по настройкам config: настроенные столбцы,
+    а если задана выгрузка — все столбцы (ширина таблицы до просмотра
+    листа неизвестна)
+    """
+    return ColumnScanner(None if config["export"] else configured_columns(config))
+
+
+class SheetColumns:
+    """
+    Ячейки нескольких столбцов листа в виде массивов: столбец, строка,
+    тип, значение <v> и прочее содержимое (встроенные строки)
+    """
+
+    def __init__(self, parts, max_row, string_text=None):
+        cells = np.concatenate(parts) if parts else np.array([], dtype=CELL_DTYPE)
+        rows = cells["row"].astype(np.int64)
+        inside = rows <= max_row
+        cells = cells[inside]
+        self.letters, self.rows, self.types = cells["letter"], rows[inside], cells["t"]
+        # Значения <v> — байты; длинные строки формул не обрезаются
+        self.values = cells["v"].astype("S") if cells.size else np.array([], dtype="S1")
+        self.others = cells["other"]
+        self.string_text = string_text
+        self._strings = {}
+        self._columns = {}
+
+    def _indexes(self, col):
+        indexes = self._columns.get(col)
+        if indexes is None:
+            indexes = self._columns[col] = np.flatnonzero(self.letters == get_column_letter(col).encode())
+        return indexes
+
+    def value(self, idx):
+        """Значение ячейки с номером idx: float, str или None"""
+        return self.value_of(self.types[idx], self.values[idx], self.others[idx])
+
+    def value_of(self, t, value, other=b""):
+        """Значение ячейки по ее типу, содержимому <v> и прочему содержимому"""
+        if t == b"inlineStr":
+            simple = SIMPLE_INLINE_RE.fullmatch(other)
+            return simple.group(1).decode("utf-8") if simple is not None else si_text(other.decode("utf-8"))
+        if not value:
+            return None
+        if t in (b"", b"n"):
+            return float(value)
+        if t == b"s":
+            text = self._strings.get(value)
+            if text is None and self.string_text is not None:
+                text = self._strings[value] = self.string_text(int(value))
+            return text
+        if t == b"str":
+            return html.unescape(value.decode("utf-8"))
+        # Логические значения и ошибки не считаются ни числами, ни текстом
+        return None
+
+    def numeric(self, col, size):
+        """Столбец float64 длиной size (элемент i — строка i + 1); пустые и нечисловые ячейки — NaN"""
+        array = np.full(size, np.nan)
+        indexes = self._indexes(col)
+        types, values = self.types[indexes], self.values[indexes]
+        plain = ((types == b"") | (types == b"n")) & (values != b"")
+        try:
+            array[self.rows[indexes[plain]] - 1] = values[plain].astype(np.float64)
+        except ValueError:
+            plain[:] = False
+        # Числа, записанные текстом, и прочие редкие ячейки — по одной
+        for idx in indexes[~plain]:
+            number = to_number(self.value(idx))
+            if number is not None:
+                array[self.rows[idx] - 1] = number
+        return array
+
+    def text(self, col, size):
+        """Столбец текста (object) длиной size; пустые ячейки — None"""
+        array = np.full(size, None, dtype=object)
+        indexes = self._indexes(col)
+        types, rows = self.types[indexes], self.rows[indexes] - 1
+
+        # Общие строки декодируются по одному разу на индекс
+        shared = types == b"s"
+        if shared.any():
+            unique, inverse = np.unique(self.values[indexes[shared]], return_inverse=True)
+            texts = np.array([self.value_of(b"s", value) for value in unique.tolist()] + [None], dtype=object)
+            array[rows[shared]] = texts[:-1][inverse.ravel()]
+
+        # Простые встроенные строки (<is><t>текст</t></is>) декодируются одним вызовом
+        inline = types == b"inlineStr"
+        if inline.any():
+            others = self.others[indexes[inline]].tolist()
+            texts = b"\0".join(others).decode("utf-8").split("\0")
+            array[rows[inline]] = [
+                text[7:-9] if text.startswith("<is><t>") and text.endswith("</t></is>")
+                and "<" not in text[7:-9] and "&" not in text[7:-9]
+                else self.value_of(b"inlineStr", b"", other)
+                for text, other in zip(texts, others)]
+
+        for idx in indexes[~(shared | inline)].tolist():
+            value = self.value(idx)
+            if value is not None:
+                array[self.rows[idx] - 1] = _text(value)
+        return array
+
+    def headers(self, col, size, prefix):
+        """
+        Строки столбца, текст которых начинается с prefix (без учета регистра
+        и начальных пробелов). Общие строки проверяются по одному разу на
+        индекс, встроенные — по началу текста, поэтому целиком декодируются
+        только найденные заголовки
+
+        Returns:
+            tuple: (маска длиной size, {номер элемента: текст})
+        """
+        prefix = prefix.lower()
+        head_size = len(prefix.encode("utf-8")) + 64
+        indexes = self._indexes(col)
+        types = self.types[indexes]
+        found = []
+
+        shared = indexes[types == b"s"]
+        if shared.size:
+            values = self.values[shared]
+            unique = np.unique(values)
+            matched = [value for value in unique.tolist()
+                       if _text(self.value_of(b"s", value)).strip().lower().startswith(prefix)]
+            if matched:
+                found.extend(shared[np.isin(values, matched)].tolist())
+
+        inline = indexes[types == b"inlineStr"]
+        if inline.size:
+            # Начала встроенных строк декодируются одним вызовом (в XML нет символа \0);
+            # форматированный текст проверяется целиком
+            heads = self.others[inline].astype(f"S{head_size}")
+            texts = b"\0".join(heads.tolist()).decode("utf-8", "ignore").lower().split("\0")
+            candidates = [prefix in text for text in texts] | ~np.char.startswith(heads, b"<is><t>")
+            found.extend(inline[candidates].tolist())
+
+        rest = indexes[(types != b"s") & (types != b"inlineStr")]
+        found.extend(rest.tolist())
+
+        mask = np.zeros(size, dtype=bool)
+        labels = {}
+        for idx in found:
+            value = self.value(idx)
+            if value is None:
+                continue
+            text = _text(value).strip()
+            if text.lower().startswith(prefix):
+                row = int(self.rows[idx]) - 1
+                mask[row] = True
+                labels[row] = text
+        return mask, labels
+
+    def typed(self, col, size):
+        """Числовой столбец, если в нем только числа, иначе строковый (пустые ячейки — '')"""
+        indexes = self._indexes(col)
+        types = self.types[indexes]
+        if np.all((types == b"") | (types == b"n")):
+            return self.numeric(col, size)
+        return np.array(["" if text is None else text for text in self.text(col, size)], dtype=str)
+
+
+class EstimateSummary:
+    """
+    Итоги таблицы сметы rows × cols, вставленной в лист со строки start_row.
+    Столбцы хранятся массивами NumPy длиной rows (элемент i — строка i + 1 сметы)
+    """
+
+    def __init__(self, config, rows, cols, start_row=START_ROW):
+        self.config = config
+        self.rows = rows
+        self.cols = cols
+        self.start_row = start_row
+        self.arrays = {}
+        self.metrics = {}
+        self.sections = []
+        self.labels = {}
+        self.columns = None
+        self.read_cols = []
+
+    def wanted_columns(self, export=False):
+        """Номера столбцов для чтения: настроенные или (для выгрузки) все столбцы таблицы"""
+        cols = configured_columns(self.config)
+        if export:
+            cols.update(range(1, self.cols + 1))
+        return sorted(col for col in cols if col <= self.cols)
+
+    def read(self, source, string_text=None, export=False):
+        """Читает нужные столбцы из XML листа сметы (двоичный поток) в массивы"""
+        return self.load(read_columns(source, self.wanted_columns(export), self.rows, string_text), export)
+
+    def load(self, columns, export=False):
+        """Массивы нужных столбцов из прочитанных ячеек листа (SheetColumns)"""
+        config, size = self.config, self.rows
+        self.read_cols = self.wanted_columns(export)
+        self.columns = columns
+
+        for role, letter in config["columns"].items():
+            self.arrays[role] = columns.numeric(column_index_from_string(letter), size)
+        if config["section"]:
+            section = config["section"]
+            self.arrays["section"], self.labels = columns.headers(
+                column_index_from_string(section["column"]), size, section["prefix"])
+        return self
+
+    def compute(self):
+        """Итоги и проверки по столбцам; результат — в self.metrics и self.sections"""
+        arrays, size = self.arrays, self.rows
+        nan = np.full(size, np.nan)
+        cost = arrays.get("cost", nan)
+        quantity, price = arrays.get("quantity"), arrays.get("price")
+
+        has_cost = ~np.isnan(cost)
+        metrics = {"rows": int(has_cost.sum()), "total": float(cost[has_cost].sum())}
+
+        if quantity is not None and price is not None:
+            product = quantity * price
+            has_product = ~np.isnan(product)
+            checked = has_product & has_cost
+            mismatched = checked & (np.abs(product - cost) > self.config["tolerance"])
+            first = np.flatnonzero(mismatched)
+            computed = float(product[has_product].sum())
+            metrics.update(computed_total=computed, difference=metrics["total"] - computed,
+                           checked=int(checked.sum()), mismatches=int(mismatched.sum()),
+                           first_mismatch=int(first[0]) + self.start_row if first.size else None)
+
+        is_header = arrays.get("section")
+        if is_header is not None:
+            headers = np.flatnonzero(is_header)
+            # Номер раздела каждой строки: 0 — строки до первого раздела
+            section_ids = np.cumsum(is_header)
+            sums = np.bincount(section_ids, weights=np.where(has_cost, cost, 0), minlength=headers.size + 1)
+            self.sections = [(self.labels[idx], float(total), idx + self.start_row)
+                             for idx, total in zip(headers.tolist(), sums[1:].tolist())]
+            metrics["sections"] = len(self.sections)
+
+        self.metrics = metrics
+        return metrics
+
+    def value(self, metric):
+        """Значение для ячейки шаблона (None, если его нет)"""
+        match = SECTION_METRIC_RE.match(metric)
+        if match is not None:
+            number = int(match.group(1))
+            return self.sections[number - 1][1] if 0 < number <= len(self.sections) else None
+        return self.metrics.get(metric)
+
+    def cells(self):
+        """
+        Ячейки результата для записи итогов: адреса шаблона ниже строки
+        вставки сдвигаются на высоту таблицы
+
+        Returns:
+            list: (строка, столбец, значение)
+        """
+        cells = []
+        for metric, address in self.config["cells"].items():
+            value = self.value(metric)
+            if value is None:
+                continue
+            letters, row = coordinate_from_string(address)
+            if row >= self.start_row:
+                row += self.rows
+            cells.append((row, column_index_from_string(letters), value))
+        return cells
+
+    def export_arrays(self):
+        """Все прочитанные столбцы таблицы с типами для выгрузки: имя → массив"""
+        names = {column_index_from_string(letter): role for role, letter in self.config["columns"].items()}
+        arrays = {"row": np.arange(self.start_row, self.start_row + self.rows, dtype=np.int64)}
+        for col in self.read_cols:
+            letter = get_column_letter(col)
+            if col in names:
+                arrays[f"{letter}_{names[col]}"] = self.arrays[names[col]]
+            else:
+                arrays[letter] = self.columns.typed(col, self.rows)
+        return arrays
+
+    def export(self, path):
+        """Выгружает таблицу в столбцовый файл; формат — по расширению"""
+        arrays = self.export_arrays()
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        extension = os.path.splitext(path)[1].lower()
+
+        if extension == ".npz":
+            np.savez_compressed(path, **arrays)
+        elif extension == ".npy":
+            # Одна таблица — структурированный массив со столбцами-полями
+            table = np.empty(self.rows, dtype=[(name, array.dtype) for name, array in arrays.items()])
+            for name, array in arrays.items():
+                table[name] = array
+            np.save(path, table)
+        else:
+            try:
+                import pyarrow
+                import pyarrow.feather
+                import pyarrow.parquet
+            except ImportError:
+                raise RuntimeError("Для выгрузки в Parquet/Arrow нужен пакет pyarrow (pip install pyarrow)")
+            table = pyarrow.table(arrays)
+            if extension == ".parquet":
+                pyarrow.parquet.write_table(table, path)
+            else:
+                pyarrow.feather.write_feather(table, path)
+        return path
+
+
+def export_path(config, source_path):
+    """Путь выгрузки для сметы ({name} — имя сметы без расширения) или None"""
+    if not config["export"]:
+        return None
+    return config["export"].format(name=os.path.splitext(os.path.basename(source_path))[0])
+
+
+def summarize_stream(source, config, rows, cols, start_row=START_ROW, string_text=None, export=False):
+    """Итоги по XML листа сметы (двоичный поток); export — прочитать все столбцы для выгрузки"""
+    summary = EstimateSummary(config, rows, cols, start_row)
+    summary.read(source, string_text, export).compute()
+    return summary
+
+
+def summarize_columns(columns, config, rows, cols, start_row=START_ROW, export=False):
+    """Итоги по ячейкам листа сметы, уже собранным ColumnScanner (SheetColumns)"""
+    summary = EstimateSummary(config, rows, cols, start_row)
+    summary.load(columns, export).compute()
+    return summary
+
+
+def summarize_sheet(sheet, config, rows, cols, start_row=START_ROW, export=False, scanner=None):
+    """
+    Итоги по листу сметы, открытому openpyxl только для чтения (см. source_reader).
+    scanner: ColumnScanner (column_scanner), просмотревший лист вместе с
+    границами таблицы; без него лист читается заново
+    """
+    strings = sheet._shared_strings
+
+    def string_text(idx):
+        return str(strings[idx])
+
+    if scanner is not None and scanner.complete:
+        return summarize_columns(scanner.columns(rows, string_text), config, rows, cols, start_row, export)
+    with sheet._get_source() as source:
+        return summarize_stream(source, config, rows, cols, start_row, string_text, export)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Итоги и проверки таблицы сметы, выгрузка в столбцовый файл")
+    parser.add_argument("source", help="проектная смета (.xlsx)")
+    parser.add_argument("--config", required=True, help="настройки итогов (JSON)")
+    parser.add_argument("--export", help=f"файл выгрузки ({', '.join(EXPORT_FORMATS)})")
+    args = parser.parse_args(argv)
+
+    from source_reader import open_source_workbook
+    from table_dimensions import find_table_bounds
+
+    config = load_summary_config(args.config)
+    if args.export:
+        config["export"] = args.export
+    workbook = open_source_workbook(args.source)
+    try:
+        sheet = workbook.active
+        scanner = column_scanner(config)
+        rows, cols = find_table_bounds(sheet, columns=scanner)
+        path = export_path(config, args.source)
+        summary = summarize_sheet(sheet, config, rows, cols, start_row=1, export=path is not None,
+                                  scanner=scanner)
+    finally:
+        workbook.close()
+
+    print(f"📊 {os.path.basename(args.source)}: {rows} строк × {cols} столбцов")
+    print("\n".join(summary_lines(summary.metrics, summary.sections)))
+    if path:
+        summary.export(path)
+        print(f"💾 Выгружено: {path}")
+    return 1 if summary.metrics.get("mismatches") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,600 @@
+"""
+Наблюдение за папками смет: сохраненная в папку смета сама превращается в акт КС-2.
+
+Изменения папок отслеживаются через inotify (Linux, вызовы libc через
+ctypes); на других системах, на сетевых папках и с --poll папки
+периодически просматриваются. Файл берется в работу, когда его размер и
+время изменения не менялись --settle секунд и он читается как книга .xlsx
+(ks2_preflight): недописанная копия или сохранение Excel частями не
+попадают в обработку. Шаблон выбирается по первому правилу, под которое
+подходит путь сметы относительно наблюдаемой папки, иначе берется --template.
+
+Задания выполняются в пуле процессов ks2_batch. В пуле одновременно не
+больше --queue-size заданий, остальные ждут в очереди путей без повторов,
+поэтому всплеск из сотен файлов не увеличивает ни число потоков, ни
+память. Результаты пишутся в журнал состояния (JSON Lines), акты с
+неизменными входами не собираются заново (build_cache), в том числе после
+перезапуска.
+
+Примеры:
+    python ks2_watch.py сметы --template КС-2.xlsx --output-dir акты
+    python ks2_watch.py сметы --rule "Объект1/*=шаблоны/КС-2 Объект1.xlsx" --template КС-2.xlsx --output-dir акты
+    python ks2_watch.py /mnt/share/сметы --rules rules.json --output-dir акты --poll-interval 10
+    python ks2_watch.py сметы --template КС-2.xlsx --output-dir акты --once
+
+Файл правил — JSON-список объектов {"pattern": ..., "template": ...};
+относительные пути шаблонов считаются от папки файла правил.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import fnmatch
+import json
+import os
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from ks2_splice import ENGINES
+from ks2_batch import BatchState, build_options, init_worker, job_inputs, load_summary, run_job
+from ks2_preflight import PreflightError, preflight
+from ks2_profile import add_profile_arguments, profile_options
+from build_cache import BuildCache, default_manifest_path
+from fast_save import DEFAULT_COMPRESSLEVEL
+from path_manager import apply_profile
+
+
+DEFAULT_PATTERN = "*.xlsx"
+DEFAULT_SETTLE = 2.0
+DEFAULT_POLL_INTERVAL = 2.0
+# Как часто проверяются отложенные файлы и завершенные задания
+TICK = 0.5
+
+# События inotify (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def init_watch_worker(*args):
+    """
+    Рабочий процесс наблюдателя: Ctrl+C не прерывает начатое задание,
+    остановкой пула управляет основной процесс
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_worker(*args)
+
+
+def is_temporary(name):
+    """Временные файлы Excel (~$...), скрытые и недописанные копии"""
+    return name.startswith(("~$", ".")) or name.lower().endswith((".tmp", ".part", ".crdownload"))
+
+
+def is_inside(path, folder):
+    """Лежит ли path в папке folder (пути на разных дисках — не лежит)"""
+    folder = os.path.join(os.path.normcase(os.path.abspath(folder)), "")
+    return os.path.normcase(os.path.abspath(path)).startswith(folder)
+
+
+def file_signature(path):
+    """Размер и время изменения файла (None, если файла нет)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def walk_files(folder):
+    """Все файлы папки и ее подпапок"""
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        for name in files:
+            yield os.path.join(root, name)
+
+
+def parse_rule(text):
+    """Правило вида 'шаблон_имени=путь_шаблона' из командной строки"""
+    pattern, sep, template = text.partition("=")
+    if not sep or not pattern.strip() or not template.strip():
+        raise argparse.ArgumentTypeError(f"правило '{text}' должно иметь вид ШАБЛОН_ИМЕНИ=ФАЙЛ_ШАБЛОНА")
+    return pattern.strip(), template.strip()
+
+
+def load_rules(path):
+    """
+    Читает правила выбора шаблона из JSON
+
+    Returns:
+        list: пары (шаблон имени, путь шаблона КС-2)
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r', encoding='utf-8') as f:
+        rows = json.load(f)
+    if not isinstance(rows, list):
+        raise ValueError(f"Файл правил {path}: нужен JSON-список правил")
+
+    rules = []
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            raise ValueError(f"Правило {number}: нужен объект {{\"pattern\": ..., \"template\": ...}}")
+        if not isinstance(row.get("pattern"), str) or not isinstance(row.get("template"), str):
+            raise ValueError(f"Правило {number}: поля pattern и template должны быть строками")
+        if not row["pattern"] or not row["template"]:
+            raise ValueError(f"Правило {number}: нужны поля pattern и template")
+        rules.append((row["pattern"], os.path.join(base_dir, row["template"])))
+    return rules
+
+
+class TemplateRules:
+    """Выбор шаблона КС-2 по пути сметы: первое подходящее правило, иначе шаблон по умолчанию"""
+
+    def __init__(self, rules=(), default=None):
+        self.rules = list(rules)
+        self.default = default
+
+    def match(self, relative_path):
+        """Шаблон для сметы (путь относительно наблюдаемой папки) или None"""
+        relative_path = relative_path.replace(os.sep, "/")
+        name = os.path.basename(relative_path)
+        for pattern, template in self.rules:
+            # Правило без папки сравнивается с именем файла, с папкой — с путем
+            target = relative_path if "/" in pattern else name
+            if fnmatch.fnmatch(target.lower(), pattern.lower()):
+                return template
+        return self.default
+
+
+class PollingWatcher:
+    """Периодический просмотр папок: изменившиеся файлы находятся сравнением с прошлым снимком"""
+
+    def __init__(self, folders, interval=DEFAULT_POLL_INTERVAL):
+        self.folders = folders
+        self.interval = interval
+        self.snapshot = self._scan()
+        self.last_scan = time.monotonic()
+
+    def _scan(self):
+        return {path: file_signature(path) for folder in self.folders for path in walk_files(folder)}
+
+    def existing(self):
+        """Файлы, лежащие в папках на момент запуска"""
+        return list(self.snapshot)
+
+    def wait(self, timeout):
+        """Ждет до timeout секунд; возвращает новые и изменившиеся файлы"""
+        delay = self.last_scan + self.interval - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(delay, 0))
+        snapshot = self._scan()
+        self.last_scan = time.monotonic()
+        changed = [path for path, signature in snapshot.items()
+                   if self.snapshot.get(path) != signature]
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Отслеживание папок через inotify. Подпапки, созданные во время работы,
+    добавляются в наблюдение; при переполнении очереди событий ядра папки
+    просматриваются заново
+    """
+
+    def __init__(self, folders):
+        self.folders = folders
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.watches = {}
+        try:
+            for folder in folders:
+                self._add_tree(folder)
+        except OSError:
+            self.close()
+            raise
+
+    def _add(self, folder):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"{os.strerror(errno)}: {folder}")
+        self.watches[wd] = folder
+
+    def _add_tree(self, folder):
+        """Добавляет папку с подпапками; возвращает уже лежащие в них файлы"""
+        files = []
+        for root, dirs, names in os.walk(folder):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            self._add(root)
+            files.extend(os.path.join(root, name) for name in names)
+        return files
+
+    def existing(self):
+        return [path for folder in self.folders for path in walk_files(folder)]
+
+    def wait(self, timeout):
+        """Ждет событий до timeout секунд; возвращает пути затронутых файлов"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        changed = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    changed.extend(self.existing())
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                folder = self.watches.get(wd)
+                if folder is None or not name:
+                    continue
+                path = os.path.join(folder, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO) and not os.path.basename(path).startswith("."):
+                        # Папку могли создать уже с файлами (перемещение, копирование)
+                        try:
+                            changed.extend(self._add_tree(path))
+                        except OSError:
+                            pass
+                    continue
+                changed.append(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def make_watcher(folders, poll_interval=None):
+    """inotify, если он доступен и опрос не задан явно, иначе просмотр папок"""
+    if poll_interval is None and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folders)
+        except (OSError, AttributeError) as e:
+            print(f"⚠️ inotify недоступен ({e}), папки будут просматриваться периодически")
+    return PollingWatcher(folders, poll_interval or DEFAULT_POLL_INTERVAL)
+
+
+class Debouncer:
+    """
+    Отложенные файлы: файл готов, когда его размер и время изменения
+    не менялись settle секунд. Проверяются только отложенные файлы
+    """
+
+    def __init__(self, settle=DEFAULT_SETTLE):
+        self.settle = settle
+        self.pending = {}
+
+    def __len__(self):
+        return len(self.pending)
+
+    def touch(self, path):
+        """Файл изменился: отсчет начинается заново"""
+        self.pending[path] = (file_signature(path), time.monotonic())
+
+    def ready(self):
+        """Файлы, переставшие меняться; удаленные файлы забываются"""
+        now = time.monotonic()
+        ready = []
+        for path, (signature, since) in list(self.pending.items()):
+            current = file_signature(path)
+            if current is None:
+                del self.pending[path]
+            elif current != signature:
+                self.pending[path] = (current, now)
+            elif now - since >= self.settle:
+                del self.pending[path]
+                ready.append(path)
+        return ready
+
+
+class WatchDaemon:
+    """
+    Обработка смет из наблюдаемых папок
+
+    Args:
+        folders: наблюдаемые папки
+        rules: TemplateRules
+        output_dir: папка актов (структура подпапок сохраняется)
+        queue_size: сколько заданий одновременно передается пулу
+        poll_interval: просматривать папки с этим интервалом вместо inotify
+    """
+
+    def __init__(self, folders, rules, output_dir, pattern=DEFAULT_PATTERN, workers=None,
+                 queue_size=None, settle=DEFAULT_SETTLE, poll_interval=None, state_path=None,
+                 build_cache_path=None, use_template_cache=True, template_cache_dir=None,
+                 metrics_path=None, save_options=None, engine="openpyxl"):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.rules = rules
+        self.output_dir = os.path.abspath(output_dir)
+        self.pattern = pattern
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size or self.workers * 2
+        self.poll_interval = poll_interval
+        self.debouncer = Debouncer(settle)
+        self.state = BatchState(state_path)
+        self.build_cache = BuildCache(build_cache_path) if build_cache_path else None
+        self.options = build_options(engine, save_options)
+        self.initargs = (use_template_cache, template_cache_dir, metrics_path, save_options, engine)
+
+        # Готовые к обработке сметы: очередь путей без повторов
+        self.waiting = deque()
+        self.waiting_set = set()
+        self.running = {}
+        self.stats = {"ok": 0, "error": 0, "rejected": 0, "up_to_date": 0}
+
+    def is_candidate(self, path):
+        """Файл сметы, а не временный файл и не акт в папке результатов"""
+        name = os.path.basename(path)
+        if is_temporary(name) or not fnmatch.fnmatch(name.lower(), self.pattern.lower()):
+            return False
+        return not is_inside(path, self.output_dir)
+
+    def relative_path(self, path):
+        """Путь сметы относительно наблюдаемой папки, в которой она лежит"""
+        path = os.path.abspath(path)
+        for folder in self.folders:
+            if is_inside(path, folder):
+                return os.path.relpath(path, folder)
+        return os.path.basename(path)
+
+    def make_job(self, path):
+        """Задание для сметы или None, если для нее нет шаблона"""
+        relative = self.relative_path(path)
+        template = self.rules.match(relative)
+        if template is None:
+            return None
+        folder, name = os.path.split(relative)
+        name = os.path.splitext(name)[0]
+        return {
+            "template": template,
+            "source": path,
+            "output": os.path.join(self.output_dir, folder, f"{name}_КС-2.xlsx"),
+        }
+
+    def enqueue(self, path):
+        if path not in self.waiting_set:
+            self.waiting_set.add(path)
+            self.waiting.append(path)
+
+    def reject(self, job, error):
+        """Смета не обрабатывается: ошибка записывается в журнал и на экран"""
+        self.stats["rejected"] += 1
+        self.state.record(dict(job, status="rejected", error=error, elapsed=0,
+                               finished=time.strftime("%Y-%m-%d %H:%M:%S")))
+        print(f"  ⚠️ {self.relative_path(job['source'])}: {error}")
+
+    def submit_waiting(self, executor):
+        """Передает пулу задания из очереди, пока в пуле есть места"""
+        while self.waiting and len(self.running) < self.queue_size:
+            path = self.waiting.popleft()
+            self.waiting_set.discard(path)
+            job = self.make_job(path)
+            if job is None:
+                self.reject({"template": None, "source": path, "output": None},
+                            "нет правила выбора шаблона")
+                continue
+            if self.build_cache is not None and self.build_cache.is_fresh(
+                    job["output"], job_inputs(job), self.options):
+                self.stats["up_to_date"] += 1
+                print(f"  ⏭️ {self.relative_path(path)}: акт актуален")
+                continue
+            try:
+                # Файл перестал меняться, но мог быть сохранен не полностью
+                preflight(job["template"], job["source"], job["output"], makedirs=True)
+            except PreflightError as e:
+                self.reject(job, str(e))
+                continue
+            print(f"  ▶️ {self.relative_path(path)}")
+            self.running[executor.submit(run_job, job)] = job
+
+    def collect_finished(self):
+        """Записывает результаты завершенных заданий"""
+        finished = [future for future in self.running if future.done()]
+        for future in finished:
+            job = self.running.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                # Рабочий процесс упал: задание записывается как ошибочное
+                result = dict(job, status="error", error=str(e) or type(e).__name__, elapsed=0)
+            result["finished"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            self.state.record(result, self.options)
+            self.stats[result["status"]] += 1
+
+            name = self.relative_path(result["source"])
+            if result["status"] == "ok":
+                print(f"  ✅ {name} → {os.path.basename(result['output'])} ({result['elapsed']} с)")
+            else:
+                print(f"  ❌ {name}: {result['error']}")
+            if self.build_cache is not None:
+                if result["status"] == "ok":
+                    self.build_cache.record(result["output"], job_inputs(result), self.options)
+                else:
+                    self.build_cache.forget(result["output"])
+        if finished and self.build_cache is not None:
+            self.build_cache.save()
+
+    def idle(self):
+        return not (self.debouncer or self.waiting or self.running)
+
+    def run(self, stop_event=None, once=False):
+        """
+        Наблюдает за папками до stop_event (или Ctrl+C).
+        once: обработать лежащие в папках сметы и завершиться
+
+        Returns:
+            dict: счетчики заданий
+        """
+        stop_event = stop_event or threading.Event()
+        os.makedirs(self.output_dir, exist_ok=True)
+        watcher = make_watcher(self.folders, self.poll_interval)
+        kind = "inotify" if isinstance(watcher, InotifyWatcher) else f"просмотр раз в {watcher.interval} с"
+        print(f"👀 Наблюдение за {', '.join(self.folders)} ({kind}), акты → {self.output_dir}")
+
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_watch_worker,
+                                       initargs=self.initargs)
+        try:
+            for path in watcher.existing():
+                if self.is_candidate(path):
+                    self.debouncer.touch(path)
+
+            while not stop_event.is_set():
+                if self.waiting and len(self.running) >= self.queue_size:
+                    # Пул заполнен: ждем освобождения места, события папок не теряются
+                    wait(self.running, timeout=TICK, return_when=FIRST_COMPLETED)
+                    changed = watcher.wait(0)
+                else:
+                    changed = watcher.wait(TICK)
+                for path in changed:
+                    if self.is_candidate(path):
+                        self.debouncer.touch(path)
+                for path in self.debouncer.ready():
+                    self.enqueue(path)
+                self.collect_finished()
+                self.submit_waiting(executor)
+                if once and self.idle():
+                    break
+        except KeyboardInterrupt:
+            print("\n⏹️ Остановка: начатые задания завершаются, очередь не выполняется")
+        finally:
+            watcher.close()
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.collect_finished()
+            if self.build_cache is not None:
+                self.build_cache.save()
+
+        print(f"🏁 Успешно: {self.stats['ok']}, ошибок: {self.stats['error']}, "
+              f"отклонено: {self.stats['rejected']}, без изменений: {self.stats['up_to_date']}")
+        return dict(self.stats)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Автоматическая обработка смет, сохраняемых в наблюдаемые папки")
+    parser.add_argument("folders", nargs="+", help="наблюдаемые папки смет")
+    parser.add_argument("--output-dir", help="папка актов КС-2")
+    parser.add_argument("--template", help="шаблон КС-2 для смет, не подходящих ни под одно правило")
+    parser.add_argument("--rule", action="append", type=parse_rule, default=[], metavar="ИМЯ=ШАБЛОН",
+                        help="правило выбора шаблона, например 'Объект1/*=КС-2 Объект1.xlsx' "
+                             "(можно повторять, действует первое подходящее)")
+    parser.add_argument("--rules", help="JSON-файл правил [{\"pattern\": ..., \"template\": ...}]")
+    parser.add_argument("--pattern", default=DEFAULT_PATTERN,
+                        help=f"какие файлы считать сметами (по умолчанию {DEFAULT_PATTERN})")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE, metavar="С",
+                        help="сколько секунд файл не должен меняться перед обработкой")
+    parser.add_argument("--poll", action="store_true",
+                        help="просматривать папки с интервалом вместо inotify (сетевые папки)")
+    parser.add_argument("--poll-interval", type=float, metavar="С",
+                        help=f"интервал просмотра папок (по умолчанию {DEFAULT_POLL_INTERVAL}), включает --poll")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="число рабочих процессов (по умолчанию — число ядер)")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help="сколько заданий одновременно передается пулу (по умолчанию 2 × workers)")
+    parser.add_argument("--once", action="store_true",
+                        help="обработать лежащие в папках сметы и завершиться")
+    parser.add_argument("--no-template-cache", action="store_true",
+                        help="загружать шаблон заново для каждого задания")
+    parser.add_argument("--template-cache-dir",
+                        help="папка для сохранения разобранных шаблонов на диск")
+    parser.add_argument("--no-fast-save", action="store_true",
+                        help="сохранять обычным способом openpyxl")
+    parser.add_argument("--compresslevel", type=int, default=DEFAULT_COMPRESSLEVEL,
+                        choices=range(10), metavar="0-9",
+                        help="степень сжатия результата (0 — без сжатия)")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="openpyxl",
+                        help="способ обработки: openpyxl или прямая вставка XML (splice)")
+    parser.add_argument("--memory-budget", type=int, metavar="МБ",
+                        help="бюджет памяти на задание: смета вписывается в акт потоком частями")
+    parser.add_argument("--summary", metavar="JSON",
+                        help="настройки итогов сметы: суммы и проверки после вставки (нужен numpy)")
+    parser.add_argument("--metrics", help="файл метрик этапов в формате JSON Lines")
+    add_profile_arguments(parser)
+    parser.add_argument("--state", default="ks2_watch_state.jsonl",
+                        help="журнал состояния заданий (JSON Lines)")
+    parser.add_argument("--build-cache",
+                        help="манифест сборки (по умолчанию рядом с настройками программы)")
+    parser.add_argument("--no-build-cache", action="store_true",
+                        help="не вести манифест сборки: собирать каждую смету при запуске заново")
+    parser.add_argument("--profile",
+                        help="профиль настроек (path_manager): шаблон, папка, процессы, движок по умолчанию")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = apply_profile(parser, parser.parse_args(argv), argv)
+    if not args.output_dir:
+        parser.error("укажите --output-dir (или профиль с папкой результатов)")
+
+    rules = list(args.rule)
+    if args.rules:
+        try:
+            rules.extend(load_rules(args.rules))
+        except (OSError, ValueError, AttributeError) as e:
+            parser.error(str(e))
+    if not rules and not args.template:
+        parser.error("укажите --template или правила выбора шаблона (--rule, --rules)")
+    for folder in args.folders:
+        if not os.path.isdir(folder):
+            parser.error(f"папка '{folder}' не найдена")
+    try:
+        summary = load_summary(args.summary)
+    except (OSError, ValueError, RuntimeError) as e:
+        parser.error(str(e))
+
+    poll_interval = args.poll_interval or (DEFAULT_POLL_INTERVAL if args.poll else None)
+    daemon = WatchDaemon(args.folders, TemplateRules(rules, args.template), args.output_dir,
+                         pattern=args.pattern, workers=args.workers, queue_size=args.queue_size,
+                         settle=args.settle, poll_interval=poll_interval, state_path=args.state,
+                         build_cache_path=None if args.no_build_cache
+                         else args.build_cache or default_manifest_path(),
+                         use_template_cache=not args.no_template_cache,
+                         template_cache_dir=args.template_cache_dir,
+                         metrics_path=args.metrics,
+                         save_options={"fast_save": not args.no_fast_save,
+                                       "compresslevel": args.compresslevel,
+                                       "memory_budget": args.memory_budget,
+                                       "summary": summary,
+                                       **profile_options(args)},
+                         engine=args.engine)
+    stats = daemon.run(once=args.once)
+    return 1 if stats["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Бюджет памяти обработки и пиковый RSS процесса.
+
+В режиме с бюджетом памяти (KS2Processor(memory_budget=...)) строки сметы
+не копируются в лист шаблона, а при сохранении передаются в запись листа
+частями. Размер части подбирается так, чтобы ячейки одной части занимали
+не больше доли бюджета; остальное остается шаблону, таблицам строк и стилей.
+"""
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Примерный объем ячейки openpyxl в памяти вместе со значением и стилем, байт
+CELL_MEMORY = 512
+# Доля бюджета на ячейки, ожидающие записи
+BUFFER_SHARE = 0.25
+MIN_CHUNK_ROWS = 16
+
+
+def chunk_rows(budget_mb, cols):
+    """Сколько строк сметы по cols столбцов держать в памяти одновременно"""
+    budget = budget_mb * 1024 * 1024 * BUFFER_SHARE
+    return max(MIN_CHUNK_ROWS, int(budget // (max(cols, 1) * CELL_MEMORY)))
+
+
+def _windows_memory_counters():
+    """Счетчики памяти процесса в Windows (None, если недоступны)"""
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+            (name, ctypes.c_size_t) for name in (
+                "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+                "PagefileUsage", "PeakPagefileUsage")]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return None
+    return counters
+
+
+def peak_rss():
+    """Пиковый RSS процесса в байтах (None, если недоступно)"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux возвращает КБ, macOS — байты
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    if sys.platform == "win32":
+        try:
+            counters = _windows_memory_counters()
+        except (OSError, AttributeError):
+            return None
+        return None if counters is None else counters.PeakWorkingSetSize
+    return None
+
+
+def current_rss():
+    """Текущий RSS процесса в байтах (None, если недоступно; в macOS недоступен)"""
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/self/statm", "rb") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+
+    if sys.platform == "win32":
+        try:
+            counters = _windows_memory_counters()
+        except (OSError, AttributeError):
+            return None
+        return None if counters is None else counters.WorkingSetSize
+    return None
+
+
+def peak_rss_mb():
+    """
+    Пиковый RSS процесса в МБ за все время его работы (None, если недоступно).
+    В долгоживущем процессе (GUI, сервис) включает и предыдущие обработки
+    """
+    peak = peak_rss()
+    return None if peak is None else round(peak / (1024 * 1024), 1)
@@ -0,0 +1,251 @@
+"""
+Параллельное чтение таблицы сметы при вставке (copy_workers).
+
+Большую часть времени вставки занимает разбор XML листа сметы: значения
+ячеек, общие строки, даты. Строки листа независимы, поэтому лист
+разрезается на блоки строк прямо в байтах XML (по границам </row>, без
+разбора), блоки разбираются в рабочих процессах в компактный вид — номера
+строк и столбцов, значения и номера стилей, — а основной процесс по
+порядку блоков отдает ячейки в KS2Processor.copy_cells. Ячейки листа КС-2
+создаются и получают стили так же, как при обычном чтении, поэтому
+результат совпадает с ним байт в байт.
+
+Состояние, которое openpyxl переносит между строками, сохраняется:
+- блок всегда начинается со строки с номером (r="..."), строки без номера
+  остаются в одном блоке с предыдущей;
+- общие формулы (t="shared") разворачиваются в основном процессе по
+  порядку ячеек, как это делает WorkSheetParser;
+- остановка на строке после max_row прекращает чтение следующих блоков.
+
+Параллельное чтение включается для таблиц от PARALLEL_MIN_ROWS строк:
+на маленьких сметах запуск процессов дороже разбора.
+"""
+import re
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from openpyxl.formula.translate import Translator
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
+from openpyxl.worksheet._reader import FORMULA_TAG, WorkSheetParser
+
+
+# Размер блока XML листа, разбираемого одним заданием, байт (около 2 тысяч строк)
+BLOCK_SIZE = 1024 * 1024
+# Таблицы меньше этого числа строк читаются в основном процессе
+PARALLEL_MIN_ROWS = 5000
+# Сколько блоков на процесс может ждать слияния (ограничивает память)
+BLOCKS_PER_WORKER = 2
+
+SHEET_DATA_RE = re.compile(rb"<((?:\w+:)?)sheetData\b[^>]*?(/?)>")
+ROOT_RE = re.compile(rb"<((?:\w+:)?worksheet)\b")
+# Граница блока: конец строки, за которым идет строка с номером
+CUT_RE = re.compile(rb'</(?:\w+:)?row>(?=\s*<(?:\w+:)?row\b[^>]*?\sr=")')
+# Граница ищется в конце накопленных данных, а если ее там нет — во всех данных
+CUT_SEARCH_TAIL = 64 * 1024
+
+# Параметры разбора книги сметы в рабочем процессе (см. init_copy_worker)
+_worker = {}
+
+
+class SharedFormula:
+    """Ячейка общей формулы, которая разворачивается в основном процессе по порядку ячеек"""
+
+    __slots__ = ("idx", "coordinate", "text")
+
+    def __init__(self, idx, coordinate, text):
+        self.idx = idx
+        self.coordinate = coordinate
+        self.text = text
+
+    def resolve(self, masters):
+        """Значение ячейки, как у WorkSheetParser.parse_formula; masters — формулы по si"""
+        value = "=" + (self.text or "")
+        if self.idx in masters:
+            return masters[self.idx].translate_formula(self.coordinate)
+        if value != "=":
+            masters[self.idx] = Translator(value, self.coordinate)
+        return value
+
+
+class BlockParser(WorkSheetParser):
+    """Разбор блока строк: общие формулы не разворачиваются (их источник может быть в другом блоке)"""
+
+    def parse_formula(self, element):
+        formula = element.find(FORMULA_TAG)
+        if formula.get('t') == "shared":
+            return SharedFormula(formula.get('si'), element.get('r'), formula.text)
+        return super().parse_formula(element)
+
+
+def split_sheet_blocks(source, block_size=BLOCK_SIZE):
+    """
+    Режет XML листа на блоки строк примерно по block_size байт. Каждый блок —
+    самостоятельный документ: начало листа до <sheetData> включительно,
+    строки блока и закрывающие теги
+
+    Yields:
+        bytes: XML блока
+    """
+    data = b""
+    while True:
+        chunk = source.read(block_size)
+        data += chunk
+        match = SHEET_DATA_RE.search(data)
+        if match is not None:
+            break
+        if not chunk:
+            return
+    if match.group(2):
+        # <sheetData/>: в листе нет строк
+        return
+
+    prefix = match.group(1)
+    root = ROOT_RE.search(data)
+    head = data[:match.end()]
+    closing = b"</%ssheetData></%s>" % (prefix, root.group(1) if root else b"worksheet")
+    end_tag = b"</%ssheetData>" % prefix
+    data = data[match.end():]
+
+    while True:
+        end = data.find(end_tag)
+        if end >= 0:
+            yield head + data[:end] + closing
+            return
+        if len(data) >= block_size:
+            cut = _find_cut(data)
+            if cut is not None:
+                yield head + data[:cut] + closing
+                data = data[cut:]
+                continue
+        chunk = source.read(block_size)
+        if not chunk:
+            # Лист оборван: разбор блока сообщит об ошибке, как при обычном чтении
+            yield head + data + closing
+            return
+        data += chunk
+
+
+def _find_cut(data):
+    """Позиция после последней границы блока в data или None"""
+    last = None
+    for start in (max(len(data) - CUT_SEARCH_TAIL, 0), 0):
+        for last in CUT_RE.finditer(data, start):
+            pass
+        if last is not None:
+            return last.end()
+    return None
+
+
+def init_copy_worker(shared_strings, data_only, epoch, date_formats, timedelta_formats):
+    """Инициализация рабочего процесса: параметры разбора книги сметы"""
+    _worker.update(shared_strings=shared_strings, data_only=data_only, epoch=epoch,
+                   date_formats=date_formats, timedelta_formats=timedelta_formats)
+
+
+def convert_block(data, max_row, max_col):
+    """
+    Разбирает блок строк в компактный вид (в рабочем процессе)
+
+    Returns:
+        tuple: (строки, столбцы, значения, номера стилей, чтение остановлено на строке после max_row)
+    """
+    parser = BlockParser(BytesIO(data), **_worker)
+    rows, cols, style_ids = array("l"), array("l"), array("l")
+    values = []
+    stopped = False
+    for row_idx, row in parser.parse():
+        if row_idx > max_row:
+            stopped = True
+            break
+        for cell in row:
+            if cell['column'] > max_col:
+                continue
+            rows.append(cell['row'])
+            cols.append(cell['column'])
+            values.append(cell['value'])
+            style_ids.append(cell['style_id'])
+    return rows, cols, values, style_ids, stopped
+
+
+class ChunkedCellReader:
+    """
+    Чтение таблиц смет рабочими процессами. Процессы запускаются для книги
+    сметы (им передаются ее общие строки и форматы дат) и остаются для
+    следующих таблиц той же книги
+    """
+
+    def __init__(self, workers, block_size=BLOCK_SIZE):
+        self.workers = workers
+        self.block_size = block_size
+        self.executor = None
+        self.workbook = None
+        self.blocks = 0
+
+    def accepts(self, sheet, max_row):
+        """Читать ли таблицу параллельно: лист читается потоком и таблица достаточно большая"""
+        return self.workers > 1 and max_row >= PARALLEL_MIN_ROWS and isinstance(sheet, ReadOnlyWorksheet)
+
+    def _executor_for(self, sheet):
+        workbook = sheet.parent
+        if self.workbook is not workbook:
+            self.close()
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=init_copy_worker,
+                initargs=(list(sheet._shared_strings), workbook.data_only, workbook.epoch,
+                          workbook._date_formats, workbook._timedelta_formats))
+            self.workbook = workbook
+        return self.executor
+
+    def iter_cells(self, sheet, max_row, max_col):
+        """
+        Генератор ячеек таблицы в пределах max_row × max_col — тех же и в том
+        же порядке, что у source_reader.iter_source_cells
+
+        Yields:
+            tuple: (строка, столбец, значение, массив стиля или None)
+        """
+        cell_styles = sheet.parent._cell_styles
+        styles_by_id = {}
+        masters = {}
+        executor = self._executor_for(sheet)
+        pending = deque()
+        window = self.workers * BLOCKS_PER_WORKER
+
+        with sheet._get_source() as source:
+            blocks = split_sheet_blocks(source, self.block_size)
+            try:
+                while True:
+                    # Следующие блоки разбираются, пока основной процесс создает ячейки
+                    while len(pending) < window:
+                        data = next(blocks, None)
+                        if data is None:
+                            break
+                        pending.append(executor.submit(convert_block, data, max_row, max_col))
+                    if not pending:
+                        break
+
+                    rows, cols, values, style_ids, stopped = pending.popleft().result()
+                    self.blocks += 1
+                    for row_idx, col_idx, value, style_id in zip(rows, cols, values, style_ids):
+                        if type(value) is SharedFormula:
+                            value = value.resolve(masters)
+
+                        style = styles_by_id.get(style_id, False)
+                        if style is False:
+                            style = cell_styles[style_id]
+                            style = styles_by_id[style_id] = style if any(style) else None
+
+                        yield row_idx, col_idx, value, style
+                    if stopped:
+                        break
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def close(self):
+        """Останавливает рабочие процессы"""
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+            self.workbook = None
@@ -1,54 +1,341 @@
-import os
+"""
+Настройки программы между сессиями: пути к файлам и параметры обработки
+в именованных профилях (шаблон, смета, результат, число процессов, движок).
+
+Файл настроек одновременно используют несколько окон GUI, пакетная
+обработка и сервис, поэтому:
+- изменения пишутся во временный файл, который заменяет настройки
+  переименованием: читатель видит либо старый, либо новый файл целиком;
+- чтение-изменение-запись выполняется под блокировкой paths_config.json.lock
+  (fcntl в Linux и macOS, msvcrt в Windows), и изменения, сохраненные
+  другим процессом, не теряются;
+- прочитанные настройки кэшируются в памяти процесса и перечитываются,
+  только когда у файла меняются время изменения, размер или номер.
+
+Формат файла:
+    {"version": 2, "active": "default",
+     "profiles": {"default": {"ks2_template": "...", "workers": 4, "engine": "splice"}}}
+Файл прежнего формата (один плоский словарь) читается как профиль "default".
+
+Пример:
+    python path_manager.py list
+    python path_manager.py set объект-1 ks2_template=КС-2.xlsx workers=4 engine=splice
+    python path_manager.py use объект-1
+"""
+import argparse
+import copy
 import json
+import os
+import sys
+import time
+from contextlib import contextmanager
 import appdirs
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+CONFIG_VERSION = 2
+DEFAULT_PROFILE = "default"
+
+# Сколько ждать блокировку файла настроек, секунд, и пауза между попытками
+LOCK_TIMEOUT = 10.0
+LOCK_RETRY = 0.05
+# Windows не дает заменить файл, пока его читает другой процесс: замена повторяется
+REPLACE_ATTEMPTS = 40
+
+# Ключи профиля, которые служат значениями по умолчанию аргументов командной
+# строки (--profile): ключ профиля → имя аргумента
+PROFILE_ARGS = {
+    "ks2_template": "template",
+    "output_dir": "output_dir",
+    "workers": "workers",
+    "engine": "engine",
+    "memory_budget": "memory_budget",
+}
+
+# Кэш прочитанных файлов настроек: путь → (подпись файла, содержимое)
+_cache = {}
+
+
+class ConfigError(Exception):
+    """Файл настроек поврежден или занят; сообщение — для пользователя"""
+
+
+@contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT):
+    """Исключительная блокировка файла path между процессами (файл создается при необходимости)"""
+    deadline = time.monotonic() + timeout
+    with open(path, 'a+b') as f:
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise ConfigError(f"Файл настроек занят другим процессом ({path})")
+                time.sleep(LOCK_RETRY)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _empty_config():
+    return {"version": CONFIG_VERSION, "active": DEFAULT_PROFILE, "profiles": {}}
+
+
+def _upgrade(data):
+    """Содержимое файла настроек в текущем формате"""
+    if not isinstance(data, dict):
+        raise ValueError("ожидается объект JSON")
+    if isinstance(data.get("profiles"), dict):
+        return data
+    # Прежний формат: один набор путей и настроек
+    config = _empty_config()
+    if data:
+        config["profiles"][DEFAULT_PROFILE] = data
+    return config
+
 
 class PathManager:
-    """Класс для управления сохранением/загрузкой путей между сессиями"""
-    
-    def __init__(self):
+    """Класс для управления сохранением/загрузкой путей и настроек между сессиями"""
+
+    def __init__(self, profile=None, config_dir=None):
+        """
+        Args:
+            profile: профиль этого экземпляра; None — активный профиль файла настроек
+            config_dir: папка настроек (по умолчанию — пользовательская папка программы)
+        """
         # Определяем путь к конфигурационному файлу в пользовательской директории
-        self.config_dir = appdirs.user_config_dir("ID+TG", "DocumentProcessor")
+        self.config_dir = config_dir or appdirs.user_config_dir("ID+TG", "DocumentProcessor")
         self.config_file = os.path.join(self.config_dir, "paths_config.json")
-        
-        # Создаем директорию конфигурации, если она не существует
-        if not os.path.exists(self.config_dir):
-            os.makedirs(self.config_dir)
-    
-    def save_paths(self, paths_dict):
-        """
-        Сохраняет пути и настройки в конфигурационный файл
-        
+        self.lock_file = f"{self.config_file}.lock"
+        # Манифест пакетной обработки (ks2_batch) хранится рядом с настройками
+        self.build_cache_file = os.path.join(self.config_dir, "build_cache.json")
+        self.profile = profile
+
+        os.makedirs(self.config_dir, exist_ok=True)
+
+    def _signature(self):
+        """Время изменения, размер и номер файла настроек (None, если файла нет)"""
+        try:
+            stat = os.stat(self.config_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _read(self):
+        """Содержимое файла настроек; пока файл не меняется, JSON не перечитывается"""
+        signature = self._signature()
+        cached = _cache.get(self.config_file)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        if signature is None:
+            data = _empty_config()
+        else:
+            try:
+                with open(self.config_file, 'r', encoding='utf-8') as f:
+                    data = _upgrade(json.load(f))
+            except (OSError, ValueError) as e:
+                raise ConfigError(f"Не удалось прочитать настройки {self.config_file}: {e}")
+        _cache[self.config_file] = (signature, data)
+        return data
+
+    def _write(self, data):
+        """Записывает настройки атомарно: временный файл заменяет прежний"""
+        tmp_path = f"{self.config_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        for attempt in range(REPLACE_ATTEMPTS):
+            try:
+                os.replace(tmp_path, self.config_file)
+                break
+            except PermissionError:
+                if attempt == REPLACE_ATTEMPTS - 1:
+                    os.remove(tmp_path)
+                    raise
+                time.sleep(LOCK_RETRY)
+        _cache[self.config_file] = (self._signature(), data)
+
+    @contextmanager
+    def _update(self):
+        """
+        Изменение настроек под блокировкой: выдает копию текущего содержимого
+        файла и записывает ее, если она изменилась
+        """
+        with file_lock(self.lock_file):
+            try:
+                data = copy.deepcopy(self._read())
+            except ConfigError:
+                # Поврежденный файл остается рядом для разбора, настройки начинаются заново
+                os.replace(self.config_file, f"{self.config_file}.bad")
+                _cache.pop(self.config_file, None)
+                data = _empty_config()
+            before = copy.deepcopy(data)
+            yield data
+            if data != before:
+                self._write(data)
+
+    def _profile_name(self, data, profile=None):
+        return profile or self.profile or data.get("active") or DEFAULT_PROFILE
+
+    def active_profile(self):
+        """Профиль, с которым работает этот экземпляр"""
+        return self._profile_name(self._read())
+
+    def profiles(self):
+        """Названия сохраненных профилей"""
+        return sorted(self._read()["profiles"])
+
+    def save_paths(self, paths_dict, profile=None):
+        """
+        Сохраняет пути и настройки в профиль (по умолчанию — профиль экземпляра).
+        Значения объединяются с сохраненными; значение None удаляет настройку
+
         Args:
             paths_dict (dict): Словарь с путями и настройками
+
+        Raises:
+            ConfigError: файл настроек занят другим процессом дольше LOCK_TIMEOUT
         """
-        try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(paths_dict, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            print(f"Ошибка сохранения конфигурации: {e}")
-    
-    def load_paths(self):
-        """
-        Загружает сохраненные пути и настройки из конфигурационного файла
-        
+        with self._update() as data:
+            values = data["profiles"].setdefault(self._profile_name(data, profile), {})
+            for key, value in paths_dict.items():
+                if value is None:
+                    values.pop(key, None)
+                else:
+                    values[key] = value
+
+    def load_paths(self, profile=None):
+        """
+        Загружает сохраненные пути и настройки профиля
+
         Returns:
-            dict: Словарь с путями и настройками или пустой словарь, если файл не найден
+            dict: Словарь с путями и настройками или пустой словарь, если профиля нет
+
+        Raises:
+            ConfigError: файл настроек поврежден или не читается
         """
-        if not os.path.exists(self.config_file):
-            return {}
-        
-        try:
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Ошибка загрузки конфигурации: {e}")
-            return {}
-    
+        data = self._read()
+        return copy.deepcopy(data["profiles"].get(self._profile_name(data, profile), {}))
+
+    def profile_defaults(self, profile):
+        """Значения аргументов командной строки из профиля (см. PROFILE_ARGS)"""
+        if profile not in self.profiles():
+            raise ConfigError(f"Профиль '{profile}' не найден")
+        return {PROFILE_ARGS[key]: value for key, value in self.load_paths(profile).items()
+                if key in PROFILE_ARGS}
+
+    def set_active(self, profile):
+        """Делает профиль активным (создает пустой, если его нет)"""
+        with self._update() as data:
+            data["profiles"].setdefault(profile, {})
+            data["active"] = profile
+
+    def delete_profile(self, profile):
+        """Удаляет профиль; активным становится профиль по умолчанию"""
+        with self._update() as data:
+            found = data["profiles"].pop(profile, None) is not None
+            if data.get("active") == profile:
+                data["active"] = DEFAULT_PROFILE
+        return found
+
     def clear_paths(self):
-        """Удаляет конфигурационный файл"""
-        if os.path.exists(self.config_file):
-            try:
+        """Удаляет конфигурационный файл со всеми профилями"""
+        with file_lock(self.lock_file):
+            if os.path.exists(self.config_file):
                 os.remove(self.config_file)
-            except Exception as e:
-                print(f"Ошибка удаления конфигурации: {e}")
\ No newline at end of file
+            _cache.pop(self.config_file, None)
+
+
+def apply_profile(parser, args, argv=None):
+    """
+    Подставляет значения профиля args.profile как значения по умолчанию
+    аргументов parser (явно заданные аргументы важнее) и разбирает argv заново
+    """
+    if not args.profile:
+        return args
+    try:
+        parser.set_defaults(**PathManager().profile_defaults(args.profile))
+    except ConfigError as e:
+        parser.error(str(e))
+    return parser.parse_args(argv)
+
+
+def _parse_value(text):
+    """Значение настройки из командной строки: число, true/false, null или строка"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Профили настроек обработки КС-2")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="список профилей")
+    show = commands.add_parser("show", help="настройки профиля")
+    show.add_argument("profile", nargs="?", help="профиль (по умолчанию активный)")
+    use = commands.add_parser("use", help="сделать профиль активным")
+    use.add_argument("profile")
+    set_values = commands.add_parser("set", help="задать настройки профиля (КЛЮЧ=ЗНАЧЕНИЕ)")
+    set_values.add_argument("profile")
+    set_values.add_argument("values", nargs="+", metavar="КЛЮЧ=ЗНАЧЕНИЕ")
+    unset = commands.add_parser("unset", help="удалить настройки профиля")
+    unset.add_argument("profile")
+    unset.add_argument("keys", nargs="+", metavar="КЛЮЧ")
+    delete = commands.add_parser("delete", help="удалить профиль")
+    delete.add_argument("profile")
+    args = parser.parse_args(argv)
+
+    manager = PathManager()
+    try:
+        if args.command == "list":
+            active = manager.active_profile()
+            for name in manager.profiles():
+                print(f"{'*' if name == active else ' '} {name}")
+        elif args.command == "show":
+            print(json.dumps(manager.load_paths(args.profile), ensure_ascii=False, indent=1))
+        elif args.command == "use":
+            manager.set_active(args.profile)
+            print(f"✅ Активный профиль: {args.profile}")
+        elif args.command == "set":
+            values = {}
+            for item in args.values:
+                key, sep, value = item.partition("=")
+                if not sep or not key:
+                    parser.error(f"ожидается КЛЮЧ=ЗНАЧЕНИЕ: '{item}'")
+                values[key] = _parse_value(value)
+            manager.save_paths(values, args.profile)
+            print(f"✅ Профиль {args.profile}: сохранено настроек {len(values)}")
+        elif args.command == "unset":
+            manager.save_paths(dict.fromkeys(args.keys), args.profile)
+            print(f"✅ Профиль {args.profile}: удалено настроек {len(args.keys)}")
+        elif args.command == "delete":
+            if not manager.delete_profile(args.profile):
+                print(f"❌ Профиль '{args.profile}' не найден")
+                return 1
+            print(f"✅ Профиль {args.profile} удален")
+    except ConfigError as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
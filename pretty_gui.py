@@ -1,10 +1,32 @@
+import time
+STARTUP_STARTED = time.perf_counter()
+
+import json
 import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import messagebox, ttk, filedialog
 from tkinterdnd2 import DND_FILES, TkinterDnD
-from openpyxl import load_workbook
-from openpyxl.utils import get_column_letter
-from path_manager import PathManager
+from path_manager import ConfigError, PathManager
+from ks2_events import PHASES, TextListener, ProgressListener
+from ks2_preflight import (PreflightError, check_template, check_source, check_output, preflight,
+                           plan_insert, plan_summary)
+
+
+# При заданной переменной окружения GUI сообщает время запуска и закрывается (см. ks2_startup)
+STARTUP_REPORT_ENV = "KS2_STARTUP_REPORT"
+
+
+PHASE_TITLES = {
+    "load": "📥 Загрузка файлов...",
+    "dimensions": "📏 Определение размеров таблицы...",
+    "shift": "🔄 Сдвиг строк в шаблоне...",
+    "insert": "📋 Вставка данных...",
+    "summary": "🧮 Итоги сметы...",
+    "shift_range": "⬅️ Сдвиг областей шапки...",
+    "save": "💾 Сохранение результата...",
+}
 
 
 def is_filled(value):
@@ -16,187 +38,30 @@ def is_filled(value):
     return True
 
 
-class KS2Processor:
-    """Класс для обработки вставки проектной сметы в шаблон КС-2"""
-
-    def __init__(self, template_path, source_path, output_path):
-        self.template_path = template_path
-        self.source_path = source_path
-        self.output_path = output_path
-
-    def find_ks2_sheet(self, workbook):
-        """Находит лист, начинающийся с 'КС-2'"""
-        for sheet_name in workbook.sheetnames:
-            if sheet_name.startswith("КС-2"):
-                return workbook[sheet_name]
-        raise ValueError("Не найден лист, начинающийся с 'КС-2'")
-
-    def get_table_dimensions(self, source_sheet):
-        """Определяет размеры таблицы из исходного файла"""
-        max_row = 0
-        max_col = 0
-
-        for row in source_sheet.iter_rows():
-            for cell in row:
-                if cell.value is not None:
-                    max_row = max(max_row, cell.row)
-                    max_col = max(max_col, cell.column)
-
-        return max_row, max_col
-
-    def shift_rows(self, sheet, start_row, rows_to_insert):
-        """Сдвигает строки вниз начиная с start_row"""
-        print(f"  Сдвиг строк с {start_row} на {rows_to_insert} позиций вниз...")
-
-        # Получаем максимальную используемую строку
-        max_row = sheet.max_row
-
-        # Сдвигаем строки снизу вверх, чтобы избежать перезаписи
-        for row_idx in range(max_row, start_row - 1, -1):
-            for col_idx in range(1, sheet.max_column + 1):
-                source_cell = sheet.cell(row=row_idx, column=col_idx)
-                target_cell = sheet.cell(row=row_idx + rows_to_insert, column=col_idx)
-
-                # Копируем значение
-                target_cell.value = source_cell.value
-
-                # Копируем форматирование
-                if source_cell.has_style:
-                    target_cell.font = source_cell.font.copy()
-                    target_cell.border = source_cell.border.copy()
-                    target_cell.fill = source_cell.fill.copy()
-                    target_cell.number_format = source_cell.number_format
-                    target_cell.protection = source_cell.protection.copy()
-                    target_cell.alignment = source_cell.alignment.copy()
-
-        # Очищаем освободившиеся строки
-        for row_idx in range(start_row, start_row + rows_to_insert):
-            for col_idx in range(1, sheet.max_column + 1):
-                sheet.cell(row=row_idx, column=col_idx).value = None
-
-    def shift_range_left(self, sheet, range_start, range_end, columns_to_shift):
-        """
-        Сдвигает диапазон ячеек влево на указанное количество столбцов
-        range_start, range_end: кортежи (строка, столбец)
-        """
-        print(f"  Сдвиг диапазона {get_column_letter(range_start[1])}{range_start[0]}:" +
-              f"{get_column_letter(range_end[1])}{range_end[0]} влево на {columns_to_shift} столбцов...")
-
-        for row_idx in range(range_start[0], range_end[0] + 1):
-            for col_idx in range(range_start[1], range_end[1] + 1):
-                source_cell = sheet.cell(row=row_idx, column=col_idx)
-                target_col = col_idx - columns_to_shift
-
-                if target_col >= 1:  # Проверяем, что не выходим за границы
-                    target_cell = sheet.cell(row=row_idx, column=target_col)
-
-                    # Копируем значение
-                    target_cell.value = source_cell.value
-
-                    # Копируем форматирование
-                    if source_cell.has_style:
-                        target_cell.font = source_cell.font.copy()
-                        target_cell.border = source_cell.border.copy()
-                        target_cell.fill = source_cell.fill.copy()
-                        target_cell.number_format = source_cell.number_format
-                        target_cell.protection = source_cell.protection.copy()
-                        target_cell.alignment = source_cell.alignment.copy()
-
-                # Очищаем исходную ячейку
-                source_cell.value = None
-
-    def insert_table(self, target_sheet, source_sheet, start_row=20):
-        """Вставляет таблицу из source_sheet в target_sheet начиная со start_row"""
-        print(f"  Вставка таблицы начиная со строки {start_row}...")
-
-        # Получаем размеры исходной таблицы
-        source_rows, source_cols = self.get_table_dimensions(source_sheet)
-        print(f"  Размеры вставляемой таблицы: {source_rows} строк × {source_cols} столбцов")
-
-        # Копируем данные
-        for row_idx in range(1, source_rows + 1):
-            for col_idx in range(1, source_cols + 1):
-                source_cell = source_sheet.cell(row=row_idx, column=col_idx)
-                target_cell = target_sheet.cell(row=start_row + row_idx - 1, column=col_idx)
-
-                # Копируем значение
-                target_cell.value = source_cell.value
-
-                # Копируем форматирование
-                if source_cell.has_style:
-                    target_cell.font = source_cell.font.copy()
-                    target_cell.border = source_cell.border.copy()
-                    target_cell.fill = source_cell.fill.copy()
-                    target_cell.number_format = source_cell.number_format
-                    target_cell.protection = source_cell.protection.copy()
-                    target_cell.alignment = source_cell.alignment.copy()
-
-        return source_rows, source_cols
-
-    def process(self):
-        """Основной метод обработки"""
-        print("🚀 === НАЧАЛО ОБРАБОТКИ ===\n")
-        print(f"📄 Шаблон: {os.path.basename(self.template_path)}")
-        print(f"📊 Исходные данные: {os.path.basename(self.source_path)}")
-
-        try:
-            # Загружаем файлы
-            print("\n📥 Загрузка файлов...")
-            template_wb = load_workbook(self.template_path)
-            source_wb = load_workbook(self.source_path)
-
-            # Находим нужные листы
-            ks2_sheet = self.find_ks2_sheet(template_wb)
-            source_sheet = source_wb.active
-
-            print(f"✅ Найден лист шаблона: '{ks2_sheet.title}'")
-            print(f"✅ Используется исходный лист: '{source_sheet.title}'")
-
-            # Получаем размеры вставляемой таблицы
-            source_rows, source_cols = self.get_table_dimensions(source_sheet)
-
-            # 1. Сдвигаем строки в шаблоне
-            print(f"\n🔄 Сдвиг строк в шаблоне...")
-            self.shift_rows(ks2_sheet, start_row=20, rows_to_insert=source_rows)
-
-            # 2. Вставляем таблицу
-            print(f"\n📋 Вставка данных...")
-            inserted_rows, inserted_cols = self.insert_table(ks2_sheet, source_sheet, start_row=20)
-
-            # 3. Проверяем, нужно ли сдвигать области G1:H18 и E12:F18
-            # Столбец H это 8-й столбец
-            if inserted_cols > 8:
-                columns_to_shift = inserted_cols - 8
-                print(f"\n⬅️  Вставленная таблица выходит за столбец H")
-                print(f"  Необходимо сдвинуть области влево на {columns_to_shift} столбцов")
-
-                # Сдвигаем область G1:H18 (столбцы 7-8, строки 1-18)
-                self.shift_range_left(ks2_sheet,
-                                      range_start=(1, 7),
-                                      range_end=(18, 8),
-                                      columns_to_shift=columns_to_shift)
-
-                # Сдвигаем область E12:F18 (столбцы 5-6, строки 12-18)
-                self.shift_range_left(ks2_sheet,
-                                      range_start=(12, 5),
-                                      range_end=(18, 6),
-                                      columns_to_shift=columns_to_shift)
-            else:
-                print(f"\n✅ Вставленная таблица заканчивается на столбце {get_column_letter(inserted_cols)}")
-                print(f"  Сдвиг областей G1:H18 и E12:F18 не требуется")
+def phase_progress(phase, done, total):
+    """Переводит этап и выполненную часть этапа в проценты общего прогресса"""
+    index = PHASES.index(phase)
+    fraction = done / total if total else 0
+    return 100 * (index + fraction) / len(PHASES)
 
-            # Сохраняем результат
-            print(f"\n💾 Сохранение результата...")
-            template_wb.save(self.output_path)
 
-            print(f"\n🎉 === ОБРАБОТКА ЗАВЕРШЕНА ===")
-            print(f"✅ Результат сохранен: {os.path.basename(self.output_path)}")
+def parse_memory_budget(value):
+    """Бюджет памяти в МБ из настроек или окружения (None, если не задан или задан неверно)"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
 
-            return True
 
-        except Exception as e:
-            print(f"\n❌ Ошибка: {str(e)}")
-            raise
+def load_processing():
+    """
+    Модули обработки: openpyxl и весь путь КС-2 загружаются после показа окна
+    (в фоне или при первой обработке); повторный вызов возвращает уже загруженные
+    """
+    from ks2_processor import KS2Processor, ProcessingCancelled
+    from ks2_service import RemoteKS2Processor
+    return KS2Processor, ProcessingCancelled, RemoteKS2Processor
 
 
 class ToolTip:
@@ -238,14 +103,27 @@ class KS2Application:
         self.root.title("📊 Вставка проектной сметы в КС-2")
         self.root.geometry("800x800")
 
-        # Инициализация менеджера путей
-        self.path_manager = PathManager()
-        saved_paths = self.path_manager.load_paths()
+        # Инициализация менеджера путей: профиль можно выбрать переменной окружения
+        self.path_manager = PathManager(profile=os.environ.get("KS2_PROFILE") or None)
+        try:
+            saved_paths = self.path_manager.load_paths()
+        except ConfigError as e:
+            saved_paths = {}
+            self.root.after(200, lambda: messagebox.showwarning(
+                "Настройки", f"{e}\nСохраненные пути не загружены", parent=self.root))
 
         # Переменные для путей
         self.template_path = tk.StringVar(value=saved_paths.get("ks2_template", ""))
         self.source_path = tk.StringVar(value=saved_paths.get("source_file", ""))
         self.output_path = tk.StringVar(value=saved_paths.get("output_file", ""))
+        # Адрес сервиса обработки (ks2_service); пустой — обработка на этом компьютере
+        self.service_url = tk.StringVar(value=saved_paths.get("service_url",
+                                                              os.environ.get("KS2_SERVICE_URL", "")))
+        # Бюджет памяти обработки в МБ (для терминальных серверов); пустой — обычный режим
+        self.memory_budget = parse_memory_budget(saved_paths.get("memory_budget",
+                                                                 os.environ.get("KS2_MEMORY_BUDGET")))
+        # Отчет профилирования обработки (ks2_profile) для обращения в поддержку
+        self.profile_report = tk.BooleanVar(value=False)
 
         # Переменные валидации
         self.validation_vars = {
@@ -253,6 +131,9 @@ class KS2Application:
             'source': tk.BooleanVar(),
             'output': tk.BooleanVar()
         }
+        # Результаты предварительной проверки файлов (ks2_preflight) и ее ошибки
+        self.preflight_results = {}
+        self.validation_errors = {}
 
         self.setup_ui()
 
@@ -307,6 +188,22 @@ class KS2Application:
                                  self.validation_vars['output'],
                                  is_output=True)
 
+        # Необязательный сервис обработки
+        service_frame = ttk.LabelFrame(main_frame, text="🖧 Сервис обработки (необязательно)", padding=(10, 5))
+        service_frame.pack(fill=tk.X, pady=8)
+
+        service_entry = ttk.Entry(service_frame, textvariable=self.service_url, font=("Arial", 9))
+        service_entry.pack(fill=tk.X)
+        ToolTip(service_entry, "Адрес сервиса ks2_service, например http://127.0.0.1:8765.\n"
+                               "Оставьте пустым для обработки на этом компьютере")
+
+        profile_check = ttk.Checkbutton(main_frame, text="📈 Записать отчет профилирования",
+                                        variable=self.profile_report)
+        profile_check.pack(anchor=tk.W)
+        ToolTip(profile_check, "Время этапов, самые затратные функции и рост памяти сохраняются\n"
+                               "рядом с результатом (файл .profile.json), чтобы приложить к обращению.\n"
+                               "Только при обработке на этом компьютере")
+
         # Информационная панель
         info_frame = ttk.LabelFrame(main_frame, text="ℹ️ Информация", padding=(15, 10))
         info_frame.pack(fill=tk.BOTH, expand=True, pady=(20, 0))
@@ -426,19 +323,35 @@ class KS2Application:
             self.validate_path(var, validation_var, must_exist)
 
     def validate_path(self, var, validation_var, must_exist=True):
-        """Валидация пути"""
-        path = var.get()
+        """
+        Валидация пути. Шаблон и смета проверяются по содержимому без загрузки
+        книг (ks2_preflight, миллисекунды), для результата — папка и то, что он
+        не совпадает с входными файлами
+        """
+        path = var.get().strip()
+        kind = next(key for key, value in self.validation_vars.items() if value is validation_var)
+        self.preflight_results.pop(kind, None)
+        self.validation_errors.pop(kind, None)
 
         if not is_filled(path):
             validation_var.set(False)
             self.update_process_button()
             return
 
-        if must_exist:
-            validation_var.set(os.path.exists(path) and os.path.isfile(path))
-        else:
-            # Для выходного файла проверяем только, что путь валидный
-            validation_var.set(len(path) > 0)
+        try:
+            if kind == 'template':
+                self.preflight_results[kind] = check_template(path)
+            elif kind == 'source':
+                self.preflight_results[kind] = check_source(path)
+            elif must_exist:
+                if not os.path.isfile(path):
+                    raise PreflightError("Файл не найден")
+            else:
+                check_output(path, (self.template_path.get().strip(), self.source_path.get().strip()))
+            validation_var.set(True)
+        except PreflightError as e:
+            self.validation_errors[kind] = str(e)
+            validation_var.set(False)
 
         self.update_process_button()
 
@@ -447,26 +360,45 @@ class KS2Application:
         all_valid = all(var.get() for var in self.validation_vars.values())
 
         if all_valid:
+            plan = plan_insert(self.preflight_results['template'], self.preflight_results['source'])
             self.process_btn.config(state='normal')
-            self.status_label.config(text="✅ Готово к обработке", foreground="green")
+            self.status_label.config(text=f"✅ Готово к обработке: {plan_summary(plan)}", foreground="green")
+        elif self.validation_errors:
+            self.process_btn.config(state='disabled')
+            error = next(iter(self.validation_errors.values()))
+            self.status_label.config(text=f"❌ {error}", foreground="red")
         else:
             self.process_btn.config(state='disabled')
             self.status_label.config(text="📋 Заполните все поля", foreground="orange")
 
     def process_files(self):
         """Запуск обработки файлов"""
+        # Файлы могли измениться после выбора: повторная быстрая проверка перед обработкой
+        try:
+            preflight(self.template_path.get().strip(), self.source_path.get().strip(),
+                      self.output_path.get().strip())
+        except PreflightError as e:
+            messagebox.showerror("Ошибка", str(e), parent=self.root)
+            return
+
         # Сохраняем пути
         paths_to_save = {
             "ks2_template": self.template_path.get().strip(),
             "source_file": self.source_path.get().strip(),
-            "output_file": self.output_path.get().strip()
+            "output_file": self.output_path.get().strip(),
+            "service_url": self.service_url.get().strip(),
+            "memory_budget": self.memory_budget or None
         }
-        self.path_manager.save_paths(paths_to_save)
+        try:
+            self.path_manager.save_paths(paths_to_save)
+        except (ConfigError, OSError) as e:
+            # Обработке это не мешает: пути просто не запомнятся
+            self.status_label.config(text=f"⚠️ Пути не сохранены: {e}", foreground="orange")
 
         # Создаем окно прогресса
         progress_window = tk.Toplevel(self.root)
         progress_window.title("Обработка...")
-        progress_window.geometry("500x200")
+        progress_window.geometry("500x260")
         progress_window.transient(self.root)
         progress_window.grab_set()
 
@@ -476,6 +408,13 @@ class KS2Application:
         y = (progress_window.winfo_screenheight() // 2) - (progress_window.winfo_height() // 2)
         progress_window.geometry(f"+{x}+{y}")
 
+        # Индикатор прогресса и текущий этап
+        phase_label = ttk.Label(progress_window, text="Подготовка...", font=("Arial", 9))
+        phase_label.pack(fill=tk.X, padx=10, pady=(10, 0))
+
+        progress_bar = ttk.Progressbar(progress_window, mode='determinate', maximum=100)
+        progress_bar.pack(fill=tk.X, padx=10, pady=(5, 0))
+
         # Текстовое поле для вывода
         text_frame = ttk.Frame(progress_window)
         text_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -487,62 +426,99 @@ class KS2Application:
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         text_widget.config(yscrollcommand=scrollbar.set)
 
-        # Перенаправляем print в текстовое поле
-        import sys
-        from io import StringIO
-
-        old_stdout = sys.stdout
-        sys.stdout = StringIO()
+        # Отмена обработки
+        cancel_event = threading.Event()
+
+        def cancel():
+            cancel_event.set()
+            cancel_btn.config(state='disabled')
+            phase_label.config(text="Отмена...")
+
+        cancel_btn = ttk.Button(progress_window, text="⛔ Отмена", command=cancel)
+        cancel_btn.pack(pady=(0, 10))
+        progress_window.protocol("WM_DELETE_WINDOW", cancel)
+
+        # Обработка идет в рабочем потоке, события передаются через очередь
+        events = queue.Queue()
+
+        listeners = [
+            TextListener(write=lambda message: events.put(("log", message))),
+            ProgressListener(lambda phase, done, total: events.put(("progress", phase, done, total))),
+        ]
+        paths = (self.template_path.get().strip(),
+                 self.source_path.get().strip(),
+                 self.output_path.get().strip())
+        service_url = self.service_url.get().strip()
+        memory_budget = self.memory_budget
+        profile_report = self.profile_report.get() or None
+
+        def worker():
+            # Модули обработки загружаются в рабочем потоке, окно не замирает
+            try:
+                KS2Processor, ProcessingCancelled, RemoteKS2Processor = load_processing()
+            except Exception as e:
+                events.put(("error", str(e)))
+                return
+
+            if service_url:
+                # Обработка в пуле «прогретого» сервиса, события приходят так же
+                processor = RemoteKS2Processor(*paths, service_url,
+                                               listeners=listeners, cancel_event=cancel_event)
+            else:
+                processor = KS2Processor(*paths, listeners=listeners, cancel_event=cancel_event,
+                                         memory_budget=memory_budget, profile_report=profile_report)
+
+            try:
+                processor.process()
+                events.put(("done",))
+            except ProcessingCancelled:
+                events.put(("cancelled",))
+            except Exception as e:
+                events.put(("error", str(e)))
+
+        def finish(event):
+            progress_window.grab_release()
+            progress_window.destroy()
 
-        def update_text():
-            output = sys.stdout.getvalue()
-            text_widget.delete(1.0, tk.END)
-            text_widget.insert(tk.END, output)
-            text_widget.see(tk.END)
-            progress_window.update()
+            if event[0] == "done":
+                messagebox.showinfo(
+                    "Успех",
+                    "Обработка успешно завершена!\n\n" +
+                    f"Результат сохранен в:\n{self.output_path.get()}",
+                    parent=self.root
+                )
+            elif event[0] == "cancelled":
+                messagebox.showwarning("Отмена", "Обработка отменена", parent=self.root)
+            else:
+                messagebox.showerror(
+                    "Ошибка",
+                    f"Произошла ошибка при обработке:\n\n{event[1]}",
+                    parent=self.root
+                )
 
-        try:
-            # Создаем процессор
-            processor = KS2Processor(
-                self.template_path.get().strip(),
-                self.source_path.get().strip(),
-                self.output_path.get().strip()
-            )
-
-            # Обновляем GUI во время обработки
-            def process_with_updates():
+        def poll():
+            # Дописываем только новые строки журнала
+            while True:
                 try:
-                    processor.process()
-                    update_text()
-
-                    messagebox.showinfo(
-                        "Успех",
-                        "Обработка успешно завершена!\n\n" +
-                        f"Результат сохранен в:\n{self.output_path.get()}",
-                        parent=progress_window
-                    )
-                except Exception as e:
-                    update_text()
-                    messagebox.showerror(
-                        "Ошибка",
-                        f"Произошла ошибка при обработке:\n\n{str(e)}",
-                        parent=progress_window
-                    )
-                finally:
-                    sys.stdout = old_stdout
-                    progress_window.destroy()
-
-            # Запускаем обработку после отображения окна
-            progress_window.after(100, process_with_updates)
-
-        except Exception as e:
-            sys.stdout = old_stdout
-            progress_window.destroy()
-            messagebox.showerror(
-                "Ошибка",
-                f"Произошла ошибка:\n\n{str(e)}",
-                parent=self.root
-            )
+                    event = events.get_nowait()
+                except queue.Empty:
+                    break
+
+                if event[0] == "log":
+                    text_widget.insert(tk.END, event[1] + "\n")
+                    text_widget.see(tk.END)
+                elif event[0] == "progress":
+                    _, phase, done, total = event
+                    progress_bar['value'] = phase_progress(phase, done, total)
+                    phase_label.config(text=PHASE_TITLES.get(phase, phase))
+                else:
+                    finish(event)
+                    return
+
+            progress_window.after(100, poll)
+
+        threading.Thread(target=worker, daemon=True).start()
+        progress_window.after(100, poll)
 
     def run(self):
         """Запуск приложения"""
@@ -552,8 +528,23 @@ class KS2Application:
         y = (self.root.winfo_screenheight() // 2) - (self.root.winfo_height() // 2)
         self.root.geometry(f"+{x}+{y}")
 
+        if os.environ.get(STARTUP_REPORT_ENV):
+            self.root.after_idle(self.report_startup)
+        else:
+            # Окно уже на экране: модули обработки загружаются в фоне
+            self.root.after(200, lambda: threading.Thread(target=load_processing, daemon=True).start())
+
         self.root.mainloop()
 
+    def report_startup(self):
+        """Выводит время до показа окна и до загрузки модулей обработки, затем закрывает окно"""
+        self.root.update()
+        window = time.perf_counter() - STARTUP_STARTED
+        load_processing()
+        print(json.dumps({"window": round(window, 4),
+                          "processing": round(time.perf_counter() - STARTUP_STARTED, 4)}), flush=True)
+        self.root.quit()
+
 
 if __name__ == "__main__":
     app = KS2Application()
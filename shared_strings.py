@@ -0,0 +1,94 @@
+"""
+Таблица общих строк (sharedStrings.xml) книги результата.
+
+Сметы повторяют одни и те же наименования работ, единицы измерения и
+шифры тысячи раз. Вместо того чтобы писать каждую строку в ячейку заново,
+строки собираются в общую таблицу, а ячейки ссылаются на них по индексу.
+Строки шаблона идут в таблице первыми и сохраняют свои индексы, поэтому
+листы шаблона, перенесенные без изменений, остаются верными.
+"""
+import re
+from xml.sax.saxutils import escape
+
+from openpyxl.xml.constants import SHEET_MAIN_NS
+
+
+SHARED_STRING_RE = re.compile(r"<si>(.*?)</si>|<si/>", re.S)
+PREFIXED_SST_RE = re.compile(r"<\w+:sst\b")
+
+
+def text_xml(text):
+    """Содержимое <si> для обычной строки"""
+    if text != text.strip():
+        return f'<t xml:space="preserve">{escape(text)}</t>'
+    return f"<t>{escape(text)}</t>"
+
+
+def parse_shared_strings(xml):
+    """
+    Разбирает sharedStrings.xml
+
+    Returns:
+        list: содержимое каждого <si> в виде XML или None, если разметка
+            нестандартная (элементы с префиксом пространства имен)
+    """
+    if PREFIXED_SST_RE.search(xml):
+        return None
+    return [entry or "" for entry in SHARED_STRING_RE.findall(xml)]
+
+
+class SharedStringTable:
+    """
+    Общие строки результата: строки шаблона, затем новые уникальные строки.
+    Ключ строки — содержимое <si>, поэтому форматированный текст тоже
+    объединяется, если совпадает разметка
+    """
+
+    def __init__(self, entries=()):
+        self.entries = list(entries)
+        self.template_count = len(self.entries)
+        self._ids = {}
+        self._text_ids = {}
+        self._used = set()
+        self.cells = 0
+
+        for idx, entry in enumerate(self.entries):
+            self._ids.setdefault(entry, idx)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add_xml(self, xml):
+        """Индекс строки по содержимому <si>; одинаковые строки получают один индекс"""
+        idx = self._ids.get(xml)
+        if idx is None:
+            idx = self._ids[xml] = len(self.entries)
+            self.entries.append(xml)
+        self.cells += 1
+        self._used.add(idx)
+        return idx
+
+    def add(self, text):
+        """Индекс обычной строки"""
+        idx = self._text_ids.get(text)
+        if idx is None:
+            # Экранирование выполняется один раз на уникальную строку
+            idx = self._text_ids[text] = self.add_xml(text_xml(text))
+            return idx
+        self.cells += 1
+        self._used.add(idx)
+        return idx
+
+    def stats(self):
+        """Сколько ячеек записано ссылками и сколько среди них разных строк"""
+        return {
+            "string_cells": self.cells,
+            "unique_strings": len(self._used),
+            "new_strings": len(self.entries) - self.template_count,
+        }
+
+    def to_xml(self):
+        """XML части sharedStrings.xml"""
+        items = "".join(f"<si>{entry}</si>" for entry in self.entries)
+        return (f'<sst xmlns="{SHEET_MAIN_NS}" uniqueCount="{len(self.entries)}">{items}</sst>'
+                ).encode("utf-8")
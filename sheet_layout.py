@@ -0,0 +1,298 @@
+"""
+Разметка таблицы сметы: объединенные области, высоты строк, ширины столбцов.
+
+SheetLayout собирается из загруженного листа или потоком из XML листа
+(вместе с поиском границ таблицы, см. table_dimensions) и переносится в лист
+КС-2 целиком: высоты строк и ширины столбцов — одним обновлением словарей
+размеров, объединения — без проверки каждой новой области по всем областям
+листа. Пересечения и покрытие ячеек объединениями ищутся через MergeIndex —
+интервальный индекс по строкам: обход N строк при M объединениях стоит
+O(N + M log M) вместо O(N × M).
+"""
+import re
+from bisect import bisect_right
+from copy import copy
+from heapq import heappop, heappush
+
+from openpyxl.cell.cell import MergedCell
+from openpyxl.utils import get_column_letter, range_boundaries
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet.dimensions import ColumnDimension, RowDimension
+from openpyxl.worksheet.merge import MergedCellRange
+
+
+# Свойства строк и столбцов, которые переносятся из сметы (стили строк и
+# столбцов не переносятся: у ячеек сметы свои стили)
+ROW_ATTRS = ("ht", "customHeight", "hidden", "outlineLevel", "collapsed", "thickTop", "thickBot")
+COL_ATTRS = ("width", "customWidth", "bestFit", "hidden", "outlineLevel", "collapsed")
+
+ROW_TAG_RE = re.compile(rb"<(?:\w+:)?row\s([^>]*?)/?>")
+ROW_PROPS_RE = re.compile(rb'\b(?:ht|hidden|outlineLevel|collapsed|thickTop|thickBot)="')
+COL_TAG_RE = re.compile(rb"<(?:\w+:)?col\s([^>]*?)/?>")
+MERGE_TAG_RE = re.compile(rb'<(?:\w+:)?mergeCell\s[^>]*?\bref="([^"]+)"')
+ATTR_RE = re.compile(rb'([\w:]+)="([^"]*)"')
+
+
+def ref_bounds(ref):
+    """Границы области A1:B2 в виде (min_row, min_col, max_row, max_col)"""
+    min_col, min_row, max_col, max_row = range_boundaries(ref)
+    return min_row, min_col, max_row, max_col
+
+
+def bounds_ref(bounds):
+    """Адрес области A1:B2 по границам (min_row, min_col, max_row, max_col)"""
+    min_row, min_col, max_row, max_col = bounds
+    return f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{max_row}"
+
+
+def _overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class RowSweep:
+    """
+    Обход строк по возрастанию с набором объединений, задевающих текущие строки.
+    Каждое объединение один раз попадает в кучу и один раз из нее уходит
+    """
+
+    def __init__(self, ranges):
+        self.ranges = ranges
+        self.next = 0
+        self.active = []
+
+    def covering(self, min_row, max_row=None):
+        """
+        Объединения, задевающие строки min_row..max_row; min_row не должен
+        убывать от вызова к вызову
+        """
+        max_row = min_row if max_row is None else max_row
+        ranges, active = self.ranges, self.active
+        while self.next < len(ranges) and ranges[self.next][0] <= max_row:
+            bounds = ranges[self.next]
+            heappush(active, (bounds[2], bounds))
+            self.next += 1
+        while active and active[0][0] < min_row:
+            heappop(active)
+        return [bounds for end, bounds in active if bounds[0] <= max_row]
+
+
+class MergeIndex:
+    """Объединенные области (min_row, min_col, max_row, max_col), упорядоченные по первой строке"""
+
+    def __init__(self, ranges=()):
+        self.ranges = sorted(ranges)
+
+    @classmethod
+    def from_refs(cls, refs):
+        return cls(ref_bounds(ref) for ref in refs)
+
+    @classmethod
+    def from_sheet(cls, sheet):
+        return cls((r.min_row, r.min_col, r.max_row, r.max_col) for r in sheet.merged_cells.ranges)
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def sweep(self):
+        return RowSweep(self.ranges)
+
+    def overlaps(self, ranges):
+        """
+        Пары (область из ranges, пересекающая ее область индекса) —
+        одним обходом по строкам
+        """
+        sweep = self.sweep()
+        found = []
+        for bounds in sorted(ranges):
+            found.extend((bounds, other) for other in sweep.covering(bounds[0], bounds[2])
+                         if _overlap(bounds, other))
+        return found
+
+    def check_free(self, ranges, action):
+        """Ошибка, если области ranges задевают объединенные области индекса"""
+        for bounds, other in self.overlaps(ranges):
+            raise ValueError(f"Область {bounds_ref(bounds)} пересекается с объединенной областью "
+                             f"{bounds_ref(other)} и не может быть {action}")
+
+
+class SheetLayout:
+    """
+    Разметка листа: объединения, свойства строк {строка: {атрибут: текст}}
+    и описания столбцов [(min, max, {атрибут: текст})] в виде атрибутов XML
+    """
+
+    def __init__(self, merged=(), rows=None, columns=()):
+        self.merged = list(merged)
+        self.rows = rows or {}
+        self.columns = list(columns)
+        self._in_head = True
+
+    @classmethod
+    def from_worksheet(cls, sheet):
+        """Разметка загруженного листа openpyxl"""
+        layout = cls(MergeIndex.from_sheet(sheet).ranges)
+        for idx, dim in sheet.row_dimensions.items():
+            attrs = {key: value for key, value in dim if key in ROW_ATTRS}
+            if attrs:
+                layout.rows[idx] = attrs
+        for dim in sheet.column_dimensions.values():
+            dim.reindex()
+            attrs = {key: value for key, value in dim if key in COL_ATTRS}
+            if attrs:
+                layout.columns.append((dim.min, dim.max, attrs))
+        return layout
+
+    def scan(self, data):
+        """
+        Дополняет разметку фрагментом XML листа (байты). Фрагменты
+        передаются по порядку и режутся по границам строк
+        """
+        if self._in_head:
+            end = data.find(b"sheetData")
+            for match in COL_TAG_RE.finditer(data if end < 0 else data[:end]):
+                attrs = {key.decode(): value.decode() for key, value in ATTR_RE.findall(match.group(1))}
+                carried = {key: value for key, value in attrs.items() if key in COL_ATTRS}
+                if carried and "min" in attrs and "max" in attrs:
+                    self.columns.append((int(attrs["min"]), int(attrs["max"]), carried))
+            self._in_head = end < 0
+
+        for match in ROW_TAG_RE.finditer(data):
+            # У большинства строк только номер и spans
+            if ROW_PROPS_RE.search(match.group(1)) is None:
+                continue
+            attrs = {key.decode(): value.decode() for key, value in ATTR_RE.findall(match.group(1))}
+            carried = {key: value for key, value in attrs.items() if key in ROW_ATTRS}
+            if carried and "r" in attrs:
+                self.rows[int(attrs["r"])] = carried
+
+        if b"mergeCell" in data:
+            self.merged.extend(ref_bounds(ref.decode()) for ref in MERGE_TAG_RE.findall(data))
+
+    def table(self, rows, cols):
+        """
+        Разметка таблицы сметы rows × cols: объединения обрезаются по ее
+        границам, строки и столбцы за границами отбрасываются
+        """
+        merged = []
+        for min_row, min_col, max_row, max_col in self.merged:
+            bounds = (min_row, min_col, min(max_row, rows), min(max_col, cols))
+            if bounds[0] <= bounds[2] and bounds[1] <= bounds[3] and bounds[:2] != bounds[2:]:
+                merged.append(bounds)
+        columns = [(lo, min(hi, cols), attrs) for lo, hi, attrs in self.columns if lo <= cols]
+        return SheetLayout(sorted(merged), {idx: attrs for idx, attrs in self.rows.items() if idx <= rows},
+                           sorted(columns, key=lambda item: item[0]))
+
+    def shifted(self, offset):
+        """Разметка, сдвинутая на offset строк вниз"""
+        merged = [(r[0] + offset, r[1], r[2] + offset, r[3]) for r in self.merged]
+        return SheetLayout(merged, {idx + offset: attrs for idx, attrs in self.rows.items()},
+                           self.columns)
+
+    def covered(self):
+        """Ячейки (строка, столбец) внутри объединений, кроме левых верхних"""
+        cells = set()
+        for min_row, min_col, max_row, max_col in self.merged:
+            cells.update((row, col) for row in range(min_row, max_row + 1)
+                         for col in range(min_col, max_col + 1))
+            cells.discard((min_row, min_col))
+        return cells
+
+
+def _subtract(lo, hi, covered, starts):
+    """Части отрезка lo..hi, не закрытые отрезками covered (упорядочены, не пересекаются)"""
+    parts = []
+    index = max(bisect_right(starts, lo) - 1, 0)
+    while lo <= hi and index < len(covered):
+        cover_lo, cover_hi = covered[index]
+        if cover_lo > hi:
+            break
+        if cover_hi >= lo:
+            if cover_lo > lo:
+                parts.append((lo, cover_lo - 1))
+            lo = max(lo, cover_hi + 1)
+        index += 1
+    if lo <= hi:
+        parts.append((lo, hi))
+    return parts
+
+
+def overlay_columns(base, overrides):
+    """
+    Накладывает описания столбцов overrides на base, оба вида [(min, max, данные)].
+    Закрытые части описаний base удаляются (описание делится на части)
+
+    Returns:
+        list: (min, max, данные, из overrides ли описание) по возрастанию min
+    """
+    covered = sorted((lo, hi) for lo, hi, data in overrides)
+    starts = [lo for lo, hi in covered]
+    result = [(part_lo, part_hi, data, False)
+              for lo, hi, data in base for part_lo, part_hi in _subtract(lo, hi, covered, starts)]
+    result.extend((lo, hi, data, True) for lo, hi, data in overrides)
+    result.sort(key=lambda item: item[0])
+    return result
+
+
+def apply_row_dimensions(sheet, rows):
+    """
+    Записывает свойства строк {строка: атрибуты} в лист одним обновлением.
+    У строк, уже описанных в листе, остальные свойства (стиль строки) сохраняются
+    """
+    dims = sheet.row_dimensions
+    added = {}
+    for idx, attrs in rows.items():
+        dim = RowDimension(sheet, index=idx, **attrs)
+        existing = dims.get(idx)
+        if existing is None:
+            added[idx] = dim
+            continue
+        for key in attrs:
+            if key != "customHeight":
+                setattr(existing, key, getattr(dim, key))
+    dims.update(added)
+
+
+def apply_column_dimensions(sheet, columns):
+    """Заменяет описания столбцов листа описаниями columns [(min, max, атрибуты)]"""
+    if not columns:
+        return
+    dims = sheet.column_dimensions
+    base = []
+    for dim in dims.values():
+        dim.reindex()
+        base.append((dim.min, dim.max, dim))
+
+    dims.clear()
+    for lo, hi, data, override in overlay_columns(base, columns):
+        letter = get_column_letter(lo)
+        if override:
+            dim = ColumnDimension(sheet, index=letter, min=lo, max=hi, **data)
+        else:
+            dim = copy(data)
+            dim.index, dim.min, dim.max = letter, lo, hi
+        dims[letter] = dim
+
+
+def merge_cells(sheet, bounds):
+    """
+    Объединяет область так же, как Worksheet.merge_cells, но без сравнения
+    с каждой областью листа (пересечения проверяются заранее через MergeIndex)
+    и без переноса границ левой верхней ячейки на края области: объединения
+    создаются до копирования ячеек сметы, и стили ячеек области приходят из
+    нее. Стили ячеек шаблона, оказавшихся внутри области, сохраняются
+    """
+    min_row, min_col, max_row, max_col = bounds
+    merged = MergedCellRange(sheet, CellRange(min_col=min_col, min_row=min_row,
+                                              max_col=max_col, max_row=max_row).coord)
+    sheet.merged_cells.ranges.add(merged)
+
+    cells = sheet._cells
+    for row in range(min_row, max_row + 1):
+        for col in range(min_col, max_col + 1):
+            if row == min_row and col == min_col:
+                continue
+            cell = MergedCell(sheet, row=row, column=col)
+            existing = cells.get((row, col))
+            if existing is not None and existing.has_style:
+                cell._style = copy(existing._style)
+            cells[row, col] = cell
@@ -0,0 +1,305 @@
+from collections import OrderedDict
+
+from openpyxl.cell.cell import Cell
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet.formula import ArrayFormula
+
+from formula_refs import shift_formula_rows, move_formula_block, offset_formula_rows
+
+
+def _row_mapper(start_row, rows_to_insert):
+    """Возвращает функцию пересчета номера строки при вставке"""
+    def map_row(row):
+        return row + rows_to_insert if row >= start_row else row
+    return map_row
+
+
+def _shift_cell_range(cell_range, map_row):
+    """Сдвигает границы диапазона на месте (диапазон не должен лежать в множестве)"""
+    cell_range.min_row = map_row(cell_range.min_row)
+    cell_range.max_row = map_row(cell_range.max_row)
+    return cell_range
+
+
+def _shift_range_string(ref, map_row):
+    """Сдвигает строковый адрес диапазона вида A1:B2"""
+    if not ref:
+        return ref
+    return _shift_cell_range(CellRange(ref), map_row).coord
+
+
+def _shift_multi_range(multi_range, map_row):
+    """Сдвигает все диапазоны MultiCellRange с пересборкой множества"""
+    ranges = list(multi_range.ranges)
+    for cell_range in ranges:
+        _shift_cell_range(cell_range, map_row)
+    multi_range.ranges = set(ranges)
+
+
+def _shift_formula_value(value, title, start_row, rows_to_insert):
+    """Пересчитывает ссылки в значении ячейки-формулы"""
+    if isinstance(value, str):
+        return shift_formula_rows(value, title, start_row, rows_to_insert)
+    if isinstance(value, ArrayFormula):
+        if value.text:
+            value.text = shift_formula_rows(value.text, title, start_row, rows_to_insert)
+        value.ref = _shift_range_string(value.ref, _row_mapper(start_row, rows_to_insert))
+    return value
+
+
+def _shift_cells(sheet, start_row, rows_to_insert):
+    """
+    Перестраивает словарь ячеек листа за один проход.
+    Возвращает количество перемещенных ячеек
+    """
+    title = sheet.title
+    gap_end = start_row + rows_to_insert
+    cells = {}
+    gap_cells = []
+    moved = 0
+
+    for (row, col), cell in sheet._cells.items():
+        if cell.data_type == "f":
+            cell._value = _shift_formula_value(cell._value, title, start_row, rows_to_insert)
+
+        if row < start_row:
+            cells[row, col] = cell
+            continue
+
+        # Освободившиеся строки сохраняют форматирование исходных строк
+        if row < gap_end and cell.has_style:
+            gap_cells.append(Cell(sheet, row=row, column=col, style_array=cell._style))
+
+        new_row = row + rows_to_insert
+        cell.row = new_row
+        cells[new_row, col] = cell
+        if getattr(cell, "_hyperlink", None) is not None:
+            cell._hyperlink.ref = cell.coordinate
+        moved += 1
+
+    for cell in gap_cells:
+        cells[cell.row, cell.column] = cell
+
+    sheet._cells = cells
+    return moved
+
+
+def _shift_merged_cells(sheet, map_row):
+    """Сдвигает объединенные ячейки"""
+    merged = list(sheet.merged_cells.ranges)
+    if not merged:
+        return
+
+    for merged_range in merged:
+        height = merged_range.max_row - merged_range.min_row
+        _shift_cell_range(merged_range, map_row)
+        # Объединение, пересекающее точку вставки, растягивается как в Excel
+        if merged_range.max_row - merged_range.min_row != height:
+            merged_range.format()
+    sheet.merged_cells.ranges = set(merged)
+
+
+def _shift_row_dimensions(sheet, start_row, rows_to_insert):
+    """Сдвигает высоты и свойства строк"""
+    dims = sheet.row_dimensions
+    moved = [(idx, dims.pop(idx)) for idx in sorted(dims) if idx >= start_row]
+    for idx, dim in moved:
+        dim.index = idx + rows_to_insert
+        dims[idx + rows_to_insert] = dim
+
+
+def _shift_print_settings(sheet, map_row):
+    """Сдвигает область печати и сквозные строки"""
+    if sheet._print_area.ranges:
+        _shift_multi_range(sheet._print_area, map_row)
+
+    print_rows = sheet._print_rows
+    if print_rows:
+        print_rows.min_row = map_row(int(print_rows.min_row))
+        print_rows.max_row = map_row(int(print_rows.max_row))
+
+
+def _shift_rule_formulas(formulas, title, start_row, rows_to_insert):
+    """Пересчитывает формулы условного форматирования и проверки данных (без '=')"""
+    return [shift_formula_rows("=" + formula, title, start_row, rows_to_insert)[1:]
+            for formula in formulas]
+
+
+def _shift_conditional_formatting(sheet, map_row, start_row, rows_to_insert):
+    """Сдвигает условное форматирование (ключи словаря правил зависят от диапазонов)"""
+    cf_list = sheet.conditional_formatting
+    if not cf_list:
+        return
+
+    rules_by_range = OrderedDict()
+    for cf, rules in cf_list._cf_rules.items():
+        _shift_multi_range(cf.sqref, map_row)
+        for rule in rules:
+            if rule.formula:
+                rule.formula = _shift_rule_formulas(rule.formula, sheet.title,
+                                                    start_row, rows_to_insert)
+        rules_by_range.setdefault(cf, []).extend(rules)
+    cf_list._cf_rules = rules_by_range
+
+
+def _shift_data_validations(sheet, map_row, start_row, rows_to_insert):
+    """Сдвигает проверки данных"""
+    for validation in sheet.data_validations.dataValidation:
+        _shift_multi_range(validation.sqref, map_row)
+        for attr in ("formula1", "formula2"):
+            formula = getattr(validation, attr)
+            if formula:
+                setattr(validation, attr, _shift_rule_formulas(
+                    [formula], sheet.title, start_row, rows_to_insert)[0])
+
+
+def _formula_text(value):
+    """Текст формулы ячейки (None для табличных формул)"""
+    if isinstance(value, ArrayFormula):
+        return value.text
+    return value if isinstance(value, str) else None
+
+
+def _set_formula_text(cell, text):
+    """Записывает пересчитанный текст формулы в ячейку"""
+    if isinstance(cell._value, ArrayFormula):
+        cell._value.text = text
+    else:
+        cell._value = text
+
+
+def _rewrite_defined_names(sheet, rewrite):
+    """
+    Пересчитывает именованные диапазоны книги и локальные имена листов.
+    rewrite(формула, external) возвращает пересчитанную формулу
+    """
+    workbook = sheet.parent
+    scopes = [(workbook.defined_names, True)]
+    scopes += [(ws.defined_names, ws is not sheet) for ws in workbook.worksheets]
+    for names, external in scopes:
+        for defined_name in names.values():
+            if defined_name.value:
+                defined_name.value = rewrite("=" + defined_name.value, external)[1:]
+
+
+def _rewrite_other_sheets(sheet, rewrite):
+    """
+    Пересчитывает ссылки на лист sheet в формулах остальных листов книги
+
+    Returns:
+        list: названия измененных листов
+    """
+    quoted_title = sheet.title.replace("'", "''")
+    modified = []
+    for other in sheet.parent.worksheets:
+        if other is sheet:
+            continue
+        changed = False
+        for cell in other._cells.values():
+            if cell.data_type != "f":
+                continue
+            text = _formula_text(cell._value)
+            # Формулы без имени листа на него не ссылаются и не разбираются
+            if not text or quoted_title not in text:
+                continue
+            new_text = rewrite(text, True)
+            if new_text != text:
+                _set_formula_text(cell, new_text)
+                changed = True
+        if changed:
+            modified.append(other.title)
+    return modified
+
+
+def shift_row_references(sheet, start_row, rows_to_insert):
+    """
+    Пересчитывает ссылки на лист sheet за его пределами после вставки строк:
+    именованные диапазоны и формулы других листов
+
+    Returns:
+        list: названия других листов, формулы которых изменились
+    """
+    if rows_to_insert <= 0:
+        return []
+
+    def rewrite(formula, external):
+        return shift_formula_rows(formula, sheet.title, start_row, rows_to_insert, external)
+
+    _rewrite_defined_names(sheet, rewrite)
+    return _rewrite_other_sheets(sheet, rewrite)
+
+
+def move_block_references(sheet, bounds, columns, skip_rows=None):
+    """
+    Пересчитывает ссылки после переноса блока ячеек bounds
+    (min_row, min_col, max_row, max_col) на columns столбцов влево.
+    Меняются ссылки, целиком лежащие в блоке, — в формулах листа
+    (кроме строк skip_rows), именованных диапазонах и на других листах
+
+    Returns:
+        list: названия других листов, формулы которых изменились
+    """
+    title = sheet.title
+
+    def rewrite(formula, external):
+        return move_formula_block(formula, title, bounds, columns, external)
+
+    for (row, col), cell in sheet._cells.items():
+        if cell.data_type != "f" or (skip_rows is not None and row in skip_rows):
+            continue
+        text = _formula_text(cell._value)
+        if text:
+            _set_formula_text(cell, rewrite(text, False))
+
+    _rewrite_defined_names(sheet, rewrite)
+    return _rewrite_other_sheets(sheet, rewrite)
+
+
+def shift_rows_down(sheet, start_row, rows_to_insert):
+    """
+    Вставляет rows_to_insert пустых строк перед start_row.
+
+    Ячейки переносятся перестройкой словаря ячеек листа, поэтому время
+    зависит только от числа занятых ячеек. Вместе со строками сдвигаются
+    объединения, высоты строк, область печати, условное форматирование,
+    проверки данных, автофильтр, таблицы и ссылки в формулах листа.
+    Освободившиеся строки сохраняют форматирование строк, стоявших на их месте.
+
+    Returns:
+        int: количество перемещенных ячеек
+    """
+    if rows_to_insert <= 0:
+        return 0
+
+    map_row = _row_mapper(start_row, rows_to_insert)
+
+    moved = _shift_cells(sheet, start_row, rows_to_insert)
+    _shift_merged_cells(sheet, map_row)
+    _shift_row_dimensions(sheet, start_row, rows_to_insert)
+    _shift_print_settings(sheet, map_row)
+    _shift_conditional_formatting(sheet, map_row, start_row, rows_to_insert)
+    _shift_data_validations(sheet, map_row, start_row, rows_to_insert)
+
+    if sheet.auto_filter.ref:
+        sheet.auto_filter.ref = _shift_range_string(sheet.auto_filter.ref, map_row)
+    for table in sheet.tables.values():
+        table.ref = _shift_range_string(table.ref, map_row)
+        if table.autoFilter is not None and table.autoFilter.ref:
+            table.autoFilter.ref = _shift_range_string(table.autoFilter.ref, map_row)
+
+    sheet._current_row = sheet.max_row
+    return moved
+
+
+def shift_source_formula(value, title, rows):
+    """
+    Значение ячейки сметы title, вставляемой на rows строк ниже: ссылки
+    формул следуют за строками сметы, остальные значения не меняются.
+    Табличная формула копируется — значение принадлежит смете
+    """
+    if isinstance(value, str):
+        return offset_formula_rows(value, title, rows) if value.startswith("=") else value
+    if isinstance(value, ArrayFormula):
+        text = offset_formula_rows(value.text, title, rows) if value.text else value.text
+        return ArrayFormula(_shift_range_string(value.ref, lambda row: row + rows), text)
+    return value
@@ -0,0 +1,62 @@
+from openpyxl import load_workbook
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
+from openpyxl.worksheet._reader import WorkSheetParser
+
+
+def open_source_workbook(path):
+    """
+    Открывает книгу проектной сметы только для чтения.
+    Листы не загружаются в память целиком, а читаются потоком при обходе
+    """
+    return load_workbook(path, read_only=True)
+
+
+def _iter_stream_cells(sheet, max_row, max_col):
+    """Читает ячейки листа прямо из XML, не создавая объектов ячеек"""
+    workbook = sheet.parent
+    cell_styles = workbook._cell_styles
+    styles_by_id = {}
+
+    with sheet._get_source() as source:
+        parser = WorkSheetParser(source,
+                                 sheet._shared_strings,
+                                 data_only=workbook.data_only,
+                                 epoch=workbook.epoch,
+                                 date_formats=workbook._date_formats,
+                                 timedelta_formats=workbook._timedelta_formats)
+
+        for row_idx, row in parser.parse():
+            if row_idx > max_row:
+                break
+
+            for cell in row:
+                if cell['column'] > max_col:
+                    continue
+
+                # Таблица стилей разбирается один раз на каждый стиль
+                style_id = cell['style_id']
+                style = styles_by_id.get(style_id, False)
+                if style is False:
+                    style = cell_styles[style_id]
+                    style = styles_by_id[style_id] = style if any(style) else None
+
+                yield cell['row'], cell['column'], cell['value'], style
+
+
+def _iter_loaded_cells(sheet, max_row, max_col):
+    """Перебирает ячейки полностью загруженного листа"""
+    for (row_idx, col_idx), cell in sheet._cells.items():
+        if row_idx <= max_row and col_idx <= max_col:
+            yield row_idx, col_idx, cell.value, cell._style if cell.has_style else None
+
+
+def iter_source_cells(sheet, max_row, max_col):
+    """
+    Генератор ячеек исходной таблицы в пределах max_row × max_col.
+
+    Yields:
+        tuple: (строка, столбец, значение, массив стиля или None)
+    """
+    if isinstance(sheet, ReadOnlyWorksheet):
+        return _iter_stream_cells(sheet, max_row, max_col)
+    return _iter_loaded_cells(sheet, max_row, max_col)
@@ -0,0 +1,102 @@
+from copy import copy
+
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.styles.numbers import (
+    BUILTIN_FORMATS,
+    BUILTIN_FORMATS_MAX_SIZE,
+    BUILTIN_FORMATS_REVERSE,
+)
+
+
+# Поля StyleArray, которые переносятся между ячейками:
+# шрифт, заливка, границы, числовой формат, защита, выравнивание
+STYLE_FIELDS = 6
+NO_EXTRA = (0, 0, 0)
+
+STYLE_COLLECTIONS = (
+    (0, "_fonts"),
+    (1, "_fills"),
+    (2, "_borders"),
+    (4, "_protections"),
+    (5, "_alignments"),
+)
+
+
+class StyleTransfer:
+    """
+    Переносит форматирование ячеек между книгами по идентификаторам стилей.
+
+    Каждый уникальный набор идентификаторов исходной книги один раз
+    сопоставляется с таблицами стилей целевой книги, дальше ячейкам
+    присваивается уже готовый массив идентификаторов без создания копий
+    шрифтов, границ и заливок.
+    """
+
+    def __init__(self, source_wb, target_wb):
+        self.source_wb = source_wb
+        self.target_wb = target_wb
+        self.same_workbook = source_wb is target_wb
+        self._cache = {}
+        self.copied = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _map_number_format(self, fmt_id):
+        """Сопоставляет идентификатор числового формата"""
+        if self.same_workbook:
+            return fmt_id
+
+        if fmt_id < BUILTIN_FORMATS_MAX_SIZE:
+            fmt = BUILTIN_FORMATS.get(fmt_id, "General")
+        else:
+            fmt = self.source_wb._number_formats[fmt_id - BUILTIN_FORMATS_MAX_SIZE]
+
+        if fmt in BUILTIN_FORMATS_REVERSE:
+            return BUILTIN_FORMATS_REVERSE[fmt]
+        return self.target_wb._number_formats.add(fmt) + BUILTIN_FORMATS_MAX_SIZE
+
+    def _map_style(self, source_style, extra):
+        """Строит массив стилей целевой книги для исходного массива"""
+        style = list(source_style[:STYLE_FIELDS]) + list(extra)
+
+        if not self.same_workbook:
+            for field, collection in STYLE_COLLECTIONS:
+                source_coll = getattr(self.source_wb, collection)
+                target_coll = getattr(self.target_wb, collection)
+                item = source_coll[source_style[field]]
+                if item in target_coll:
+                    style[field] = target_coll.index(item)
+                else:
+                    style[field] = target_coll.add(copy(item))
+
+        style[3] = self._map_number_format(source_style[3])
+        return StyleArray(style)
+
+    def copy_style(self, source_cell, target_cell):
+        """
+        Копирует форматирование source_cell в target_cell.
+        Остальные поля стиля целевой ячейки (именованный стиль и флаги) сохраняются
+        """
+        self.copy_style_array(source_cell._style, target_cell)
+
+    def map_style_array(self, source_style, target_style=None):
+        """
+        Возвращает массив стилей целевой книги для source_style с полями
+        именованного стиля и флагами из target_style (массив общий, не изменять)
+        """
+        extra = tuple(target_style[STYLE_FIELDS:]) if target_style is not None else NO_EXTRA
+
+        key = (tuple(source_style), extra)
+        style = self._cache.get(key)
+        if style is None:
+            style = self._cache[key] = self._map_style(source_style, extra)
+        self.copied += 1
+        return style
+
+    def copy_style_array(self, source_style, target_cell):
+        """Назначает target_cell стиль по массиву идентификаторов исходной книги"""
+        style = self.map_style_array(source_style, target_cell._style)
+
+        # Массив копируется: openpyxl изменяет стиль ячейки на месте
+        target_cell._style = StyleArray(style)
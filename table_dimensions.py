@@ -0,0 +1,175 @@
+import re
+
+from openpyxl.utils import column_index_from_string
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
+
+from sheet_layout import SheetLayout
+
+
+# Ячейка с содержимым: открывающий тег <c ...> (не пустой <c .../>),
+# за которым сразу следует значение, формула или встроенная строка
+FILLED_CELL_RE = re.compile(
+    rb"<(?:\w+:)?c\s([^>]*?)(?<!/)>\s*<(?:\w+:)?(?:v>(?!</)|f[\s/>]|is[\s/>])")
+CELL_REF_RE = re.compile(rb'\br="([A-Z]{1,3})([0-9]+)"')
+SCAN_CHUNK_SIZE = 1024 * 1024
+
+
+def _has_value(cells, row, col):
+    """Проверяет, что в ячейке листа есть значение"""
+    cell = cells.get((row, col))
+    return cell is not None and cell._value is not None
+
+
+def find_table_bounds(sheet, layout=None, columns=None):
+    """
+    Определяет последнюю непустую строку и последний непустой столбец листа.
+
+    Просмотр идет от границ листа (sheet.max_row, sheet.max_column) назад
+    и останавливается на первой строке / первом столбце со значением,
+    поэтому хвост из пустых отформатированных ячеек проверяется один раз,
+    а сами данные не перебираются. Лист в режиме только для чтения
+    просматривается потоком по XML; если передан layout (SheetLayout),
+    в том же проходе собирается разметка листа, если columns
+    (ks2_summary.ColumnScanner) — ячейки столбцов итогов.
+
+    Returns:
+        tuple: (max_row, max_col), (0, 0) для пустого листа
+    """
+    if isinstance(sheet, ReadOnlyWorksheet):
+        return _find_read_only_bounds(sheet, layout, columns)
+
+    if layout is not None:
+        loaded = SheetLayout.from_worksheet(sheet)
+        layout.merged, layout.rows, layout.columns = loaded.merged, loaded.rows, loaded.columns
+
+    cells = sheet._cells
+    if not cells:
+        return 0, 0
+
+    declared_rows = sheet.max_row
+    declared_cols = sheet.max_column
+
+    max_row = 0
+    for row in range(declared_rows, 0, -1):
+        if any(_has_value(cells, row, col) for col in range(1, declared_cols + 1)):
+            max_row = row
+            break
+
+    max_col = 0
+    for col in range(declared_cols, 0, -1):
+        if any(_has_value(cells, row, col) for row in range(1, max_row + 1)):
+            max_col = col
+            break
+
+    return max_row, max_col
+
+
+def scan_sheet_xml_bounds(source, layout=None, columns=None):
+    """
+    Определяет границы таблицы прямым просмотром XML листа без его разбора.
+
+    Читается распакованный поток байтов, регулярным выражением находятся
+    ячейки со значением. Тег <dimension> для этого не подходит: он учитывает
+    и пустые отформатированные ячейки, а сдвиг областей шапки зависит
+    от последнего столбца именно со значениями. Если передан layout
+    (SheetLayout), в него собирается разметка листа; columns
+    (ks2_summary.ColumnScanner) получает те же фрагменты XML и после
+    полного просмотра отмечается завершенным.
+
+    Returns:
+        tuple: (max_row, max_col) или None, если у ячеек нет адресов
+    """
+    max_row = 0
+    max_col = 0
+    col_indexes = {}
+    tail = b""
+
+    while True:
+        chunk = source.read(SCAN_CHUNK_SIZE)
+        data = tail + chunk
+        if chunk:
+            # Фрагмент режется по границе строки, незавершенная строка
+            # переносится в следующий фрагмент
+            cut = data.rfind(b"row>") + len(b"row>")
+            if cut < len(b"row>"):
+                tail = data
+                continue
+            data, tail = data[:cut], data[cut:]
+
+        if layout is not None:
+            layout.scan(data)
+        if columns is not None:
+            columns.scan(data)
+
+        # Адреса ищутся сразу во всех атрибутах фрагмента: если адресов
+        # меньше, чем ячеек, у части ячеек их нет
+        cells = FILLED_CELL_RE.findall(data)
+        if cells:
+            refs = CELL_REF_RE.findall(b"\n".join(cells))
+            if len(refs) != len(cells):
+                return None
+            max_row = max(max_row, max(int(row) for letters, row in refs))
+            for letters in {letters for letters, row in refs}:
+                col = col_indexes.get(letters)
+                if col is None:
+                    col = col_indexes[letters] = column_index_from_string(letters.decode())
+                max_col = max(max_col, col)
+
+        if not chunk:
+            if columns is not None:
+                columns.finish()
+            return max_row, max_col
+
+
+def _find_read_only_bounds(sheet, layout=None, columns=None):
+    """Границы таблицы листа, открытого в режиме только для чтения"""
+    with sheet._get_source() as source:
+        bounds = scan_sheet_xml_bounds(source, layout, columns)
+    if bounds is not None:
+        return bounds
+
+    # Ячейки без адресов: считаем границы по разобранным значениям
+    max_row = 0
+    max_col = 0
+    for row in sheet.iter_rows():
+        for cell in row:
+            if cell.value is not None:
+                max_row = max(max_row, cell.row)
+                max_col = max(max_col, cell.column)
+    return max_row, max_col
+
+
+class DimensionIndex:
+    """
+    Хранит размеры таблиц листов и их разметку, чтобы каждый лист
+    сканировался один раз
+    """
+
+    def __init__(self):
+        self._bounds = {}
+        self._layouts = {}
+
+    def get(self, sheet, columns=None):
+        """
+        Возвращает (max_row, max_col) листа, вычисляя их при первом обращении.
+        columns: сканер столбцов итогов для того же прохода (см. find_table_bounds)
+        """
+        bounds = self._bounds.get(sheet)
+        if bounds is None:
+            layout = self._layouts[sheet] = SheetLayout()
+            bounds = self._bounds[sheet] = find_table_bounds(sheet, layout, columns)
+        return bounds
+
+    def layout(self, sheet):
+        """Разметка таблицы листа в ее границах (SheetLayout)"""
+        rows, cols = self.get(sheet)
+        return self._layouts[sheet].table(rows, cols)
+
+    def invalidate(self, sheet=None):
+        """Сбрасывает сохраненные размеры листа (или всех листов)"""
+        if sheet is None:
+            self._bounds.clear()
+            self._layouts.clear()
+        else:
+            self._bounds.pop(sheet, None)
+            self._layouts.pop(sheet, None)
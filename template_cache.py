@@ -0,0 +1,138 @@
+import copyreg
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+import openpyxl
+from openpyxl import load_workbook
+from openpyxl.worksheet.table import TableList
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# Формат снимков: меняется, если снимки прежних версий нельзя использовать
+SNAPSHOT_FORMAT = 2
+
+
+def _reduce_table_list(tables):
+    """
+    TableList.items() возвращает адреса вместо таблиц, и pickle по умолчанию
+    восстанавливал бы вместо таблиц строки — сериализуем словарь целиком
+    """
+    return TableList, (dict(dict.items(tables)),)
+
+
+copyreg.pickle(TableList, _reduce_table_list)
+
+
+def file_digest(path):
+    """Потоково считает SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TemplateCache:
+    """
+    Кэш разобранных шаблонов КС-2.
+
+    Шаблон хранится как сериализованный снимок только что загруженной книги.
+    Каждое задание получает собственную копию, восстановленную из снимка,
+    без повторного разбора XML и таблиц стилей; сам снимок не изменяется.
+    Ключ — путь, время изменения и размер файла (быстрая проверка) и хэш
+    содержимого. Снимки вытесняются по LRU при превышении числа или объема,
+    при указании disk_dir они дополнительно сохраняются на диск.
+    """
+
+    def __init__(self, max_entries=8, max_bytes=256 * 1024 * 1024, disk_dir=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._digests = {}
+        self._snapshots = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+        if disk_dir and not os.path.exists(disk_dir):
+            os.makedirs(disk_dir)
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def _get_digest(self, path):
+        """Хэш содержимого; пересчитывается только при изменении mtime/размера"""
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._digests.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        digest = file_digest(path)
+        self._digests[path] = (signature, digest)
+        return digest
+
+    def _disk_path(self, digest):
+        # Версия openpyxl входит в имя: снимки разных версий несовместимы
+        return os.path.join(self.disk_dir,
+                            f"{digest}-openpyxl-{openpyxl.__version__}-v{SNAPSHOT_FORMAT}.pickle")
+
+    def _read_disk(self, digest):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(digest)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _write_disk(self, digest, snapshot):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(digest)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(snapshot)
+        os.replace(tmp_path, path)
+
+    def _store(self, digest, snapshot):
+        """Кладет снимок в память с вытеснением самых старых"""
+        self._snapshots[digest] = snapshot
+        self._size += len(snapshot)
+
+        while self._snapshots and (len(self._snapshots) > self.max_entries
+                                   or self._size > self.max_bytes):
+            _, evicted = self._snapshots.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _get_snapshot(self, path):
+        digest = self._get_digest(path)
+
+        snapshot = self._snapshots.get(digest)
+        if snapshot is not None:
+            self._snapshots.move_to_end(digest)
+            self.hits += 1
+            return snapshot
+
+        self.misses += 1
+        snapshot = self._read_disk(digest)
+        if snapshot is None:
+            workbook = load_workbook(path)
+            snapshot = pickle.dumps(workbook, protocol=pickle.HIGHEST_PROTOCOL)
+            self._write_disk(digest, snapshot)
+
+        self._store(digest, snapshot)
+        return snapshot
+
+    def load(self, path):
+        """Возвращает независимую копию книги шаблона"""
+        snapshot = self._get_snapshot(os.path.abspath(path))
+        return pickle.loads(snapshot)
+
+    def clear(self):
+        """Очищает кэш в памяти (файлы на диске остаются)"""
+        self._digests.clear()
+        self._snapshots.clear()
+        self._size = 0
@@ -0,0 +1,203 @@
+"""
+Небольшие книги для тестов и сравнение результатов.
+
+openpyxl записывает строки встроенными (t="inlineStr"), а формулы —
+обычными, поэтому общие строки и общие формулы, как их пишет Excel,
+получаются правкой XML готовой книги (to_shared_strings, share_formulas).
+"""
+import re
+from zipfile import ZipFile, ZIP_DEFLATED
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell.rich_text import CellRichText, TextBlock
+from openpyxl.cell.text import InlineFont
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.workbook.defined_name import DefinedName
+
+
+TEMPLATE_TITLE = "КС-2 тест"
+FOOTER_ROWS = 10
+
+INLINE_CELL_RE = re.compile(r'<c r="([A-Z]+\d+)"((?: s="\d+")?) t="inlineStr"><is>(.*?)</is></c>', re.S)
+FORMULA_CELL_RE = re.compile(r'<c r="([A-Z]+)(\d+)"((?: s="\d+")?)><f>(.*?)</f>(<v ?/>|<v>.*?</v>)</c>', re.S)
+
+SHARED_STRINGS_REL = ('<Relationship Id="rIdStrings" Target="sharedStrings.xml" Type="http://schemas.'
+                      'openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/>')
+SHARED_STRINGS_TYPE = ('<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.'
+                       'openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>')
+
+
+def rich_text(plain, bold):
+    """Форматированный текст из обычной и полужирной частей"""
+    return CellRichText(plain, TextBlock(InlineFont(b=True), bold))
+
+
+def make_template(path):
+    """
+    Шаблон КС-2: шапка G1:H18 и E12:F18 с формулами, заголовок в строке 19,
+    подвал с 20-й строки (объединения, высоты строк, формулы, форматированный
+    текст), лист «Справка» со ссылками на КС-2, имя книги и область печати
+    """
+    wb = Workbook()
+    ws = wb.active
+    ws.title = TEMPLATE_TITLE
+    thin = Side(style="thin")
+
+    for row in range(1, 19):
+        ws.cell(row, 7, f"Реквизит {row}").font = Font(bold=True)
+        ws.cell(row, 8, row * 10)
+    for row in range(12, 19):
+        for col in (5, 6):
+            ws.cell(row, col, f"Поле {row}.{col}").border = Border(bottom=thin)
+    # Ссылки внутри переносимой шапки и на нее снаружи
+    ws["H3"] = "=H2*2"
+    ws["F15"] = "=E15&H15"
+    ws["A5"] = "=H5+1"
+    ws["A19"] = "АКТ О ПРИЕМКЕ ВЫПОЛНЕННЫХ РАБОТ"
+    ws.merge_cells("A19:D19")
+
+    last = 19 + FOOTER_ROWS
+    for row in range(20, last + 1):
+        ws.cell(row, 1, f"Подвал {row}").fill = PatternFill("solid", start_color="FFF2CC")
+        ws.cell(row, 10, row)
+        # Станут общими формулами (share_formulas)
+        ws.cell(row, 11, f"=J{row}*2")
+    ws.cell(last + 1, 10, f"=SUM(J20:J{last})")
+    ws.cell(last + 1, 1, "Итого по акту:")
+    ws.cell(22, 2, rich_text("Сдал: ", "прораб")).alignment = Alignment(wrap_text=True)
+    ws.merge_cells(start_row=25, start_column=1, end_row=25, end_column=4)
+    ws.row_dimensions[23].height = 30
+    ws.column_dimensions["B"].width = 40
+    ws.print_area = f"A1:K{last + 1}"
+
+    other = wb.create_sheet("Справка")
+    other["A1"] = f"='{TEMPLATE_TITLE}'!J{last + 1}"
+    other["A2"] = f"=SUM('{TEMPLATE_TITLE}'!J20:J{last})"
+    other["A3"] = f"='{TEMPLATE_TITLE}'!H5"
+    other["A4"] = f"='{TEMPLATE_TITLE}'!A19"
+    wb.defined_names["Итого"] = DefinedName("Итого", attr_text=f"'{TEMPLATE_TITLE}'!$J${last + 1}")
+    wb.save(path)
+    return path
+
+
+def make_estimate(path, rows, cols=7):
+    """
+    Смета rows × cols: номера, шифры, наименования (каждое седьмое — с
+    форматированием), количество, цена, стоимость формулой (станет общей
+    формулой в столбце G), объединенные заголовки разделов, стили и размеры
+    """
+    styles = [(Font(name="Arial", size=9), PatternFill()),
+              (Font(name="Arial", size=9, bold=True), PatternFill("solid", start_color="DDEBF7")),
+              (Font(name="Times New Roman", size=10, italic=True), PatternFill())]
+    thin = Side(style="thin")
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Смета"
+
+    for row in range(1, rows + 1):
+        font, fill = styles[row % len(styles)]
+        if row % 10 == 1:
+            ws.cell(row, 2, f"Раздел {row // 10 + 1}").font = Font(bold=True)
+            ws.merge_cells(start_row=row, start_column=2, end_row=row, end_column=4)
+            continue
+        name = rich_text(f"Работа {row} ", "(доп.)") if row % 7 == 0 else f"Работа {row % 13}"
+        values = [row, f"ФЕР01-{row:03d}", name, "м2" if row % 2 else "шт",
+                  row % 17 + 0.5, round(row * 1.25, 2), f"=E{row}*F{row}"]
+        values += [f"Прим. {row}.{col}" for col in range(len(values) + 1, cols + 1)]
+        for col, value in enumerate(values[:cols], start=1):
+            cell = ws.cell(row, col, value)
+            cell.font, cell.fill = font, fill
+            cell.border = Border(left=thin, right=thin)
+            if col in (5, 6, 7):
+                cell.number_format = "#,##0.00"
+        if row % 9 == 0:
+            ws.row_dimensions[row].height = 24
+    ws.column_dimensions["C"].width = 50
+    wb.save(path)
+    return path
+
+
+def rewrite_parts(path, rewrite, added=None):
+    """Переписывает части архива функцией rewrite(имя, текст) и дописывает added"""
+    with ZipFile(path) as archive:
+        parts = [(info, archive.read(info.filename)) for info in archive.infolist()]
+    with ZipFile(path, "w", ZIP_DEFLATED) as archive:
+        for info, data in parts:
+            if info.filename.endswith((".xml", ".rels")):
+                data = rewrite(info.filename, data.decode("utf-8")).encode("utf-8")
+            archive.writestr(info, data)
+        for name, text in (added or {}).items():
+            archive.writestr(name, text.encode("utf-8"))
+    return path
+
+
+def to_shared_strings(path):
+    """Заменяет встроенные строки всех листов общими, как в книгах Excel"""
+    strings = {}
+
+    def cell(match):
+        index = strings.setdefault(match.group(3), len(strings))
+        return f'<c r="{match.group(1)}"{match.group(2)} t="s"><v>{index}</v></c>'
+
+    def rewrite(name, text):
+        if name.startswith("xl/worksheets/"):
+            return INLINE_CELL_RE.sub(cell, text)
+        if name == "xl/_rels/workbook.xml.rels":
+            return text.replace("</Relationships>", SHARED_STRINGS_REL + "</Relationships>")
+        if name == "[Content_Types].xml":
+            return text.replace("</Types>", SHARED_STRINGS_TYPE + "</Types>")
+        return text
+
+    rewrite_parts(path, rewrite)
+    items = "".join(f"<si>{xml}</si>" for xml in strings)
+    return rewrite_parts(path, lambda name, text: text, {"xl/sharedStrings.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        f'count="{len(strings)}" uniqueCount="{len(strings)}">{items}</sst>')})
+
+
+def share_formulas(path, sheet_part, column):
+    """Формулы столбца column листа sheet_part становятся одной общей формулой, как их пишет Excel"""
+    def rewrite(name, text):
+        if name != sheet_part:
+            return text
+        cells = [match for match in FORMULA_CELL_RE.finditer(text) if match.group(1) == column]
+        if not cells:
+            return text
+        first, last = cells[0], cells[-1]
+        ref = f"{column}{first.group(2)}:{column}{last.group(2)}"
+        replaced = {}
+        for match in cells:
+            formula = (f'<f t="shared" ref="{ref}" si="0">{match.group(4)}</f>' if match is first
+                       else '<f t="shared" si="0"/>')
+            replaced[match.group(0)] = (f'<c r="{column}{match.group(2)}"{match.group(3)}>'
+                                        f'{formula}{match.group(5)}</c>')
+        return FORMULA_CELL_RE.sub(lambda match: replaced.get(match.group(0), match.group(0)), text)
+
+    return rewrite_parts(path, rewrite)
+
+
+def snapshot(path):
+    """
+    Содержимое книги так, как его видит openpyxl: значения и формулы, стили,
+    объединения, высоты строк, ширины столбцов, области печати и имена.
+    Форматированный текст сравнивается как обычный: обычная обработка
+    (KS2Processor) читает книги без форматирования частей текста
+    """
+    wb = load_workbook(path)
+    result = {"sheets": wb.sheetnames,
+              "names": sorted((name, item.attr_text) for name, item in wb.defined_names.items())}
+    for ws in wb.worksheets:
+        cells = {}
+        for (row, col), cell in ws._cells.items():
+            style = (repr(cell.font), repr(cell.fill), repr(cell.border), cell.number_format,
+                     repr(cell.alignment)) if cell.has_style else None
+            if cell.value is not None or style is not None:
+                cells[row, col] = (cell.value, style)
+        result[ws.title] = {
+            "cells": cells,
+            "merged": sorted(str(bounds) for bounds in ws.merged_cells.ranges),
+            "rows": {idx: dim.height for idx, dim in ws.row_dimensions.items() if dim.height is not None},
+            "columns": {key: dim.width for key, dim in ws.column_dimensions.items() if dim.customWidth},
+            "print_area": ws.print_area,
+        }
+    return result
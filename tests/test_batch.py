@@ -0,0 +1,98 @@
+"""Пакетная обработка: журнал возобновления и манифест сборки решают, какие задания выполнять"""
+import json
+import pytest
+from openpyxl import load_workbook
+from helpers import make_template, make_estimate
+from build_cache import BuildCache
+from ks2_batch import BatchState, build_options, job_inputs, load_manifest, run_batch
+
+
+@pytest.fixture
+def batch(tmp_path):
+    template = make_template(str(tmp_path / "template.xlsx"))
+    source = make_estimate(str(tmp_path / "estimate.xlsx"), 12)
+    job = {"template": template, "source": source, "output": str(tmp_path / "out" / "act.xlsx")}
+    paths = {"state_path": str(tmp_path / "state.jsonl"), "build_cache_path": str(tmp_path / "build.json")}
+    return job, paths
+
+
+def edit_estimate(path):
+    wb = load_workbook(path)
+    wb.active["A2"] = "изменено"
+    wb.save(path)
+
+
+def run(job, **kwargs):
+    return run_batch([job], workers=1, use_template_cache=False, **kwargs)
+
+
+@pytest.mark.parametrize("build_cache", [True, False], ids=["state+build-cache", "state-only"])
+def test_changed_input_is_rebuilt(batch, build_cache):
+    """Задание из журнала выполняется снова, если смета изменилась (и с манифестом, и без него)"""
+    job, paths = batch
+    if not build_cache:
+        paths["build_cache_path"] = None
+    assert run(job, **paths)["succeeded"] == 1
+
+    report = run(job, **paths)
+    assert (report["processed"], report["skipped"]) == (0, 1)
+
+    edit_estimate(job["source"])
+    report = run(job, **paths)
+    assert (report["processed"], report["succeeded"]) == (1, 1)
+    assert load_workbook(job["output"]).active["A21"].value == "изменено"
+
+
+def test_changed_options_are_rebuilt(batch):
+    job, paths = batch
+    run(job, **paths)
+    report = run(job, save_options={"compresslevel": 1}, **paths)
+    assert report["processed"] == 1
+    # Бюджет памяти не влияет на результат
+    report = run(job, save_options={"compresslevel": 1, "memory_budget": 64}, **paths)
+    assert report["processed"] == 0
+
+
+def test_force_rebuilds_everything(batch):
+    job, paths = batch
+    run(job, **paths)
+    report = run(job, force=True, **paths)
+    assert (report["processed"], report["skipped"]) == (1, 0)
+
+
+def test_build_cache_rebuilds_edited_output(batch, tmp_path):
+    """Результат, измененный после сборки, собирается заново, даже если журнала нет"""
+    job, paths = batch
+    paths["state_path"] = None
+    run(job, **paths)
+    assert run(job, **paths)["up_to_date"] == 1
+
+    with open(job["output"], "ab") as f:
+        f.write(b"\0")
+    assert run(job, **paths)["processed"] == 1
+
+
+def test_state_without_input_hashes_is_not_trusted(batch):
+    """Записи журнала прежнего формата (без хэшей входов) не пропускают задание"""
+    job, paths = batch
+    run(job, **paths)
+    with open(paths["state_path"], "w", encoding="utf-8") as f:
+        f.write(json.dumps(dict(job, status="ok")) + "\n")
+    assert BatchState(paths["state_path"]).is_done(job, build_options("openpyxl", None)) is False
+
+
+def test_state_shares_build_cache_digests(batch):
+    job, paths = batch
+    run(job, **paths)
+    cache = BuildCache(paths["build_cache_path"])
+    state = BatchState(paths["state_path"], cache)
+    assert state.is_done(job, build_options("openpyxl", None))
+    assert cache.is_fresh(job["output"], job_inputs(job), build_options("openpyxl", None))
+
+
+def test_load_manifest_csv(tmp_path):
+    """Относительные пути манифеста считаются от его папки"""
+    path = tmp_path / "jobs.csv"
+    path.write_text("template,source,output\nt.xlsx,s.xlsx,o.xlsx\n", encoding="utf-8")
+    assert load_manifest(str(path)) == [{role: str(tmp_path / name) for role, name in
+                                         (("template", "t.xlsx"), ("source", "s.xlsx"), ("output", "o.xlsx"))}]
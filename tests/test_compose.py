@@ -0,0 +1,53 @@
+"""Сборка акта из нескольких смет (KS2CompositeProcessor, ks2_compose)"""
+import pytest
+from openpyxl import load_workbook
+from helpers import TEMPLATE_TITLE, FOOTER_ROWS, make_template, make_estimate
+import ks2_compose
+from ks2_compose import KS2CompositeProcessor
+
+
+@pytest.fixture(scope="module")
+def inputs(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("compose")
+    return (make_template(str(folder / "template.xlsx")),
+            make_estimate(str(folder / "first.xlsx"), 15),
+            make_estimate(str(folder / "second.xlsx"), 25))
+
+
+def test_blocks_follow_each_other(inputs, tmp_path):
+    """Вторая смета вставляется под первой, ее формулы сдвигаются на свое смещение"""
+    template, first, second = inputs
+    output = str(tmp_path / "act.xlsx")
+    KS2CompositeProcessor(template, [first, second], output, listeners=[]).process()
+
+    ks2 = load_workbook(output)[TEMPLATE_TITLE]
+    assert ks2["A21"].value == 2 and ks2["G21"].value == "=E21*F21"
+    # Строка 2 второй сметы — после 15 строк первой
+    assert ks2["A36"].value == 2 and ks2["G36"].value == "=E36*F36"
+    assert ks2[f"A{20 + 40}"].value == "Подвал 20"
+    assert ks2[f"J{20 + 40 + FOOTER_ROWS}"].value == f"=SUM(J60:J{59 + FOOTER_ROWS})"
+
+
+@pytest.mark.parametrize("option", [{"memory_budget": 64}, {"summary": {"columns": {"cost": "G"}}}])
+def test_unsupported_options_rejected(inputs, tmp_path, option):
+    template, first, second = inputs
+    with pytest.raises(ValueError, match=next(iter(option))):
+        KS2CompositeProcessor(template, [first, second], str(tmp_path / "act.xlsx"), listeners=[],
+                              **option)
+
+
+def test_main_reports_input_errors(inputs, tmp_path, capsys):
+    template, first, second = inputs
+    argv = [first, second, "--template", template, "--output", str(tmp_path / "act.xlsx"),
+            "--targets", "КС-2 (1)", "КС-2 (2)", "КС-2 (3)"]
+    assert ks2_compose.main(argv) == 1
+    assert "❌ Листов шаблона 3, а смет 2" in capsys.readouterr().out
+
+
+def test_main_reports_processing_errors_once(inputs, tmp_path, capsys):
+    template, first, _ = inputs
+    argv = [first, "--template", template, "--output", str(tmp_path / "act.xlsx"),
+            "--targets", "Нет такого листа"]
+    assert ks2_compose.main(argv) == 1
+    out = capsys.readouterr().out
+    assert out.count("Не найден лист шаблона 'Нет такого листа'") == 1
@@ -0,0 +1,75 @@
+"""Формулы сметы ссылаются на ее строки и после вставки в акт"""
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.worksheet.formula import ArrayFormula
+import parallel_copy
+from helpers import TEMPLATE_TITLE, make_template, share_formulas, to_shared_strings
+from ks2_processor import KS2Processor
+from ks2_splice import KS2SpliceProcessor
+
+
+ROWS = 30
+# Смета вставляется с 20-й строки
+OFFSET = 19
+SHEET = "xl/worksheets/sheet1.xml"
+
+
+def make_formula_estimate(path, shared):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Смета"
+    for row in range(1, ROWS + 1):
+        ws.cell(row, 1, row)
+        ws.cell(row, 5, row % 7 + 1)
+        ws.cell(row, 6, row * 1.5)
+        ws.cell(row, 7, f"=E{row}*F{row}")
+    ws["H1"] = "=$G$2+G1"
+    ws["H2"] = ArrayFormula("H2:H3", f"=G2:G3*2")
+    ws["H5"] = f"=SUM(G2:G{ROWS})"
+    ws["H6"] = "=SUM(2:3)"
+    ws["H7"] = '="E7"&Справка!A7'
+    wb.save(path)
+    if shared:
+        share_formulas(path, SHEET, "G")
+        to_shared_strings(path)
+    return path
+
+
+@pytest.fixture(scope="module")
+def inputs(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("formulas")
+    template = make_template(str(folder / "template.xlsx"))
+    return template, {shared: make_formula_estimate(str(folder / f"estimate-{shared}.xlsx"), shared)
+                      for shared in (False, True)}
+
+
+ENGINES = {
+    "openpyxl": (KS2Processor, {}),
+    "memory-budget": (KS2Processor, {"memory_budget": 1}),
+    "copy-workers": (KS2Processor, {"copy_workers": 2}),
+    "splice": (KS2SpliceProcessor, {}),
+}
+
+
+@pytest.mark.parametrize("shared", [False, True], ids=["plain", "shared-formulas"])
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_estimate_formulas_follow_rows(inputs, tmp_path, monkeypatch, engine, shared):
+    monkeypatch.setattr(parallel_copy, "PARALLEL_MIN_ROWS", 1)
+    processor_class, options = ENGINES[engine]
+    template, source = inputs[0], inputs[1][shared]
+    output = str(tmp_path / "act.xlsx")
+    processor_class(template, source, output, listeners=[], **options).process()
+
+    ks2 = load_workbook(output)[TEMPLATE_TITLE]
+    for row in range(1, ROWS + 1):
+        assert ks2[f"G{row + OFFSET}"].value == f"=E{row + OFFSET}*F{row + OFFSET}"
+    # Абсолютные ссылки и диапазоны тоже указывают на строки сметы
+    assert ks2["H20"].value == "=$G$21+G20"
+    assert ks2["H24"].value == f"=SUM(G21:G{ROWS + OFFSET})"
+    assert ks2["H25"].value == "=SUM(21:22)"
+    # Строки в кавычках и ссылки на другие листы не меняются
+    assert ks2["H26"].value == '="E7"&Справка!A7'
+
+    array = ks2["H21"].value
+    assert isinstance(array, ArrayFormula)
+    assert (array.ref, array.text) == ("H21:H22", "=G21:G22*2")
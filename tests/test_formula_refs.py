@@ -0,0 +1,85 @@
+"""Пересчет ссылок формул при вставке строк и переносе областей шапки"""
+import pytest
+from formula_refs import (map_reference, move_formula_block, offset_formula_rows, shift_formula_rows,
+                          unquote_sheet_name)
+
+
+TITLE = "КС-2 тест"
+# Шапка G1:H18 переносится на 3 столбца влево
+HEADER = (1, 7, 18, 8)
+
+
+@pytest.mark.parametrize("formula, expected", [
+    ("=A19+A20", "=A19+A40"),
+    ("=SUM($J$20:J25)", "=SUM($J$40:J45)"),
+    ("=SUM(20:25)", "=SUM(40:45)"),
+    ("=SUM(A:A)", "=SUM(A:A)"),
+    ("=Справка!A25", "=Справка!A25"),
+    (f"='{TITLE}'!B30*2", f"='{TITLE}'!B50*2"),
+    ("=Итого*2", "=Итого*2"),
+    ('="A20"&B20', '="A20"&B40'),
+    ("текст", "текст"),
+])
+def test_shift_formula_rows(formula, expected):
+    assert shift_formula_rows(formula, TITLE, 20, 20) == expected
+
+
+def test_shift_formula_rows_external():
+    """В формулах других листов и имен сдвигаются только ссылки с именем листа КС-2"""
+    formula = f"=A25+'{TITLE}'!A25+Справка!A25"
+    assert shift_formula_rows(formula, TITLE, 20, 5, external=True) == f"=A25+'{TITLE}'!A30+Справка!A25"
+
+
+def test_quoted_sheet_name():
+    assert unquote_sheet_name("'Акт ''май'''") == "Акт 'май'"
+    title = "Акт 'май'"
+    assert shift_formula_rows("='Акт ''май'''!C21", title, 20, 1, external=True) == "='Акт ''май'''!C22"
+
+
+def test_map_reference():
+    def map_row(row):
+        return row + 100
+
+    def map_col(col):
+        return col
+
+    assert map_reference("$B$2:C3", TITLE, map_row, map_col) == "$B$102:C103"
+    assert map_reference("Справка!B2", TITLE, map_row, map_col) == "Справка!B2"
+    assert map_reference("B2", TITLE, map_row, map_col, external=True) == "B2"
+    # Не адрес (имя) и ссылки из трех частей не меняются
+    assert map_reference("Итого", TITLE, map_row, map_col) == "Итого"
+    assert map_reference("A1:B2:C3", TITLE, map_row, map_col) == "A1:B2:C3"
+
+
+@pytest.mark.parametrize("formula, expected", [
+    # Ссылки внутри переносимой области следуют за ячейками
+    ("=H2*2", "=E2*2"),
+    ("=SUM(G1:H18)", "=SUM(D1:E18)"),
+    ("=$H$5", "=$E$5"),
+    # Ссылки, частично или целиком лежащие вне области, не меняются
+    ("=A5+H19", "=A5+H19"),
+    ("=SUM(F1:H1)", "=SUM(F1:H1)"),
+    ("=Справка!H5", "=Справка!H5"),
+])
+def test_move_formula_block(formula, expected):
+    assert move_formula_block(formula, TITLE, HEADER, 3) == expected
+
+
+def test_move_formula_block_external():
+    formula = f"='{TITLE}'!H5+H5"
+    assert move_formula_block(formula, TITLE, HEADER, 3, external=True) == f"='{TITLE}'!E5+H5"
+
+
+def test_move_formula_block_past_first_column():
+    """Ячейки, ушедшие левее столбца A, не переносятся, и ссылки на них не меняются"""
+    assert move_formula_block("=G1+H1", TITLE, HEADER, 7) == "=G1+A1"
+
+
+@pytest.mark.parametrize("formula", [
+    "=E7*F7", "=$E$7*-F7", "=SUM(E2:E9)/2", "=LOG10(A1)+ATAN2(B2,C3)+DAYS360(A1,B1)", "=1E5*A1+2.5",
+    "=SUM(20:25)", "=SUM($20:$25)", "=A1:A3 B2", "=IF(A1<>0,B1,C1)", "=A5%", "=SUM(A:A)+A2",
+    "=e7*f7", '="A1"&B2', "=Справка!A5+A5", f"='{TITLE}'!A5+A5", "=Итого*A3",
+])
+def test_offset_formula_rows(formula):
+    """Простые формулы сдвигаются без токенизатора так же, как через него"""
+    assert offset_formula_rows(formula, TITLE, 19) == shift_formula_rows(formula, TITLE, 1, 19)
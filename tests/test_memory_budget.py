@@ -0,0 +1,53 @@
+"""Режим с бюджетом памяти (DeferredTable) дает тот же файл, что вставка в памяти"""
+import pytest
+from helpers import make_template, make_estimate, share_formulas, to_shared_strings
+from ks2_benchmark import compare_outputs
+from ks2_events import INSERT_PROGRESS
+from ks2_processor import KS2Processor
+from memory_budget import chunk_rows
+
+
+ROWS = 300
+SHEET = "xl/worksheets/sheet1.xml"
+
+
+@pytest.fixture(scope="module")
+def inputs(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("budget")
+    template = make_template(str(folder / "template.xlsx"))
+    shared = make_estimate(str(folder / "shared.xlsx"), ROWS, 7)
+    share_formulas(shared, SHEET, "G")
+    to_shared_strings(shared)
+    return template, {"inline": make_estimate(str(folder / "inline.xlsx"), ROWS, 11), "shared": shared}
+
+
+@pytest.mark.parametrize("name", ["inline", "shared"])
+def test_deferred_output_identical(inputs, tmp_path, name):
+    template, source = inputs[0], inputs[1][name]
+    expected, result = str(tmp_path / "memory.xlsx"), str(tmp_path / "budget.xlsx")
+    KS2Processor(template, source, expected, listeners=[]).process()
+
+    processor = KS2Processor(template, source, result, listeners=[], memory_budget=1)
+    processor.process()
+    # Смета записывается несколькими частями
+    assert processor.stats["chunk_rows"] < ROWS
+    assert processor.stats["cells_copied"] > 0
+    assert compare_outputs(result, expected) == []
+
+
+def test_deferred_progress_and_cleanup(inputs, tmp_path):
+    """Прогресс вставки идет во время записи, лист сметы после записи освобождается"""
+    events = []
+    processor = KS2Processor(inputs[0], inputs[1]["inline"], str(tmp_path / "budget.xlsx"),
+                             listeners=[events.append], memory_budget=1)
+    processor.process()
+    progress = [event["done"] for event in events
+                if event.kind == INSERT_PROGRESS and event.get("phase") == "save"]
+    assert len(progress) > 2 and progress[-1] == ROWS and progress == sorted(progress)
+    assert all(table.source_sheet is None for table in processor.deferred.values())
+
+
+def test_chunk_rows():
+    assert chunk_rows(1, 11) == 46
+    assert chunk_rows(1, 10000) == 16
+    assert chunk_rows(64, 7) == 4681
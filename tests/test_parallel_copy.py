@@ -0,0 +1,99 @@
+"""Параллельное чтение таблицы сметы (copy_workers) дает тот же результат, что обычное"""
+from io import BytesIO
+import pytest
+from openpyxl.worksheet._reader import WorkSheetParser
+import parallel_copy
+from helpers import make_template, make_estimate, share_formulas, to_shared_strings
+from ks2_benchmark import compare_outputs
+from ks2_processor import KS2Processor
+from parallel_copy import ChunkedCellReader, split_sheet_blocks
+from source_reader import open_source_workbook, iter_source_cells
+
+
+ROWS = 300
+SHEET = "xl/worksheets/sheet1.xml"
+# Маленькие блоки: таблица режется на десятки блоков, общие формулы и объединения попадают на границы
+BLOCK_SIZE = 2048
+
+HEAD = (b'<?xml version="1.0" encoding="UTF-8"?><x:worksheet xmlns:x="http://schemas.openxmlformats.org/'
+        b'spreadsheetml/2006/main"><x:dimension ref="A1:B5"/><x:sheetData>')
+TAIL = b"</x:sheetData><x:pageMargins/></x:worksheet>"
+
+
+def sheet_xml(rows):
+    return HEAD + b"".join(rows) + TAIL
+
+
+def parse_rows(data):
+    return [(idx, [(cell["row"], cell["column"], cell["value"]) for cell in cells])
+            for idx, cells in WorkSheetParser(BytesIO(data), []).parse()]
+
+
+def test_split_sheet_blocks():
+    """Блоки с префиксами пространства имен разбираются и вместе дают все строки листа"""
+    rows = [b'<x:row r="%d"><x:c r="A%d"><x:v>%d</x:v></x:c></x:row>' % (idx, idx, idx) for idx in range(1, 40)]
+    data = sheet_xml(rows)
+    blocks = list(split_sheet_blocks(BytesIO(data), 128))
+    assert len(blocks) > 5
+    assert all(block.startswith(HEAD) and block.endswith(b"</x:sheetData></x:worksheet>") for block in blocks)
+    assert [row for block in blocks for row in parse_rows(block)] == parse_rows(data)
+
+
+def test_split_keeps_rows_without_numbers():
+    """Строка без номера остается в одном блоке с предыдущей: ее номер считается от нее"""
+    rows = []
+    for idx in range(1, 30):
+        rows.append(b'<x:row r="%d"><x:c r="A%d"><x:v>1</x:v></x:c></x:row>' % (idx * 2, idx * 2))
+        rows.append(b'<x:row><x:c><x:v>2</x:v></x:c></x:row>')
+    data = sheet_xml(rows)
+    blocks = list(split_sheet_blocks(BytesIO(data), 64))
+    assert len(blocks) > 5
+    assert all(block[len(HEAD):].startswith(b'<x:row r="') for block in blocks)
+    assert [row for block in blocks for row in parse_rows(block)] == parse_rows(data)
+
+
+def test_split_empty_sheet():
+    data = HEAD.replace(b"<x:sheetData>", b"<x:sheetData/>") + b"</x:worksheet>"
+    assert list(split_sheet_blocks(BytesIO(data))) == []
+
+
+@pytest.fixture(scope="module")
+def estimates(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("estimates")
+    template = make_template(str(folder / "template.xlsx"))
+    inline = make_estimate(str(folder / "inline.xlsx"), ROWS, 11)
+    shared = make_estimate(str(folder / "shared.xlsx"), ROWS, 7)
+    share_formulas(shared, SHEET, "G")
+    to_shared_strings(shared)
+    return template, {"inline": inline, "shared": shared}
+
+
+@pytest.mark.parametrize("name", ["inline", "shared"])
+def test_iter_cells_matches_serial(estimates, name):
+    """Те же ячейки и стили, что у iter_source_cells, в том числе при обрезке по строкам и столбцам"""
+    workbook = open_source_workbook(estimates[1][name])
+    reader = ChunkedCellReader(2, block_size=BLOCK_SIZE)
+    try:
+        sheet = workbook.active
+        for max_row, max_col in ((ROWS, 11), (137, 5)):
+            expected = list(iter_source_cells(sheet, max_row, max_col))
+            assert list(reader.iter_cells(sheet, max_row, max_col)) == expected
+    finally:
+        reader.close()
+        workbook.close()
+    assert reader.blocks > 10
+
+
+@pytest.mark.parametrize("name", ["inline", "shared"])
+def test_copy_workers_output_identical(estimates, tmp_path, monkeypatch, name):
+    """Результат с copy_workers совпадает с обычным байт в байт во всех частях архива"""
+    monkeypatch.setattr(parallel_copy, "PARALLEL_MIN_ROWS", 1)
+    template, source = estimates[0], estimates[1][name]
+    expected, result = str(tmp_path / "serial.xlsx"), str(tmp_path / "parallel.xlsx")
+    KS2Processor(template, source, expected, listeners=[]).process()
+
+    processor = KS2Processor(template, source, result, listeners=[], copy_workers=2)
+    processor.cell_reader.block_size = BLOCK_SIZE
+    processor.process()
+    assert processor.cell_reader.blocks > 10
+    assert compare_outputs(result, expected) == []
@@ -0,0 +1,149 @@
+"""Файл настроек: блокировка между процессами, атомарная замена, прежний формат и кэш по подписи файла"""
+import json
+import multiprocessing
+import os
+import pytest
+import path_manager
+from path_manager import ConfigError, PathManager, file_lock
+
+
+WRITERS = 4
+WRITES = 15
+
+
+def write_values(config_dir, number):
+    manager = PathManager(config_dir=config_dir)
+    for idx in range(WRITES):
+        manager.save_paths({f"процесс{number}_{idx}": idx})
+
+
+def read_file(manager):
+    with open(manager.config_file, encoding="utf-8") as f:
+        return json.loads(f.read())
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return PathManager(config_dir=str(tmp_path))
+
+
+def test_concurrent_writers_keep_all_changes(tmp_path):
+    """Изменения нескольких процессов не теряются: каждое делается под блокировкой по свежему файлу"""
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=write_values, args=(str(tmp_path), number))
+                 for number in range(WRITERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    values = PathManager(config_dir=str(tmp_path)).load_paths()
+    assert len(values) == WRITERS * WRITES
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_busy_lock(manager):
+    with file_lock(manager.lock_file):
+        with pytest.raises(ConfigError, match="занят другим процессом"):
+            with file_lock(manager.lock_file, timeout=0.2):
+                pass
+    # После освобождения блокировка берется сразу
+    manager.save_paths({"workers": 2})
+    assert manager.load_paths() == {"workers": 2}
+
+
+def test_replace_is_retried(manager, monkeypatch):
+    """Замена, которой мешает читатель (Windows), повторяется; файл не бывает записан наполовину"""
+    manager.save_paths({"engine": "openpyxl"})
+    replace = os.replace
+    failures = []
+
+    def busy_replace(src, dst):
+        if len(failures) < 3:
+            failures.append(dst)
+            raise PermissionError("файл открыт другим процессом")
+        replace(src, dst)
+
+    monkeypatch.setattr(path_manager.os, "replace", busy_replace)
+    monkeypatch.setattr(path_manager, "LOCK_RETRY", 0)
+    manager.save_paths({"engine": "splice"})
+    assert len(failures) == 3
+    assert read_file(manager)["profiles"]["default"] == {"engine": "splice"}
+
+
+def test_failed_replace_keeps_old_file(manager, monkeypatch):
+    manager.save_paths({"engine": "openpyxl"})
+
+    def busy_replace(src, dst):
+        raise PermissionError("файл открыт другим процессом")
+
+    monkeypatch.setattr(path_manager.os, "replace", busy_replace)
+    monkeypatch.setattr(path_manager, "LOCK_RETRY", 0)
+    with pytest.raises(PermissionError):
+        manager.save_paths({"engine": "splice"})
+    assert read_file(manager)["profiles"]["default"] == {"engine": "openpyxl"}
+    assert not [name for name in os.listdir(manager.config_dir) if name.endswith(".tmp")]
+
+
+def test_legacy_format_upgrade(manager):
+    """Плоский словарь прежнего формата читается как профиль default и сохраняется в новом формате"""
+    with open(manager.config_file, "w", encoding="utf-8") as f:
+        json.dump({"ks2_template": "КС-2.xlsx", "source": "смета.xlsx"}, f)
+    assert manager.profiles() == ["default"]
+    assert manager.load_paths() == {"ks2_template": "КС-2.xlsx", "source": "смета.xlsx"}
+
+    manager.save_paths({"workers": 4}, profile="объект-1")
+    data = read_file(manager)
+    assert data["version"] == path_manager.CONFIG_VERSION
+    assert data["profiles"] == {"default": {"ks2_template": "КС-2.xlsx", "source": "смета.xlsx"},
+                                "объект-1": {"workers": 4}}
+
+
+def test_cache_reread_only_when_file_changes(manager, monkeypatch):
+    manager.save_paths({"engine": "splice"})
+    loads = []
+    load = json.load
+    monkeypatch.setattr(path_manager.json, "load", lambda f: loads.append(1) or load(f))
+
+    other = PathManager(config_dir=manager.config_dir)
+    assert other.load_paths() == {"engine": "splice"}
+    assert other.load_paths() == manager.load_paths()
+    assert loads == []
+
+    # Другой процесс заменил файл: подпись изменилась, файл перечитывается
+    data = read_file(manager)
+    data["profiles"]["default"]["engine"] = "openpyxl"
+    with open(manager.config_file + ".new", "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(manager.config_file + ".new", manager.config_file)
+    assert manager.load_paths() == {"engine": "openpyxl"}
+    assert loads == [1]
+    # Результат чтения — копия: ее изменение не портит кэш
+    manager.load_paths()["engine"] = "испорчено"
+    assert manager.load_paths() == {"engine": "openpyxl"}
+
+
+def test_corrupted_file(manager):
+    with open(manager.config_file, "w", encoding="utf-8") as f:
+        f.write("{не JSON")
+    with pytest.raises(ConfigError, match="Не удалось прочитать настройки"):
+        manager.load_paths()
+    # Запись начинает настройки заново, поврежденный файл остается рядом
+    manager.save_paths({"workers": 2})
+    assert manager.load_paths() == {"workers": 2}
+    assert os.path.exists(manager.config_file + ".bad")
+
+
+def test_profiles(manager):
+    manager.save_paths({"ks2_template": "КС-2.xlsx", "workers": 4, "source": "смета.xlsx"}, "объект-1")
+    manager.set_active("объект-1")
+    assert PathManager(config_dir=manager.config_dir).active_profile() == "объект-1"
+    assert manager.profile_defaults("объект-1") == {"template": "КС-2.xlsx", "workers": 4}
+    manager.save_paths({"workers": None})
+    assert manager.load_paths() == {"ks2_template": "КС-2.xlsx", "source": "смета.xlsx"}
+
+    assert manager.delete_profile("объект-1") and not manager.delete_profile("объект-1")
+    assert manager.active_profile() == "default"
+    with pytest.raises(ConfigError, match="не найден"):
+        manager.profile_defaults("объект-1")
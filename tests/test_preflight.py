@@ -0,0 +1,104 @@
+"""Предварительная проверка файлов и план вставки без загрузки книг"""
+import pytest
+from openpyxl import Workbook, load_workbook
+from helpers import TEMPLATE_TITLE, make_template, make_estimate, rewrite_parts
+import ks2_preflight
+from ks2_preflight import PreflightError, preflight, check_output, plan_summary
+from ks2_processor import KS2Processor
+
+
+@pytest.fixture(scope="module")
+def inputs(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("preflight")
+    return (make_template(str(folder / "template.xlsx")),
+            make_estimate(str(folder / "narrow.xlsx"), 40, 7),
+            make_estimate(str(folder / "wide.xlsx"), 40, 11))
+
+
+def test_plan_without_header_shift(inputs):
+    template, narrow, _ = inputs
+    plan = preflight(template, narrow)
+    assert (plan["template_sheet"], plan["source_sheet"]) == (TEMPLATE_TITLE, "Смета")
+    assert (plan["rows"], plan["cols"], plan["start_row"]) == (40, 7, 20)
+    assert plan["header_shift"] == 0 and plan["moved_ranges"] == []
+    assert plan_summary(plan) == "смета ≈40 × 7, шапка без сдвига"
+
+
+def test_plan_matches_processing(inputs, tmp_path):
+    """Точный план совпадает с тем, что делает обработка"""
+    template, _, wide = inputs
+    plan = preflight(template, wide, exact=True)
+    assert plan["exact"] and plan["header_shift"] == 3
+    assert plan["moved_ranges"] == [("G1:H18", "D1:E18"), ("E12:F18", "B12:C18")]
+
+    processor = KS2Processor(template, wide, str(tmp_path / "act.xlsx"), listeners=[])
+    processor.process()
+    assert (processor.stats["source_rows"], processor.stats["source_cols"]) == (plan["rows"], plan["cols"])
+    assert processor.stats["header_shift"] == plan["header_shift"]
+
+
+def test_missing_dimension(inputs, tmp_path):
+    """Без тега размера план строится, размер определится при обработке"""
+    source = str(tmp_path / "estimate.xlsx")
+    with open(inputs[1], "rb") as src, open(source, "wb") as dst:
+        dst.write(src.read())
+    rewrite_parts(source, lambda name, text: text.replace('<dimension ref="A1:G40" />', "")
+                  if name == "xl/worksheets/sheet1.xml" else text)
+    plan = preflight(inputs[0], source)
+    assert plan["rows"] is None and plan["header_shift"] is None
+    assert preflight(inputs[0], source, exact=True)["rows"] == 40
+
+
+@pytest.mark.parametrize("case, message", [
+    ("missing", "Файл сметы не найден"),
+    ("xls", "в формате .xls"),
+    ("not-zip", "не является книгой Excel .xlsx"),
+    ("no-workbook", "нет книги Excel"),
+    ("chartsheet-active", "не является обычным листом"),
+])
+def test_source_rejected(inputs, tmp_path, case, message):
+    source = str(tmp_path / "estimate.xlsx")
+    if case == "xls":
+        source = str(tmp_path / "estimate.xls")
+        open(source, "wb").close()
+    elif case == "not-zip":
+        with open(source, "w", encoding="utf-8") as f:
+            f.write("не архив")
+    elif case == "no-workbook":
+        rewrite_parts(make_estimate(source, 5), lambda name, text: text.replace(
+            'Target="xl/workbook.xml"', 'Target="xl/missing.xml"') if name == "_rels/.rels" else text)
+    elif case == "chartsheet-active":
+        wb = Workbook()
+        wb.create_chartsheet("Диаграмма")
+        wb.active = 1
+        wb.save(source)
+    with pytest.raises(PreflightError, match=message):
+        preflight(inputs[0], source)
+
+
+def test_template_without_ks2_sheet(inputs, tmp_path):
+    template = str(tmp_path / "template.xlsx")
+    wb = load_workbook(inputs[0])
+    wb[TEMPLATE_TITLE].title = "Акт"
+    wb.save(template)
+    with pytest.raises(PreflightError, match="Не найден лист, начинающийся с 'КС-2'"):
+        preflight(template, inputs[1])
+
+
+def test_output_rejected(inputs, tmp_path):
+    template, source, _ = inputs
+    with pytest.raises(PreflightError, match="поверх входного файла"):
+        preflight(template, source, source)
+    with pytest.raises(PreflightError, match="не существует"):
+        check_output(str(tmp_path / "нет" / "act.xlsx"))
+    assert check_output(str(tmp_path / "нет" / "act.xlsx"), makedirs=True)
+    with pytest.raises(PreflightError, match="указывает на папку"):
+        check_output(str(tmp_path))
+
+
+def test_main(inputs, capsys):
+    template, _, wide = inputs
+    assert ks2_preflight.main([template, wide]) == 0
+    assert "D1:E18" in capsys.readouterr().out
+    assert ks2_preflight.main([template, template + ".нет"]) == 1
+    assert "❌ Файл сметы не найден" in capsys.readouterr().out
@@ -0,0 +1,85 @@
+"""Сервис обработки: задания, перезапуск пула после аварии рабочего процесса"""
+import os
+import signal
+import time
+import pytest
+from helpers import make_template, make_estimate
+from ks2_service import KS2Service, ServiceError, DONE, ERROR, RUNNING, FINISHED, warm_up
+
+
+TIMEOUT = 60
+
+
+@pytest.fixture(scope="module")
+def inputs(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("service")
+    return (make_template(str(folder / "template.xlsx")),
+            make_estimate(str(folder / "small.xlsx"), 20),
+            make_estimate(str(folder / "large.xlsx"), 3000))
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = KS2Service(work_dir=str(tmp_path / "jobs"), workers=1, use_template_cache=False)
+    yield service
+    service.close()
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline, "истекло время ожидания"
+        time.sleep(0.05)
+
+
+def wait_finished(service, job_id):
+    wait_for(lambda: service.describe(job_id)["status"] in FINISHED)
+    return service.describe(job_id)
+
+
+def test_job_done(service, inputs):
+    template, small, _ = inputs
+    job = service.submit({"template": template, "source": small, "name": "акт.xlsx"})
+    assert wait_finished(service, job["id"])["status"] == DONE
+    assert os.path.basename(service.result_path(job["id"])) == "акт.xlsx"
+    with pytest.raises(ServiceError) as error:
+        service.submit({"template": template, "source": small + ".нет"})
+    assert error.value.status == 400
+
+
+def test_pool_restarts_after_worker_crash(service, inputs):
+    """Задание упавшего процесса завершается ошибкой, health сообщает о поломке, следующее задание идет в новый пул"""
+    template, small, large = inputs
+    pid = service.executor.submit(warm_up).result()
+    job = service.submit({"template": template, "source": large})
+    wait_for(lambda: service.describe(job["id"])["status"] == RUNNING)
+    os.kill(pid, signal.SIGKILL)
+
+    assert wait_finished(service, job["id"])["status"] == ERROR
+    health = service.health()
+    assert health["status"] == "broken" and health["pool_error"]
+    # Отмена завершенного задания — обычная ошибка 409, а не KeyError
+    with pytest.raises(ServiceError) as error:
+        service.cancel(job["id"])
+    assert error.value.status == 409
+
+    job = service.submit({"template": template, "source": small})
+    assert wait_finished(service, job["id"])["status"] == DONE
+    health = service.health()
+    assert (health["status"], health["pool_restarts"], health["queued"]) == ("ok", 1, 0)
+
+
+def test_idle_worker_crash_is_recovered_on_submit(service, inputs):
+    """Упавший без заданий процесс замечается при постановке задания, задание не теряется"""
+    template, small, _ = inputs
+    os.kill(service.executor.submit(warm_up).result(), signal.SIGKILL)
+    job = service.submit({"template": template, "source": small})
+    status = wait_finished(service, job["id"])["status"]
+    if status == ERROR:
+        # Пул сломался уже после того, как принял задание: его ошибка записана, пул перезапустится
+        assert service.health()["status"] == "broken"
+        job = service.submit({"template": template, "source": small})
+        status = wait_finished(service, job["id"])["status"]
+    assert status == DONE
+    assert service.health()["pool_restarts"] == 1
+    assert all("future" in item for item in service.jobs.values())
@@ -0,0 +1,99 @@
+"""Вставка правкой XML (KS2SpliceProcessor) дает ту же книгу, что обычная обработка"""
+from zipfile import ZipFile
+import pytest
+from openpyxl import load_workbook
+from openpyxl.cell.rich_text import CellRichText
+from openpyxl.utils import get_column_letter
+from helpers import (TEMPLATE_TITLE, FOOTER_ROWS, make_template, make_estimate, share_formulas,
+                     to_shared_strings, snapshot)
+from ks2_processor import KS2Processor
+from ks2_splice import KS2SpliceProcessor
+
+
+ROWS = 60
+SHEET = "xl/worksheets/sheet1.xml"
+# Смета: (столбцов, общие строки вместо встроенных)
+ESTIMATES = {"wide-inline": (11, False), "narrow-shared": (7, True)}
+
+
+@pytest.fixture(scope="module")
+def inputs(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("inputs")
+    paths = {}
+    for shared in (False, True):
+        path = make_template(str(folder / f"template-{shared}.xlsx"))
+        share_formulas(path, SHEET, "K")
+        if shared:
+            to_shared_strings(path)
+        paths["template", shared] = path
+    for name, (cols, shared) in ESTIMATES.items():
+        path = make_estimate(str(folder / f"{name}.xlsx"), ROWS, cols)
+        share_formulas(path, SHEET, "G")
+        if shared:
+            to_shared_strings(path)
+        paths[name] = path
+    return paths
+
+
+def process_both(inputs, tmp_path, template_strings, estimate):
+    template, source = inputs["template", template_strings], inputs[estimate]
+    expected, result = str(tmp_path / "openpyxl.xlsx"), str(tmp_path / "splice.xlsx")
+    KS2Processor(template, source, expected, listeners=[]).process()
+    processor = KS2SpliceProcessor(template, source, result, listeners=[])
+    processor.process()
+    assert processor.stats["engine"] == "splice"
+    return expected, result
+
+
+@pytest.mark.parametrize("estimate", sorted(ESTIMATES))
+@pytest.mark.parametrize("template_strings", [False, True], ids=["inline-template", "shared-template"])
+def test_splice_matches_openpyxl(inputs, tmp_path, template_strings, estimate):
+    expected, result = process_both(inputs, tmp_path, template_strings, estimate)
+    assert snapshot(result) == snapshot(expected)
+
+
+@pytest.mark.parametrize("estimate", sorted(ESTIMATES))
+def test_splice_rewrites_references(inputs, tmp_path, estimate):
+    """Ссылки на сдвинутые строки и перенесенную шапку пересчитаны (а не одинаково пропущены обоими)"""
+    _, result = process_both(inputs, tmp_path, False, estimate)
+    cols = ESTIMATES[estimate][0]
+    shift = max(cols - 8, 0)
+    total_row = 20 + FOOTER_ROWS + ROWS
+    # Столбец H шапки после переноса влево
+    header = get_column_letter(8 - shift)
+
+    wb = load_workbook(result)
+    ks2, other = wb[TEMPLATE_TITLE], wb["Справка"]
+    assert ks2[f"J{total_row}"].value == f"=SUM(J{20 + ROWS}:J{total_row - 1})"
+    # Общая формула подвала раскрыта и сдвинута
+    assert ks2[f"K{21 + ROWS}"].value == f"=J{21 + ROWS}*2"
+    # Общая формула сметы (строка 7) сдвинута вместе с таблицей
+    assert ks2["G26"].value == "=E26*F26"
+    assert other["A1"].value == f"='{TEMPLATE_TITLE}'!J{total_row}"
+    assert other["A2"].value == f"=SUM('{TEMPLATE_TITLE}'!J{20 + ROWS}:J{total_row - 1})"
+    assert other["A3"].value == f"='{TEMPLATE_TITLE}'!{header}5"
+    assert ks2["A5"].value == f"={header}5+1"
+    assert ks2[f"{header}3"].value == f"={header}2*2"
+    assert wb.defined_names["Итого"].attr_text == f"'{TEMPLATE_TITLE}'!$J${total_row}"
+    assert ks2.print_area == f"'{TEMPLATE_TITLE}'!$A$1:$K${total_row}"
+
+
+def test_splice_keeps_rich_text(inputs, tmp_path):
+    """Форматирование частей текста сметы и шаблона сохраняется (обычная обработка его теряет)"""
+    _, result = process_both(inputs, tmp_path, True, "narrow-shared")
+    ks2 = load_workbook(result, rich_text=True)[TEMPLATE_TITLE]
+    assert isinstance(ks2["C26"].value, CellRichText)
+    assert str(ks2["C26"].value) == "Работа 7 (доп.)"
+    assert isinstance(ks2[f"B{22 + ROWS}"].value, CellRichText)
+
+
+def test_splice_template_without_shared_strings(inputs, tmp_path):
+    """У шаблона без sharedStrings.xml таблица общих строк появляется и подключается к книге"""
+    with ZipFile(inputs["template", False]) as archive:
+        assert "xl/sharedStrings.xml" not in archive.namelist()
+    _, result = process_both(inputs, tmp_path, False, "narrow-shared")
+    with ZipFile(result) as archive:
+        strings = [name for name in archive.namelist() if name.endswith("sharedStrings.xml")]
+        assert strings
+        assert "sharedStrings" in archive.read("xl/_rels/workbook.xml.rels").decode("utf-8")
+        assert "sharedStrings" in archive.read("[Content_Types].xml").decode("utf-8")
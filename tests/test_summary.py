@@ -0,0 +1,159 @@
+"""Итоги сметы: суммы, разделы, проверка «количество × цена = стоимость» и сбор столбцов при поиске границ"""
+import zipfile
+import numpy as np
+import pytest
+from openpyxl import Workbook, load_workbook
+from helpers import TEMPLATE_TITLE, make_template, to_shared_strings
+import ks2_summary
+from ks2_summary import (column_scanner, normalize_config, read_columns, summarize_columns,
+                         summarize_stream)
+from ks2_splice import ENGINES
+from table_dimensions import scan_sheet_xml_bounds
+
+
+SHEET = "xl/worksheets/sheet1.xml"
+CONFIG = {"columns": {"quantity": "E", "price": "F", "cost": "G"},
+          "section": {"column": "C", "prefix": "Раздел"},
+          "cells": {"total": "C21", "mismatches": "C22", "section:2": "C23", "rows": "I1"}}
+# Строки сметы: (наименование, количество, цена, стоимость)
+ROWS = [
+    ("Раздел 1. Земляные работы", None, None, None),
+    ("Разработка грунта", 2, 10.5, 21),
+    ("Вывоз грунта", 3, 4, 12.5),                 # расхождение
+    ("Обратная засыпка", 1.5, 2, "3,00"),          # стоимость текстом
+    ("  раздел 2. Фундаменты", None, None, None),  # регистр и пробелы не важны
+    ("Бетон", 10, 1234.5, "12 345,00"),
+    ("Арматура", None, None, 700),                 # без количества и цены не проверяется
+    ("Опалубка", 4, 25, 99),                       # расхождение
+    ("Итого по смете", None, None, None),
+]
+
+
+@pytest.fixture(scope="module")
+def estimate(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("summary") / "estimate.xlsx")
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Смета"
+    for row, (name, quantity, price, cost) in enumerate(ROWS, start=1):
+        ws.cell(row, 1, row)
+        for col, value in ((3, name), (5, quantity), (6, price), (7, cost)):
+            if value is not None:
+                ws.cell(row, col, value)
+    wb.save(path)
+    return path
+
+
+def expected_metrics():
+    return {"rows": 6, "total": 21 + 12.5 + 3 + 12345 + 700 + 99,
+            "computed_total": 21 + 12 + 3 + 12345 + 100, "checked": 5, "mismatches": 2,
+            "first_mismatch": 20 + 2, "sections": 2}
+
+
+def summarize(path, export=False):
+    config = normalize_config(CONFIG)
+    with zipfile.ZipFile(path) as archive, archive.open(SHEET) as source:
+        return summarize_stream(source, config, len(ROWS), 7, export=export)
+
+
+def test_totals_and_mismatches(estimate):
+    summary = summarize(estimate)
+    metrics = summary.metrics
+    expected = expected_metrics()
+    assert metrics.pop("difference") == pytest.approx(expected["total"] - expected["computed_total"])
+    assert metrics == pytest.approx(expected)
+    assert summary.sections == [("Раздел 1. Земляные работы", 36.5, 20),
+                                ("раздел 2. Фундаменты", 13144.0, 24)]
+
+
+def test_cells_below_insert_row_move_with_footer(estimate):
+    cells = summarize(estimate).cells()
+    rows = len(ROWS)
+    assert sorted(cells) == sorted([(21 + rows, 3, expected_metrics()["total"]), (22 + rows, 3, 2),
+                                    (23 + rows, 3, 13144.0), (1, 9, 6)])
+
+
+def test_tolerance(estimate):
+    config = normalize_config(dict(CONFIG, tolerance=0.9))
+    with zipfile.ZipFile(estimate) as archive, archive.open(SHEET) as source:
+        summary = summarize_stream(source, config, len(ROWS), 7)
+    assert summary.metrics["mismatches"] == 1
+
+
+def test_shared_strings(estimate, tmp_path):
+    """Текст общими строками (как в книгах Excel) дает те же итоги"""
+    path = tmp_path / "shared.xlsx"
+    path.write_bytes(open(estimate, "rb").read())
+    to_shared_strings(str(path))
+    with zipfile.ZipFile(path) as archive:
+        assert b't="s"' in archive.read(SHEET)
+    wb = load_workbook(path, read_only=True)
+    try:
+        summary = ks2_summary.summarize_sheet(wb.active, normalize_config(CONFIG), len(ROWS), 7)
+    finally:
+        wb.close()
+    assert summary.metrics == summarize(estimate).metrics
+    assert summary.sections == summarize(estimate).sections
+
+
+@pytest.mark.parametrize("export", [False, True])
+def test_scanner_matches_separate_read(estimate, export):
+    """Столбцы, собранные при поиске границ таблицы, те же, что при отдельном чтении листа"""
+    config = normalize_config(dict(CONFIG, export="{name}.npz" if export else None))
+    scanner = column_scanner(config)
+    with zipfile.ZipFile(estimate) as archive:
+        with archive.open(SHEET) as source:
+            rows, cols = scan_sheet_xml_bounds(source, columns=scanner)
+        with archive.open(SHEET) as source:
+            separate = read_columns(source, ks2_summary.EstimateSummary(config, rows, cols)
+                                    .wanted_columns(export), rows)
+    assert scanner.complete and (rows, cols) == (len(ROWS), 7)
+
+    scanned = summarize_columns(scanner.columns(rows), config, rows, cols, export=export)
+    assert scanned.metrics == summarize(estimate).metrics
+    for name, array in scanned.export_arrays().items() if export else ():
+        expected = ks2_summary.EstimateSummary(config, rows, cols).load(separate, export).export_arrays()[name]
+        np.testing.assert_array_equal(array, expected)
+
+
+def test_incomplete_scan_is_not_used(estimate):
+    """Если просмотр листа не дошел до конца, итоги читают лист заново"""
+    config = normalize_config(CONFIG)
+    scanner = column_scanner(config)
+    wb = load_workbook(estimate, read_only=True)
+    try:
+        summary = ks2_summary.summarize_sheet(wb.active, config, len(ROWS), 7, scanner=scanner)
+    finally:
+        wb.close()
+    assert not scanner.complete
+    assert summary.metrics == summarize(estimate).metrics
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_processing_writes_summary(estimate, tmp_path, engine):
+    template = make_template(str(tmp_path / "template.xlsx"))
+    output = str(tmp_path / "act.xlsx")
+    processor = ENGINES[engine](template, estimate, output, listeners=[], summary=normalize_config(CONFIG))
+    processor.process()
+    # Столбцы собраны в проходе поиска границ таблицы, лист не читался второй раз
+    assert processor.summary_scanner.complete
+    assert processor.stats["summary"]["mismatches"] == 2
+
+    ws = load_workbook(output)[TEMPLATE_TITLE]
+    rows = len(ROWS)
+    assert ws.cell(21 + rows, 3).value == pytest.approx(expected_metrics()["total"])
+    assert (ws.cell(22 + rows, 3).value, ws.cell(23 + rows, 3).value, ws["I1"].value) == (2, 13144, 6)
+
+
+@pytest.mark.parametrize("data, message", [
+    ({"columns": {"quantity": "E"}}, "не указан столбец стоимости"),
+    ({"columns": {"cost": "G", "weight": "H"}}, "неизвестные столбцы weight"),
+    ({"columns": {"cost": "7"}}, "неверное обозначение столбца"),
+    ({"columns": {"cost": "G"}, "section": {"prefix": "Раздел"}}, "section.column"),
+    ({"columns": {"cost": "G"}, "cells": {"average": "G21"}}, "неизвестное значение 'average'"),
+    ({"columns": {"cost": "G"}, "cells": {"total": "21G"}}, "неверный адрес ячейки"),
+    ({"columns": {"cost": "G"}, "export": "итоги.xlsx"}, "не поддерживается"),
+])
+def test_config_rejected(data, message):
+    with pytest.raises(ValueError, match=message):
+        normalize_config(data)
@@ -0,0 +1,95 @@
+"""Кэш разобранных шаблонов: копии из снимка, вытеснение, снимки на диске"""
+import os
+from openpyxl import load_workbook
+from openpyxl.worksheet.table import Table
+from helpers import TEMPLATE_TITLE, make_template
+import template_cache
+from template_cache import TemplateCache
+
+
+def make_template_with_table(path):
+    make_template(path)
+    wb = load_workbook(path)
+    # Заголовки таблицы — строки
+    wb[TEMPLATE_TITLE]["H1"] = "Значение"
+    wb[TEMPLATE_TITLE].add_table(Table(displayName="Реквизиты", ref="G1:H18"))
+    wb.save(path)
+    return path
+
+
+def test_load_restores_tables(tmp_path):
+    """Таблицы листа восстанавливаются из снимка таблицами, а не адресами"""
+    template = make_template_with_table(str(tmp_path / "template.xlsx"))
+    cache = TemplateCache(disk_dir=str(tmp_path / "cache"))
+    # Из снимка в памяти, из него же повторно и из снимка на диске
+    restored = [cache.load(template), cache.load(template),
+                TemplateCache(disk_dir=str(tmp_path / "cache")).load(template)]
+    for loaded in restored:
+        tables = loaded[TEMPLATE_TITLE].tables
+        assert list(tables) == ["Реквизиты"]
+        assert all(isinstance(table, Table) for table in tables.values())
+        assert tables["Реквизиты"].ref == "G1:H18"
+
+
+def test_load_returns_independent_copies(tmp_path):
+    template = make_template(str(tmp_path / "template.xlsx"))
+    cache = TemplateCache()
+    first = cache.load(template)
+    first[TEMPLATE_TITLE]["A1"] = "изменено"
+    second = cache.load(template)
+    assert second[TEMPLATE_TITLE]["A1"].value is None
+    assert second[TEMPLATE_TITLE]["H3"].value == "=H2*2"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_changed_template_is_reloaded(tmp_path):
+    template = make_template(str(tmp_path / "template.xlsx"))
+    cache = TemplateCache()
+    cache.load(template)
+    wb = load_workbook(template)
+    wb[TEMPLATE_TITLE]["A1"] = "новая редакция"
+    wb.save(template)
+    assert cache.load(template)[TEMPLATE_TITLE]["A1"].value == "новая редакция"
+    assert cache.misses == 2
+
+
+def test_eviction_by_entries(tmp_path):
+    paths = [make_template(str(tmp_path / f"template-{idx}.xlsx")) for idx in range(3)]
+    # Разное содержимое — разные хэши
+    for idx, path in enumerate(paths):
+        wb = load_workbook(path)
+        wb[TEMPLATE_TITLE]["A1"] = idx
+        wb.save(path)
+    cache = TemplateCache(max_entries=2)
+    for path in paths:
+        cache.load(path)
+    assert len(cache) == 2
+    cache.load(paths[2])
+    cache.load(paths[0])
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_eviction_by_size(tmp_path):
+    template = make_template(str(tmp_path / "template.xlsx"))
+    cache = TemplateCache(max_bytes=1)
+    cache.load(template)
+    assert len(cache) == 0
+    assert cache.load(template)[TEMPLATE_TITLE].title == TEMPLATE_TITLE
+    assert cache.misses == 2
+
+
+def test_disk_snapshot_reused(tmp_path, monkeypatch):
+    """Новый кэш с той же папкой берет снимок с диска, не разбирая книгу"""
+    template = make_template(str(tmp_path / "template.xlsx"))
+    disk_dir = str(tmp_path / "cache")
+    TemplateCache(disk_dir=disk_dir).load(template)
+    snapshots = os.listdir(disk_dir)
+    assert len(snapshots) == 1 and snapshots[0].endswith(".pickle")
+
+    def fail(path):
+        raise AssertionError(f"шаблон разобран повторно: {path}")
+
+    monkeypatch.setattr(template_cache, "load_workbook", fail)
+    cache = TemplateCache(disk_dir=disk_dir)
+    assert cache.load(template)[TEMPLATE_TITLE]["H3"].value == "=H2*2"
+    assert os.listdir(disk_dir) == snapshots
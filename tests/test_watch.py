@@ -0,0 +1,125 @@
+"""Наблюдение за папками: ожидание дописанных файлов, разовый проход --once, файл правил"""
+import json
+import os
+import pytest
+from helpers import make_template, make_estimate
+import ks2_watch
+from ks2_watch import Debouncer, TemplateRules, WatchDaemon, load_rules
+
+
+class Clock:
+    """Управляемое время для Debouncer"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ks2_watch.time, "monotonic", clock)
+    return clock
+
+
+def test_debouncer_waits_until_file_settles(tmp_path, clock):
+    path = str(tmp_path / "смета.xlsx")
+    with open(path, "wb") as f:
+        f.write(b"1")
+    debouncer = Debouncer(settle=2)
+    debouncer.touch(path)
+    clock.now += 1
+    assert debouncer.ready() == []
+
+    # Файл дописывается: отсчет начинается заново
+    with open(path, "ab") as f:
+        f.write(b"23")
+    clock.now += 1.5
+    assert debouncer.ready() == [] and len(debouncer) == 1
+    clock.now += 1.5
+    assert debouncer.ready() == []
+    clock.now += 0.5
+    assert debouncer.ready() == [path] and len(debouncer) == 0
+
+
+def test_debouncer_forgets_deleted_files(tmp_path, clock):
+    path = str(tmp_path / "смета.xlsx")
+    open(path, "wb").close()
+    debouncer = Debouncer(settle=2)
+    debouncer.touch(path)
+    os.remove(path)
+    clock.now += 3
+    assert debouncer.ready() == [] and len(debouncer) == 0
+
+
+@pytest.fixture
+def folders(tmp_path):
+    watched, output = tmp_path / "сметы", tmp_path / "акты"
+    (watched / "Объект1").mkdir(parents=True)
+    template = make_template(str(tmp_path / "template.xlsx"))
+    make_estimate(str(watched / "Объект1" / "смета.xlsx"), 12)
+    # Временный файл Excel и недописанная книга
+    (watched / "~$смета.xlsx").write_bytes(b"")
+    (watched / "битая.xlsx").write_bytes(b"PK\3\4")
+    return str(watched), str(output), template
+
+
+def make_daemon(folders, tmp_path, rules):
+    watched, output, _ = folders
+    return WatchDaemon([watched], rules, output, workers=1, settle=0, poll_interval=0.1,
+                       state_path=str(tmp_path / "state.jsonl"),
+                       build_cache_path=str(tmp_path / "build.json"), use_template_cache=False)
+
+
+def test_once_processes_existing_files(folders, tmp_path):
+    """--once: лежащие сметы обрабатываются, битые отклоняются, при повторе акт актуален"""
+    watched, output, template = folders
+    stats = make_daemon(folders, tmp_path, TemplateRules([("Объект1/*", template)])).run(once=True)
+    assert stats == {"ok": 1, "error": 0, "rejected": 1, "up_to_date": 0}
+    assert os.path.exists(os.path.join(output, "Объект1", "смета_КС-2.xlsx"))
+    with open(tmp_path / "state.jsonl", encoding="utf-8") as f:
+        statuses = sorted(json.loads(line)["status"] for line in f)
+    assert statuses == ["ok", "rejected"]
+
+    stats = make_daemon(folders, tmp_path, TemplateRules([("Объект1/*", template)])).run(once=True)
+    assert (stats["ok"], stats["up_to_date"]) == (0, 1)
+
+
+def test_template_rules(tmp_path):
+    rules = TemplateRules([("Объект1/*", "a.xlsx"), ("*ремонт*", "b.xlsx")], default="c.xlsx")
+    assert rules.match(os.path.join("Объект1", "смета.xlsx")) == "a.xlsx"
+    assert rules.match(os.path.join("Объект2", "Ремонт кровли.xlsx")) == "b.xlsx"
+    assert rules.match("смета.xlsx") == "c.xlsx"
+
+
+@pytest.mark.parametrize("content, message", [
+    ('{"pattern": "*", "template": "a.xlsx"}', "нужен JSON-список"),
+    ('["*=a.xlsx"]', "Правило 1: нужен объект"),
+    ('[{"pattern": "*", "template": "a.xlsx"}, {"pattern": "*"}]', "Правило 2: поля pattern и template"),
+    ('[{"pattern": "", "template": "a.xlsx"}]', "Правило 1: нужны поля"),
+])
+def test_load_rules_rejects_malformed(tmp_path, content, message):
+    path = tmp_path / "rules.json"
+    path.write_text(content, encoding="utf-8")
+    with pytest.raises(ValueError, match=message):
+        load_rules(str(path))
+
+
+def test_load_rules_relative_to_file(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text('[{"pattern": "*", "template": "шаблоны/a.xlsx"}]', encoding="utf-8")
+    assert load_rules(str(path)) == [("*", str(tmp_path / "шаблоны" / "a.xlsx"))]
+
+
+@pytest.mark.parametrize("content", [None, "не JSON", '["*=a.xlsx"]'])
+def test_main_reports_bad_rules(tmp_path, capsys, content):
+    """Ошибка в файле правил — сообщение argparse, а не трассировка"""
+    path = tmp_path / "rules.json"
+    if content is not None:
+        path.write_text(content, encoding="utf-8")
+    with pytest.raises(SystemExit) as exit_info:
+        ks2_watch.main([str(tmp_path), "--output-dir", str(tmp_path / "акты"), "--rules", str(path)])
+    assert exit_info.value.code == 2
+    assert "error:" in capsys.readouterr().err